@@ -1,150 +1,93 @@
 from flask import Flask, request, render_template, redirect, url_for, jsonify
 from flask_cors import CORS
-import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
+import base64
+import binascii
+import functools
+import hmac
 import json
+import os
+
+import applicants
+import blobstore
+import bulk
+import compress
+import db
+import domains
+import eligibility
+import facets
+import groupcommit
+import ingest
+import jsonstream
+import maintenance
+import metrics
+import profiling
+import respcache
+import resumable
+import search
+import versions
+from db import get_db
+from fileserve import serve_file
+from migrations import (APPLICATION_MIGRATIONS, MAIN_MIGRATIONS, SPONSORSHIP_MIGRATIONS, STUDENT_MIGRATIONS,
+                        migrate)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+app.after_request(compress.compress_response)
+db.init_app(app)
+# Study content. Sponsorship and application data have their own files next
+# to it, so their writers never wait on each other (see domains.py)
 DATABASE = 'teacher_profiles.db'
+SPONSOR_DATABASE, APPLICATIONS_DATABASE = domains.paths(DATABASE)
 STUDENT_DATABASE = 'student_profiles.db'
+# Admin routes need this in X-Admin-Token (or as a Bearer token); without it
+# they only answer localhost, and in production mode nobody
+ADMIN_TOKEN = os.environ.get('EDVANCE_ADMIN_TOKEN')
+PRODUCTION = os.environ.get('EDVANCE_SERVER_MODE') == 'production'
+# Set by a reverse proxy, whose requests all come from localhost
+PROXY_HEADERS = ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')
+if PRODUCTION and not ADMIN_TOKEN:
+    print("Warning: EDVANCE_ADMIN_TOKEN is not set; admin routes are disabled")
+# Every process of the server reports its metrics here (see metrics.py)
+METRICS_DIR = os.environ.get('EDVANCE_METRICS_DIR', DATABASE + '-metrics')
+metrics.init_app(app, METRICS_DIR)
 
-# Initialize DB and create table if not exists
-def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS teacher_profile (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            qualification TEXT NOT NULL,
-            teaching_where TEXT NOT NULL,
-            since_when TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Bring the databases up to the current schema; a no-op on warm start
+migrate(DATABASE, MAIN_MIGRATIONS)
+migrate(SPONSOR_DATABASE, SPONSORSHIP_MIGRATIONS)
+migrate(APPLICATIONS_DATABASE, APPLICATION_MIGRATIONS)
+migrate(STUDENT_DATABASE, STUDENT_MIGRATIONS)
+# Application queries join scholarships and sponsors
+db.attach(APPLICATIONS_DATABASE, sponsorship=SPONSOR_DATABASE)
 
-def init_student_db():
-    conn = sqlite3.connect(STUDENT_DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS student_profile (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            personal_data TEXT NOT NULL,
-            academic_data TEXT NOT NULL,
-            residential_data TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def is_admin():
+    if ADMIN_TOKEN:
+        token = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+        return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+    if PRODUCTION or any(name in request.headers for name in PROXY_HEADERS):
+        return False
+    return request.remote_addr in ('127.0.0.1', '::1')
 
-def init_notes_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS uploaded_notes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            standard TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            file_path TEXT NOT NULL,
-            file_name TEXT NOT NULL,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            return jsonify({'success': False, 'message': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
-def init_videos_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS uploaded_videos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            standard TEXT NOT NULL,
-            subject TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            video_type TEXT NOT NULL,
-            file_path TEXT,
-            video_url TEXT,
-            file_name TEXT,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Admins can have live requests profiled into this directory (see profiling.py)
+PROFILE_DIR = os.environ.get('EDVANCE_PROFILE_DIR', DATABASE + '-profiles')
+profiling.init_app(app, PROFILE_DIR, allowed=is_admin)
+# Scholarship expiry, upload clean-up and database upkeep (see maintenance.py)
+maintenance.configure(DATABASE, SPONSOR_DATABASE,
+                      (DATABASE, SPONSOR_DATABASE, APPLICATIONS_DATABASE, STUDENT_DATABASE))
 
-def init_sponsor_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS sponsor_profiles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            company_name TEXT NOT NULL,
-            gst_number TEXT NOT NULL,
-            annual_turnover REAL NOT NULL,
-            tax_registration_file TEXT,
-            tax_registration_path TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def init_scholarship_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS scholarships (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sponsor_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            amount REAL NOT NULL,
-            currency TEXT DEFAULT 'INR',
-            gender_criteria TEXT,
-            family_income_max REAL,
-            location_type TEXT,
-            min_academic_percentage REAL,
-            application_deadline DATE,
-            is_active BOOLEAN DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (sponsor_id) REFERENCES sponsor_profiles (id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def init_scholarship_applications_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS scholarship_applications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            scholarship_id INTEGER NOT NULL,
-            student_data TEXT NOT NULL,
-            application_message TEXT,
-            status TEXT DEFAULT 'pending',
-            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            reviewed_at TIMESTAMP,
-            FOREIGN KEY (scholarship_id) REFERENCES scholarships (id)
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-init_db()
-init_student_db()
-init_notes_db()
-init_videos_db()
-init_sponsor_db()
-init_scholarship_db()
-init_scholarship_applications_db()
+@app.before_request
+def start_background_workers():
+    # Started lazily so each worker process of a forking server gets its own
+    ingest.ensure_workers(DATABASE)
+    maintenance.ensure_started()
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -156,7 +99,7 @@ def index():
         since_when = request.form.get('sinceWhen')
 
         # Store in DB
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         # Assuming one profile, replace if exists
         c.execute('DELETE FROM teacher_profile')
@@ -165,7 +108,7 @@ def index():
             VALUES (?, ?, ?, ?)
         ''', (name, qualification, teaching_where, since_when))
         conn.commit()
-        conn.close()
+        versions.bump(DATABASE, 'teacher_profile')
 
         return redirect(url_for('profile'))
 
@@ -174,11 +117,10 @@ def index():
 
 @app.route('/profile')
 def profile():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db(DATABASE)
     c = conn.cursor()
     c.execute('SELECT name, qualification, teaching_where, since_when FROM teacher_profile LIMIT 1')
     row = c.fetchone()
-    conn.close()
 
     if not row:
         return redirect(url_for('index'))
@@ -198,13 +140,13 @@ def profile():
 
 # Teacher Profile API endpoints
 @app.route('/api/teacher/profile', methods=['GET'])
+@respcache.cached(DATABASE, 'teacher_profile')
 def get_teacher_profile():
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         c.execute('SELECT id, name, qualification, teaching_where, since_when FROM teacher_profile LIMIT 1')
         row = c.fetchone()
-        conn.close()
 
         if not row:
             return jsonify({'success': False, 'message': 'No teacher profile found'}), 404
@@ -226,7 +168,7 @@ def update_teacher_profile():
     try:
         data = request.get_json()
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         
         # Check if profile exists
@@ -259,7 +201,7 @@ def update_teacher_profile():
             ))
         
         conn.commit()
-        conn.close()
+        versions.bump(DATABASE, 'teacher_profile')
         
         return jsonify({'success': True, 'message': 'Profile updated successfully'})
     except Exception as e:
@@ -269,11 +211,10 @@ def update_teacher_profile():
 # Student Profile API endpoints
 @app.route('/api/student/profile', methods=['GET'])
 def get_student_profile():
-    conn = sqlite3.connect(STUDENT_DATABASE)
+    conn = get_db(STUDENT_DATABASE)
     c = conn.cursor()
     c.execute('SELECT personal_data, academic_data, residential_data FROM student_profile ORDER BY created_at DESC LIMIT 1')
     row = c.fetchone()
-    conn.close()
     
     if not row:
         return jsonify({'profile': None})
@@ -298,7 +239,7 @@ def save_student_profile():
         return jsonify({'success': False, 'message': 'Invalid data format'}), 400
     
     try:
-        conn = sqlite3.connect(STUDENT_DATABASE)
+        conn = get_db(STUDENT_DATABASE)
         c = conn.cursor()
         
         # Delete existing data (for demo, only one profile stored)
@@ -315,7 +256,6 @@ def save_student_profile():
         ))
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -323,25 +263,22 @@ def save_student_profile():
 
 # Notes API endpoints
 @app.route('/api/notes', methods=['GET'])
+@respcache.cached(DATABASE, 'uploaded_notes')
 def get_notes():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db(DATABASE)
     c = conn.cursor()
     c.execute('SELECT id, standard, subject, topic, file_name, uploaded_at FROM uploaded_notes ORDER BY uploaded_at DESC')
-    rows = c.fetchall()
-    conn.close()
     
-    notes = []
-    for row in rows:
-        notes.append({
-            'id': row[0],
-            'standard': row[1],
-            'subject': row[2],
-            'topic': row[3],
-            'file_name': row[4],
-            'uploaded_at': row[5]
-        })
+    notes = ({
+        'id': row[0],
+        'standard': row[1],
+        'subject': row[2],
+        'topic': row[3],
+        'file_name': row[4],
+        'uploaded_at': row[5]
+    } for row in jsonstream.iter_rows(c))
     
-    return jsonify({'notes': notes})
+    return jsonstream.stream_list({}, 'notes', notes)
 
 @app.route('/api/notes', methods=['POST'])
 def upload_notes():
@@ -362,46 +299,45 @@ def upload_notes():
     if not all([standard, subject, topic]):
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
     
+    temp_path = None
     try:
-        # Save file
-        import os
-        upload_dir = os.path.join(os.path.dirname(__file__), 'uploads')
-        if not os.path.exists(upload_dir):
-            os.makedirs(upload_dir)
-        
-        filename = f"{int(datetime.now().timestamp())}_{file.filename}"
-        file_path = os.path.join(upload_dir, filename)
-        file.save(file_path)
+        # Hash while saving; identical files are stored once
+        temp_path, digest, size = blobstore.receive(file.stream)
         
         # Save to database
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
+        file_path = blobstore.add_ref(c, temp_path, digest, size)
+        temp_path = None
         c.execute('''
-            INSERT INTO uploaded_notes (standard, subject, topic, file_path, file_name)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (standard, subject, topic, file_path, file.filename))
+            INSERT INTO uploaded_notes (standard, subject, topic, file_path, file_name, blob_digest)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (standard, subject, topic, file_path, file.filename, digest))
+        # PDF text is added to the search index in the background
+        ingest.enqueue(c, c.lastrowid, 'note')
         conn.commit()
-        conn.close()
+        versions.bump(DATABASE, 'uploaded_notes')
+        ingest.notify()
         
         return jsonify({'success': True, 'message': 'Notes uploaded successfully'})
     except Exception as e:
+        if temp_path:
+            blobstore.discard(temp_path)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/notes/<int:note_id>/download')
 def download_note(note_id):
     import os
-    from flask import send_file
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db(DATABASE)
     c = conn.cursor()
-    c.execute('SELECT file_path, file_name FROM uploaded_notes WHERE id = ?', (note_id,))
+    c.execute('SELECT file_path, file_name, blob_digest FROM uploaded_notes WHERE id = ?', (note_id,))
     row = c.fetchone()
-    conn.close()
     
     if not row:
         return jsonify({'error': 'Note not found'}), 404
     
-    file_path, file_name = row
+    file_path, file_name, blob_digest = row
     
     # Convert to absolute path
     if not os.path.isabs(file_path):
@@ -411,39 +347,74 @@ def download_note(note_id):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        return send_file(
+        return serve_file(
             file_path, 
             as_attachment=True, 
             download_name=file_name,
-            mimetype='application/pdf'
+            mimetype='application/pdf',
+            etag=blob_digest
         )
     except Exception as e:
         return jsonify({'error': f'Error serving file: {str(e)}'}), 500
 
+@app.route('/api/notes/<int:note_id>', methods=['DELETE'])
+def delete_note(note_id):
+    trash_path = None
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        c.execute('SELECT blob_digest FROM uploaded_notes WHERE id = ?', (note_id,))
+        row = c.fetchone()
+
+        if not row:
+            return jsonify({'success': False, 'message': 'Note not found'}), 404
+
+        # Triggers drop it from the search index and the facet counts; the
+        # blob goes only with its last reference. A pre-blob-store file is
+        # left for maintenance to quarantine.
+        c.execute('DELETE FROM uploaded_notes WHERE id = ?', (note_id,))
+        if row[0]:
+            trash_path = blobstore.release_ref(c, row[0])
+        conn.commit()
+        versions.bump(DATABASE, 'uploaded_notes')
+        blobstore.empty_trash(trash_path)
+
+        return jsonify({'success': True, 'message': 'Note deleted successfully'})
+    except Exception as e:
+        blobstore.restore(trash_path)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 # Videos API endpoints
 @app.route('/api/videos', methods=['GET'])
+@respcache.cached(DATABASE, 'uploaded_videos')
 def get_videos():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db(DATABASE)
     c = conn.cursor()
-    c.execute('SELECT id, standard, subject, topic, video_type, file_path, video_url, file_name, uploaded_at FROM uploaded_videos ORDER BY uploaded_at DESC')
-    rows = c.fetchall()
-    conn.close()
+    c.execute('''
+        SELECT id, standard, subject, topic, video_type, file_path, video_url, file_name, uploaded_at,
+               processing_status, duration_seconds, width, height, bitrate, size_bytes
+        FROM uploaded_videos ORDER BY uploaded_at DESC
+    ''')
     
-    videos = []
-    for row in rows:
-        videos.append({
-            'id': row[0],
-            'standard': row[1],
-            'subject': row[2],
-            'topic': row[3],
-            'video_type': row[4],
-            'file_path': row[5],
-            'video_url': row[6],
-            'file_name': row[7],
-            'uploaded_at': row[8]
-        })
+    videos = ({
+        'id': row[0],
+        'standard': row[1],
+        'subject': row[2],
+        'topic': row[3],
+        'video_type': row[4],
+        'file_path': row[5],
+        'video_url': row[6],
+        'file_name': row[7],
+        'uploaded_at': row[8],
+        'processing_status': row[9],
+        'duration_seconds': row[10],
+        'width': row[11],
+        'height': row[12],
+        'bitrate': row[13],
+        'size_bytes': row[14]
+    } for row in jsonstream.iter_rows(c))
     
-    return jsonify({'videos': videos})
+    return jsonstream.stream_list({}, 'videos', videos)
 
 @app.route('/api/videos', methods=['POST'])
 def upload_video():
@@ -455,8 +426,9 @@ def upload_video():
     if not all([standard, subject, topic, video_type]):
         return jsonify({'success': False, 'message': 'Missing required fields'}), 400
     
+    temp_path = None
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         
         if video_type == 'file':
@@ -470,21 +442,29 @@ def upload_video():
             if not file.filename.lower().endswith(('.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm')):
                 return jsonify({'success': False, 'message': 'Only video files are allowed'}), 400
             
-            # Save file
-            import os
-            upload_dir = os.path.join(os.path.dirname(__file__), 'uploads', 'videos')
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)
-            
-            filename = f"{int(datetime.now().timestamp())}_{file.filename}"
-            file_path = os.path.join(upload_dir, filename)
-            file.save(file_path)
+            # Hash while saving; identical files are stored once
+            temp_path, digest, size = blobstore.receive(file.stream)
+            file_path = blobstore.add_ref(c, temp_path, digest, size)
+            temp_path = None
             
-            # Save to database
+            # Save to database and queue fast-start/metadata processing
             c.execute('''
-                INSERT INTO uploaded_videos (standard, subject, topic, video_type, file_path, file_name)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (standard, subject, topic, video_type, file_path, file.filename))
+                INSERT INTO uploaded_videos (standard, subject, topic, video_type, file_path, file_name, blob_digest,
+                                             processing_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'processing')
+            ''', (standard, subject, topic, video_type, file_path, file.filename, digest))
+            video_id = c.lastrowid
+            ingest.enqueue(c, video_id)
+            conn.commit()
+            versions.bump(DATABASE, 'uploaded_videos')
+            ingest.notify()
+            
+            return jsonify({
+                'success': True,
+                'message': 'Video uploaded successfully',
+                'id': video_id,
+                'processing_status': 'processing'
+            }), 202
             
         else:  # video_type == 'link'
             video_url = request.form.get('video_url')
@@ -498,27 +478,27 @@ def upload_video():
             ''', (standard, subject, topic, video_type, video_url, 'External Video'))
         
         conn.commit()
-        conn.close()
+        versions.bump(DATABASE, 'uploaded_videos')
         
         return jsonify({'success': True, 'message': 'Video uploaded successfully'})
     except Exception as e:
+        if temp_path:
+            blobstore.discard(temp_path)
         return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/videos/<int:video_id>/stream')
 def stream_video(video_id):
     import os
-    from flask import send_file
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db(DATABASE)
     c = conn.cursor()
-    c.execute('SELECT file_path, file_name, video_type FROM uploaded_videos WHERE id = ?', (video_id,))
+    c.execute('SELECT file_path, file_name, video_type, blob_digest FROM uploaded_videos WHERE id = ?', (video_id,))
     row = c.fetchone()
-    conn.close()
     
     if not row:
         return jsonify({'error': 'Video not found'}), 404
     
-    file_path, file_name, video_type = row
+    file_path, file_name, video_type, blob_digest = row
     
     if video_type != 'file':
         return jsonify({'error': 'This is not a file video'}), 400
@@ -531,7 +511,8 @@ def stream_video(video_id):
         return jsonify({'error': 'Video file not found'}), 404
     
     try:
-        return send_file(file_path, mimetype='video/mp4')
+        # Content type follows the file extension (.mp4, .webm, .mov, ...)
+        return serve_file(file_path, download_name=file_name, etag=blob_digest)
     except Exception as e:
         return jsonify({'error': f'Error streaming video: {str(e)}'}), 500
 
@@ -539,27 +520,31 @@ def stream_video(video_id):
 def delete_video(video_id):
     import os
     
+    trash_path = None
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         
         # Get video details before deleting
-        c.execute('SELECT file_path, video_type FROM uploaded_videos WHERE id = ?', (video_id,))
+        c.execute('SELECT file_path, video_type, blob_digest FROM uploaded_videos WHERE id = ?', (video_id,))
         row = c.fetchone()
         
         if not row:
-            conn.close()
             return jsonify({'success': False, 'message': 'Video not found'}), 404
         
-        file_path, video_type = row
+        file_path, video_type, blob_digest = row
         
-        # Delete from database
+        # Delete from database; the blob goes only with its last reference
         c.execute('DELETE FROM uploaded_videos WHERE id = ?', (video_id,))
+        if blob_digest:
+            trash_path = blobstore.release_ref(c, blob_digest)
         conn.commit()
-        conn.close()
+        versions.bump(DATABASE, 'uploaded_videos')
+        blobstore.empty_trash(trash_path)
+        trash_path = None
         
-        # Delete physical file if it exists and is a file upload
-        if video_type == 'file' and file_path:
+        # Delete physical file if it exists and is a pre-blob-store file upload
+        if video_type == 'file' and file_path and not blob_digest:
             try:
                 # Convert to absolute path
                 if not os.path.isabs(file_path):
@@ -571,125 +556,595 @@ def delete_video(video_id):
                 print(f"Warning: Could not delete file {file_path}: {e}")
         
         return jsonify({'success': True, 'message': 'Video deleted successfully'})
+    except Exception as e:
+        blobstore.restore(trash_path)
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Resumable upload API endpoints
+@app.route('/api/uploads', methods=['POST'])
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    file_name = data.get('file_name')
+    total_size = data.get('total_size')
+    standard = data.get('standard')
+    subject = data.get('subject')
+    topic = data.get('topic')
+    
+    if kind not in ('notes', 'video'):
+        return jsonify({'success': False, 'message': "kind must be 'notes' or 'video'"}), 400
+    
+    if not all([file_name, standard, subject, topic]) or not isinstance(total_size, int):
+        return jsonify({'success': False, 'message': 'Missing required fields'}), 400
+    
+    extensions = resumable.NOTE_EXTENSIONS if kind == 'notes' else resumable.VIDEO_EXTENSIONS
+    if not file_name.lower().endswith(extensions):
+        message = 'Only PDF files are allowed' if kind == 'notes' else 'Only video files are allowed'
+        return jsonify({'success': False, 'message': message}), 400
+    
+    if total_size <= 0 or total_size > resumable.MAX_UPLOAD_SIZE:
+        return jsonify({'success': False, 'message': f'File size must be between 1 and {resumable.MAX_UPLOAD_SIZE} bytes'}), 413
+    
+    try:
+        upload_id = resumable.new_session_id()
+        resumable.create_partial(upload_id, total_size)
+        
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO upload_sessions (id, kind, file_name, total_size, metadata)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (upload_id, kind, file_name, total_size,
+              json.dumps({'standard': standard, 'subject': subject, 'topic': topic})))
+        conn.commit()
+        
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'chunk_size': resumable.RECOMMENDED_CHUNK_SIZE,
+            'max_chunk_size': resumable.MAX_CHUNK_SIZE
+        }), 201
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def get_upload_session(c, upload_id):
+    c.execute('SELECT kind, file_name, total_size, metadata, status FROM upload_sessions WHERE id = ?', (upload_id,))
+    return c.fetchone()
+
+@app.route('/api/uploads/<upload_id>/chunks', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'offset query parameter is required'}), 400
+    
+    length = request.content_length
+    if length is None:
+        return jsonify({'success': False, 'message': 'Content-Length is required'}), 411
+    if length <= 0 or length > resumable.MAX_CHUNK_SIZE:
+        return jsonify({'success': False, 'message': f'Chunks must be between 1 and {resumable.MAX_CHUNK_SIZE} bytes'}), 413
+    
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        row = get_upload_session(c, upload_id)
+        if not row:
+            return jsonify({'success': False, 'message': 'Upload not found'}), 404
+        
+        total_size, status = row[2], row[4]
+        if status != 'open':
+            return jsonify({'success': False, 'message': 'Upload is already complete'}), 409
+        if offset < 0 or offset + length > total_size:
+            return jsonify({'success': False, 'message': 'Chunk lies outside the file'}), 416
+        
+        # Stream straight to disk; the request body is never held in memory
+        written = resumable.write_chunk(resumable.partial_path(upload_id), offset, request.stream, length)
+        if written != length:
+            return jsonify({'success': False, 'message': 'Chunk was truncated, please retry'}), 400
+        
+        c.execute('''
+            INSERT OR REPLACE INTO upload_chunks (session_id, byte_offset, byte_count)
+            VALUES (?, ?, ?)
+        ''', (upload_id, offset, length))
+        c.execute('UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (upload_id,))
+        conn.commit()
+        
+        return jsonify({'success': True, 'offset': offset, 'length': length})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_progress(upload_id):
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        row = get_upload_session(c, upload_id)
+        if not row:
+            return jsonify({'success': False, 'message': 'Upload not found'}), 404
+        
+        kind, file_name, total_size, _metadata, status = row
+        c.execute('SELECT byte_offset, byte_count FROM upload_chunks WHERE session_id = ?', (upload_id,))
+        received, missing = resumable.coverage(c.fetchall(), total_size)
+        
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'kind': kind,
+            'file_name': file_name,
+            'status': status,
+            'total_size': total_size,
+            'received_bytes': total_size if status == 'complete' else received,
+            'missing_ranges': [] if status == 'complete' else missing
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        row = get_upload_session(c, upload_id)
+        if not row:
+            return jsonify({'success': False, 'message': 'Upload not found'}), 404
+        
+        kind, file_name, total_size, metadata, status = row
+        if status != 'open':
+            return jsonify({'success': False, 'message': 'Upload is already complete'}), 409
+        
+        c.execute('SELECT byte_offset, byte_count FROM upload_chunks WHERE session_id = ?', (upload_id,))
+        received, missing = resumable.coverage(c.fetchall(), total_size)
+        if missing:
+            return jsonify({
+                'success': False,
+                'message': 'Upload is incomplete',
+                'received_bytes': received,
+                'missing_ranges': missing
+            }), 409
+        
+        metadata = json.loads(metadata)
+        # Chunks may have arrived in any order, so hash the assembled file
+        partial_path = resumable.partial_path(upload_id)
+        digest, size = blobstore.hash_file(partial_path)
+        
+        # Claim the session first so a concurrent complete call can't also publish it
+        c.execute('''
+            UPDATE upload_sessions SET status = 'complete', updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'open'
+        ''', (upload_id,))
+        if c.rowcount == 0:
+            conn.rollback()
+            return jsonify({'success': False, 'message': 'Upload is already complete'}), 409
+        
+        file_path = blobstore.add_ref(c, partial_path, digest, size)
+        if kind == 'notes':
+            c.execute('''
+                INSERT INTO uploaded_notes (standard, subject, topic, file_path, file_name, blob_digest)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (metadata['standard'], metadata['subject'], metadata['topic'], file_path, file_name, digest))
+            record_id = c.lastrowid
+            ingest.enqueue(c, record_id, 'note')
+        else:
+            c.execute('''
+                INSERT INTO uploaded_videos (standard, subject, topic, video_type, file_path, file_name, blob_digest,
+                                             processing_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'processing')
+            ''', (metadata['standard'], metadata['subject'], metadata['topic'], 'file', file_path, file_name, digest))
+            record_id = c.lastrowid
+            ingest.enqueue(c, record_id)
+        c.execute('DELETE FROM upload_chunks WHERE session_id = ?', (upload_id,))
+        conn.commit()
+        versions.bump(DATABASE, 'uploaded_notes' if kind == 'notes' else 'uploaded_videos')
+        ingest.notify()
+        
+        if kind == 'notes':
+            return jsonify({'success': True, 'message': 'Notes uploaded successfully', 'id': record_id})
+        
+        return jsonify({
+            'success': True,
+            'message': 'Video uploaded successfully',
+            'id': record_id,
+            'processing_status': 'processing'
+        }), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        c.execute("DELETE FROM upload_sessions WHERE id = ? AND status = 'open'", (upload_id,))
+        if c.rowcount == 0:
+            return jsonify({'success': False, 'message': 'Upload not found'}), 404
+        c.execute('DELETE FROM upload_chunks WHERE session_id = ?', (upload_id,))
+        conn.commit()
+        
+        resumable.discard_partial(upload_id)
+        return jsonify({'success': True, 'message': 'Upload cancelled'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Study Materials API endpoints for students
+STUDY_MATERIALS_PAGE_SIZE = 50
+STUDY_MATERIALS_MAX_PAGE_SIZE = 200
+
+def encode_cursor(values):
+    """Pack keyset values into an opaque, URL-safe page token."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Unpack a page token made by encode_cursor(); raises ValueError if it is malformed."""
+    if not token:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+
 @app.route('/api/study-materials', methods=['GET'])
 def get_study_materials():
     standard = request.args.get('standard')
     subject = request.args.get('subject')
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        limit = int(request.args.get('limit', STUDY_MATERIALS_PAGE_SIZE))
+        cursor = decode_cursor(request.args.get('cursor'))
+        if cursor is not None:
+            cursor_uploaded_at, cursor_type, cursor_id = cursor
+            if cursor_type not in ('notes', 'videos') or not isinstance(cursor_id, int):
+                raise ValueError('Invalid cursor')
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    limit = min(limit, STUDY_MATERIALS_MAX_PAGE_SIZE)
+    
+    try:
+        conn = get_db(DATABASE)
         c = conn.cursor()
         
-        # Build query based on filters
-        notes_query = 'SELECT id, standard, subject, topic, file_name, uploaded_at, "notes" as type FROM uploaded_notes'
-        videos_query = 'SELECT id, standard, subject, topic, file_name, uploaded_at, video_type as type FROM uploaded_videos'
-        
-        notes_params = []
-        videos_params = []
-        
-        if standard:
-            notes_query += ' WHERE standard = ?'
-            videos_query += ' WHERE standard = ?'
-            notes_params.append(standard)
-            videos_params.append(standard)
-            
+        # Page through notes and videos in (uploaded_at, type, id) order, newest
+        # first. Each side reads at most one page from its index and the
+        # database merges the two.
+        arms = []
+        params = []
+        for material_type, table in (('notes', 'uploaded_notes'), ('videos', 'uploaded_videos')):
+            conditions = []
+            if standard:
+                conditions.append('standard = ?')
+                params.append(standard)
             if subject:
-                notes_query += ' AND subject = ?'
-                videos_query += ' AND subject = ?'
-                notes_params.append(subject)
-                videos_params.append(subject)
-        elif subject:
-            notes_query += ' WHERE subject = ?'
-            videos_query += ' WHERE subject = ?'
-            notes_params.append(subject)
-            videos_params.append(subject)
-        
-        notes_query += ' ORDER BY uploaded_at DESC'
-        videos_query += ' ORDER BY uploaded_at DESC'
-        
-        # Get notes
-        c.execute(notes_query, notes_params)
-        notes = c.fetchall()
-        
-        # Get videos
-        c.execute(videos_query, videos_params)
-        videos = c.fetchall()
-        
-        conn.close()
-        
-        # Combine and format results
-        materials = []
-        
-        for note in notes:
-            materials.append({
-                'id': note[0],
-                'standard': note[1],
-                'subject': note[2],
-                'topic': note[3],
-                'file_name': note[4],
-                'uploaded_at': note[5],
-                'type': 'notes',
-                'download_url': f'/api/notes/{note[0]}/download'
-            })
+                conditions.append('subject = ?')
+                params.append(subject)
+            if cursor is not None:
+                if material_type == cursor_type:
+                    conditions.append('(uploaded_at < ? OR (uploaded_at = ? AND id < ?))')
+                    params.extend([cursor_uploaded_at, cursor_uploaded_at, cursor_id])
+                elif material_type > cursor_type:
+                    # Sorts before the cursor's type at the same timestamp
+                    conditions.append('uploaded_at < ?')
+                    params.append(cursor_uploaded_at)
+                else:
+                    conditions.append('uploaded_at <= ?')
+                    params.append(cursor_uploaded_at)
+            
+            where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+            arms.append(
+                f"SELECT * FROM (SELECT id, standard, subject, topic, file_name, uploaded_at, '{material_type}' AS type "
+                f'FROM {table}{where} ORDER BY uploaded_at DESC, id DESC LIMIT ?)'
+            )
+            params.append(limit + 1)
+        
+        query = ' UNION ALL '.join(arms) + ' ORDER BY uploaded_at DESC, type DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        c.execute(query, params)
+        rows = c.fetchall()
         
-        for video in videos:
-            materials.append({
-                'id': video[0],
-                'standard': video[1],
-                'subject': video[2],
-                'topic': video[3],
-                'file_name': video[4],
-                'uploaded_at': video[5],
-                'type': 'videos',
-                'stream_url': f'/api/videos/{video[0]}/stream'
-            })
+        materials = []
+        for row in rows[:limit]:
+            material = {
+                'id': row[0],
+                'standard': row[1],
+                'subject': row[2],
+                'topic': row[3],
+                'file_name': row[4],
+                'uploaded_at': row[5],
+                'type': row[6]
+            }
+            if row[6] == 'notes':
+                material['download_url'] = f'/api/notes/{row[0]}/download'
+            else:
+                material['stream_url'] = f'/api/videos/{row[0]}/stream'
+            materials.append(material)
         
-        # Sort by upload date (newest first)
-        materials.sort(key=lambda x: x['uploaded_at'], reverse=True)
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor([last[5], last[6], last[0]])
         
-        return jsonify({'materials': materials})
+        return jsonify({'materials': materials, 'next_cursor': next_cursor})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/study-materials/filters', methods=['GET'])
+@respcache.cached(DATABASE, 'uploaded_notes', 'uploaded_videos')
 def get_study_filters():
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(DATABASE)
         c = conn.cursor()
         
-        # Get unique standards and subjects
-        c.execute('SELECT DISTINCT standard FROM uploaded_notes UNION SELECT DISTINCT standard FROM uploaded_videos ORDER BY standard')
-        standards = [row[0] for row in c.fetchall()]
-        
-        c.execute('SELECT DISTINCT subject FROM uploaded_notes UNION SELECT DISTINCT subject FROM uploaded_videos ORDER BY subject')
-        subjects = [row[0] for row in c.fetchall()]
-        
-        conn.close()
+        # One row per (standard, subject, type), kept current by triggers
+        tree = facets.read_tree(c)
+        standards = [node['standard'] for node in tree]
+        subjects = sorted({leaf['subject'] for node in tree for leaf in node['subjects']})
         
         return jsonify({
             'standards': standards,
-            'subjects': subjects
+            'subjects': subjects,
+            'facets': tree,
+            'total': sum(node['count'] for node in tree)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/study-materials/import', methods=['POST'])
+@admin_required
+def import_study_materials():
+    fmt = bulk.request_format(request.mimetype, request.args.get('format'))
+    if fmt is None:
+        return jsonify({'success': False, 'message': 'Send NDJSON (application/x-ndjson) or CSV (text/csv)'}), 415
+    report = bulk.ImportReport()
+    try:
+        conn = get_db(DATABASE)
+        bulk.run_import(bulk.read_records(request.stream, fmt), bulk.MATERIAL_FIELDS, bulk.write_materials(conn),
+                        report, check=bulk.check_material)
+        return jsonify({'success': True, **report.as_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e), **report.as_dict()}), 500
+    finally:
+        if report.inserted or report.updated:
+            versions.bump(DATABASE, 'uploaded_notes', 'uploaded_videos')
+
+MATERIAL_EXPORT_COLUMNS = ['type', 'id', 'standard', 'subject', 'topic', 'file_name', 'video_url', 'blob_digest',
+                           'uploaded_at']
+
+@app.route('/api/study-materials/export', methods=['GET'])
+@admin_required
+def export_study_materials():
+    fmt = request.args.get('format', 'ndjson')
+    material_type = request.args.get('type')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'success': False, 'message': f'format must be one of: {", ".join(bulk.FORMATS)}'}), 400
+    if material_type not in (None, 'notes', 'videos'):
+        return jsonify({'success': False, 'message': 'type must be notes or videos'}), 400
+    try:
+        conn = get_db(DATABASE)
+        queries = {
+            'notes': "SELECT 'notes', id, standard, subject, topic, file_name, NULL, blob_digest, uploaded_at "
+                     'FROM uploaded_notes ORDER BY id',
+            'videos': "SELECT 'videos', id, standard, subject, topic, file_name, video_url, blob_digest, uploaded_at "
+                      'FROM uploaded_videos ORDER BY id',
+        }
+
+        def rows():
+            for kind in ([material_type] if material_type else queries):
+                yield from jsonstream.iter_rows(conn.execute(queries[kind]))
+
+        return bulk.stream_records(MATERIAL_EXPORT_COLUMNS, rows(), fmt, material_type or 'study-materials')
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/facets/rebuild', methods=['POST'])
+@admin_required
+def rebuild_study_facets():
+    try:
+        conn = get_db(DATABASE)
+        facets.rebuild(conn)
+        conn.commit()
+        # Drops the cached filters response
+        versions.bump(DATABASE, 'uploaded_notes', 'uploaded_videos')
+        
+        c = conn.cursor()
+        return jsonify({'success': True, 'facets': facets.read_tree(c)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/compression', methods=['GET'])
+@admin_required
+def get_compression_stats():
+    return jsonify({
+        'success': True,
+        'encodings': compress.stats.snapshot(),
+        'response_cache': {
+            'hits': respcache.cache.hits,
+            'misses': respcache.cache.misses,
+            'bytes': respcache.cache.size
+        }
+    })
+
+# The counters behind the admin stats endpoints, for /metrics
+metrics.declare('edvance_compression_bytes_in_total', 'counter', 'Bytes before compression.', ('encoding',))
+metrics.declare('edvance_compression_bytes_out_total', 'counter', 'Bytes after compression.', ('encoding',))
+metrics.declare('edvance_compression_cpu_seconds_total', 'counter', 'CPU time spent compressing.', ('encoding',))
+metrics.declare('edvance_response_cache_requests_total', 'counter', 'Response cache lookups.', ('result',))
+metrics.declare('edvance_response_cache_bytes', 'gauge', 'Bytes held by the response cache.', ())
+metrics.declare('edvance_group_commit_batches_total', 'counter', 'Group commit batches.', ('queue',))
+metrics.declare('edvance_group_commit_rows_total', 'counter', 'Rows written by group commit.', ('queue',))
+metrics.declare('edvance_group_commit_failed_rows_total', 'counter', 'Rows group commit could not write.', ('queue',))
+metrics.declare('edvance_group_commit_queued', 'gauge', 'Rows waiting for a group commit batch.', ('queue',))
+
+@metrics.add_collector
+def stats_metrics():
+    for encoding, totals in compress.stats.snapshot().items():
+        yield 'edvance_compression_bytes_in_total', (encoding,), totals['bytes_in']
+        yield 'edvance_compression_bytes_out_total', (encoding,), totals['bytes_out']
+        yield 'edvance_compression_cpu_seconds_total', (encoding,), totals['cpu_seconds']
+    yield 'edvance_response_cache_requests_total', ('hit',), respcache.cache.hits
+    yield 'edvance_response_cache_requests_total', ('miss',), respcache.cache.misses
+    yield 'edvance_response_cache_bytes', (), respcache.cache.size
+    stats = application_writer.stats
+    yield 'edvance_group_commit_batches_total', (application_writer.name,), stats.batches
+    yield 'edvance_group_commit_rows_total', (application_writer.name,), stats.rows
+    yield 'edvance_group_commit_failed_rows_total', (application_writer.name,), stats.failed_rows
+    yield 'edvance_group_commit_queued', (application_writer.name,), application_writer.queued()
+
+@app.route('/metrics', methods=['GET'])
+@admin_required
+def get_metrics():
+    try:
+        return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/profiling', methods=['GET'])
+@admin_required
+def get_profiling():
+    try:
+        profiling.profiler.refresh_settings(force=True)
+        return jsonify({'success': True, 'settings': profiling.profiler.settings,
+                        'profiles': profiling.profiler.list_files()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/profiling', methods=['PUT'])
+@admin_required
+def update_profiling():
+    try:
+        data = request.get_json(silent=True) or {}
+        settings = {**profiling.profiler.settings, **data}
+        if settings['mode'] not in profiling.MODES:
+            return jsonify({'success': False, 'message': f'mode must be one of: {", ".join(profiling.MODES)}'}), 400
+        try:
+            settings['rate'] = float(settings['rate'])
+        except (TypeError, ValueError):
+            settings['rate'] = -1
+        if not 0 <= settings['rate'] <= 1:
+            return jsonify({'success': False, 'message': 'rate must be a number between 0 and 1'}), 400
+        endpoints = settings['endpoints']
+        if not isinstance(endpoints, list) or not all(isinstance(e, str) for e in endpoints):
+            return jsonify({'success': False, 'message': 'endpoints must be a list of endpoint names'}), 400
+        unknown = [e for e in endpoints if e not in app.view_functions]
+        if unknown:
+            return jsonify({'success': False, 'message': f'Unknown endpoints: {", ".join(unknown)}'}), 400
+        settings = {key: settings[key] for key in profiling.DEFAULT_SETTINGS}
+        profiling.profiler.save_settings(settings)
+        return jsonify({'success': True, 'settings': settings})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+@admin_required
+def download_profile(name):
+    try:
+        path = profiling.profiler.file_path(name)
+        if path is None:
+            return jsonify({'success': False, 'message': 'Profile not found'}), 404
+        return serve_file(path, download_name=name, as_attachment=True,
+                          mimetype='text/plain' if name.endswith('.collapsed') else 'application/octet-stream')
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/maintenance', methods=['GET'])
+@admin_required
+def get_maintenance():
+    try:
+        return jsonify({'success': True, **maintenance.scheduler.status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/admin/maintenance/run', methods=['POST'])
+@admin_required
+def run_maintenance():
+    try:
+        data = request.get_json(silent=True) or {}
+        tasks = data.get('tasks') or list(maintenance.scheduler.tasks)
+        if not isinstance(tasks, list) or not all(isinstance(t, str) for t in tasks):
+            return jsonify({'success': False, 'message': 'tasks must be a list of task names'}), 400
+        unknown = [t for t in tasks if t not in maintenance.scheduler.tasks]
+        if unknown:
+            return jsonify({'success': False, 'message': f'Unknown tasks: {", ".join(unknown)}'}), 400
+        requested = maintenance.scheduler.request(tasks)
+        # The leader may be another process; it picks these up within a tick
+        return jsonify({'success': True, 'requested': requested}), 202
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+@app.route('/api/search', methods=['GET'])
+def search_materials():
+    expression = search.match_expression(request.args.get('q'))
+    if expression is None:
+        return jsonify({'error': 'Missing search query'}), 400
+    
+    material_type = request.args.get('type')
+    if material_type not in (None, '', 'notes', 'videos'):
+        return jsonify({'error': 'type must be notes or videos'}), 400
+    
+    try:
+        limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+        cursor = decode_cursor(request.args.get('cursor'))
+        if cursor is not None:
+            cursor_rank, cursor_rowid = cursor
+            if not isinstance(cursor_rank, (int, float)) or not isinstance(cursor_rowid, int):
+                raise ValueError('Invalid cursor')
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
+    if limit < 1:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    limit = min(limit, SEARCH_MAX_PAGE_SIZE)
+    
+    try:
+        conn = get_db(DATABASE)
+        c = conn.cursor()
+        rows, truncated = search.search(c, expression, request.args.get('standard'), request.args.get('subject'),
+                                        material_type, limit, cursor)
+        
+        results = []
+        for row in rows[:limit]:
+            result = {
+                'id': row[3],
+                'type': row[2],
+                'standard': row[4],
+                'subject': row[5],
+                'topic': row[6],
+                'file_name': row[7],
+                'uploaded_at': row[8],
+                'score': -row[1],
+                'snippet': search.highlight(row[9])
+            }
+            if row[2] == 'notes':
+                result['download_url'] = f'/api/notes/{row[3]}/download'
+            else:
+                result['stream_url'] = f'/api/videos/{row[3]}/stream'
+            results.append(result)
+        
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor([last[1], last[0]])
+        
+        # Only the newest CANDIDATE_LIMIT matches were ranked; narrow the query to reach the rest
+        return jsonify({'results': results, 'next_cursor': next_cursor, 'truncated': truncated,
+                        'candidate_limit': search.CANDIDATE_LIMIT})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Sponsor Profile API endpoints
 @app.route('/api/sponsor/profile', methods=['GET', 'POST', 'PUT'])
 def sponsor_profile():
-    import os
     from werkzeug.utils import secure_filename
     
     if request.method == 'GET':
         try:
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db(SPONSOR_DATABASE)
             c = conn.cursor()
             c.execute('SELECT * FROM sponsor_profiles ORDER BY updated_at DESC LIMIT 1')
             row = c.fetchone()
-            conn.close()
             
             if row:
                 return jsonify({
@@ -712,6 +1167,9 @@ def sponsor_profile():
             return jsonify({'success': False, 'error': str(e)}), 500
     
     elif request.method in ['POST', 'PUT']:
+        temp_path = None
+        trash_path = None
+        added_digest = None
         try:
             # Get form data
             name = request.form.get('name')
@@ -727,61 +1185,92 @@ def sponsor_profile():
             tax_file = request.files.get('taxRegistration')
             tax_file_path = None
             tax_file_name = None
+            tax_file_digest = None
             
-            if tax_file and tax_file.filename:
-                # Create uploads directory if it doesn't exist
-                upload_dir = os.path.join(os.path.dirname(__file__), 'uploads', 'sponsors')
-                os.makedirs(upload_dir, exist_ok=True)
-                
-                # Save file
-                filename = secure_filename(tax_file.filename)
-                tax_file_path = os.path.join(upload_dir, filename)
-                tax_file.save(tax_file_path)
-                tax_file_name = filename
-            
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db(SPONSOR_DATABASE)
             c = conn.cursor()
+            # Blob references are counted in the content database with the
+            # study materials'. The new reference is committed before the
+            # profile and the old one released after it, so a failure in
+            # between can only leave a blob behind, never lose one.
+            content = get_db(DATABASE)
+            
+            if tax_file and tax_file.filename:
+                # Hash while saving; identical files are stored once
+                temp_path, tax_file_digest, size = blobstore.receive(tax_file.stream)
+                tax_file_path = blobstore.add_ref(content.cursor(), temp_path, tax_file_digest, size)
+                temp_path = None
+                content.commit()
+                added_digest = tax_file_digest
+                tax_file_name = secure_filename(tax_file.filename)
             
+            current = None
             if request.method == 'POST':
                 # Insert new profile
                 c.execute('''
                     INSERT INTO sponsor_profiles 
-                    (name, company_name, gst_number, annual_turnover, tax_registration_file, tax_registration_path)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (name, company_name, gst_number, annual_turnover, tax_file_name, tax_file_path))
+                    (name, company_name, gst_number, annual_turnover, tax_registration_file, tax_registration_path,
+                     tax_registration_digest)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (name, company_name, gst_number, annual_turnover, tax_file_name, tax_file_path, tax_file_digest))
             else:
-                # Update existing profile
+                # Update existing profile, dropping its reference to the old document
+                c.execute('SELECT id, tax_registration_digest FROM sponsor_profiles ORDER BY updated_at DESC LIMIT 1')
+                current = c.fetchone()
                 c.execute('''
                     UPDATE sponsor_profiles SET 
                     name = ?, company_name = ?, gst_number = ?, annual_turnover = ?, 
-                    tax_registration_file = ?, tax_registration_path = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = (SELECT id FROM sponsor_profiles ORDER BY updated_at DESC LIMIT 1)
-                ''', (name, company_name, gst_number, annual_turnover, tax_file_name, tax_file_path))
+                    tax_registration_file = ?, tax_registration_path = ?, tax_registration_digest = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (name, company_name, gst_number, annual_turnover, tax_file_name, tax_file_path, tax_file_digest,
+                      current[0] if current else None))
             
             conn.commit()
-            conn.close()
+            added_digest = None
+            if current and current[1]:
+                trash_path = blobstore.release_ref(content.cursor(), current[1])
+                content.commit()
+            blobstore.empty_trash(trash_path)
+            trash_path = None
+            # Scholarship listings show the sponsor's name and company
+            versions.bump(SPONSOR_DATABASE, 'scholarships')
             
             return jsonify({'success': True, 'message': 'Profile saved successfully'})
         except Exception as e:
+            if temp_path:
+                blobstore.discard(temp_path)
+            blobstore.restore(trash_path)
+            if added_digest:
+                # The profile wasn't saved; give back the new document's reference
+                try:
+                    content.rollback()
+                    undo_path = blobstore.release_ref(content.cursor(), added_digest)
+                    content.commit()
+                    blobstore.empty_trash(undo_path)
+                except Exception:
+                    pass
             return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/sponsor/tax-document/<int:profile_id>')
 def download_tax_document(profile_id):
     import os
-    from flask import send_file
     
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(SPONSOR_DATABASE)
         c = conn.cursor()
-        c.execute('SELECT tax_registration_path, tax_registration_file FROM sponsor_profiles WHERE id = ?', (profile_id,))
+        c.execute('''
+            SELECT tax_registration_path, tax_registration_file, tax_registration_digest
+            FROM sponsor_profiles WHERE id = ?
+        ''', (profile_id,))
         row = c.fetchone()
-        conn.close()
         
         if not row or not row[0]:
             return jsonify({'error': 'Document not found'}), 404
         
         file_path = row[0]
         file_name = row[1]
+        blob_digest = row[2]
         
         # Convert to absolute path
         if not os.path.isabs(file_path):
@@ -790,17 +1279,19 @@ def download_tax_document(profile_id):
         if not os.path.exists(file_path):
             return jsonify({'error': 'File not found'}), 404
         
-        return send_file(file_path, as_attachment=True, download_name=file_name, mimetype='application/pdf')
+        return serve_file(file_path, as_attachment=True, download_name=file_name, mimetype='application/pdf',
+                          etag=blob_digest)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Scholarship API endpoints
 @app.route('/api/scholarships', methods=['GET', 'POST'])
+@respcache.cached(SPONSOR_DATABASE, 'scholarships')
 def scholarships():
     if request.method == 'GET':
         # Get all active scholarships
         try:
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db(SPONSOR_DATABASE)
             c = conn.cursor()
             c.execute('''
                 SELECT s.*, sp.name as sponsor_name, sp.company_name 
@@ -809,28 +1300,25 @@ def scholarships():
                 WHERE s.is_active = 1
                 ORDER BY s.created_at DESC
             ''')
-            scholarships = []
-            for row in c.fetchall():
-                scholarships.append({
-                    'id': row[0],
-                    'sponsor_id': row[1],
-                    'title': row[2],
-                    'description': row[3],
-                    'amount': row[4],
-                    'currency': row[5],
-                    'gender_criteria': row[6],
-                    'family_income_max': row[7],
-                    'location_type': row[8],
-                    'min_academic_percentage': row[9],
-                    'application_deadline': row[10],
-                    'is_active': row[11],
-                    'created_at': row[12],
-                    'updated_at': row[13],
-                    'sponsor_name': row[14],
-                    'company_name': row[15]
-                })
-            conn.close()
-            return jsonify({'success': True, 'scholarships': scholarships})
+            scholarships = ({
+                'id': row[0],
+                'sponsor_id': row[1],
+                'title': row[2],
+                'description': row[3],
+                'amount': row[4],
+                'currency': row[5],
+                'gender_criteria': row[6],
+                'family_income_max': row[7],
+                'location_type': row[8],
+                'min_academic_percentage': row[9],
+                'application_deadline': row[10],
+                'is_active': row[11],
+                'created_at': row[12],
+                'updated_at': row[13],
+                'sponsor_name': row[14],
+                'company_name': row[15]
+            } for row in jsonstream.iter_rows(c))
+            return jsonstream.stream_list({'success': True}, 'scholarships', scholarships)
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
     
@@ -841,12 +1329,11 @@ def scholarships():
             
             # Get the first sponsor profile (for now, we'll use sponsor_id = 1)
             # In a real app, this would be based on authentication
-            conn = sqlite3.connect(DATABASE)
+            conn = get_db(SPONSOR_DATABASE)
             c = conn.cursor()
             c.execute('SELECT id FROM sponsor_profiles LIMIT 1')
             sponsor_row = c.fetchone()
             if not sponsor_row:
-                conn.close()
                 return jsonify({'success': False, 'message': 'No sponsor profile found'}), 400
             
             sponsor_id = sponsor_row[0]
@@ -870,81 +1357,124 @@ def scholarships():
                 data.get('application_deadline')
             ))
             conn.commit()
-            conn.close()
+            versions.bump(SPONSOR_DATABASE, 'scholarships')
             
             return jsonify({'success': True, 'message': 'Scholarship created successfully'})
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/scholarships/import', methods=['POST'])
+@admin_required
+def import_scholarships():
+    fmt = bulk.request_format(request.mimetype, request.args.get('format'))
+    if fmt is None:
+        return jsonify({'success': False, 'message': 'Send NDJSON (application/x-ndjson) or CSV (text/csv)'}), 415
+    report = bulk.ImportReport()
+    try:
+        conn = get_db(SPONSOR_DATABASE)
+        c = conn.cursor()
+        # New scholarships without a sponsor_id go to the first sponsor, as with POST /api/scholarships
+        c.execute('SELECT id FROM sponsor_profiles LIMIT 1')
+        sponsor_row = c.fetchone()
+        write = bulk.write_scholarships(conn, sponsor_row[0] if sponsor_row else None)
+        bulk.run_import(bulk.read_records(request.stream, fmt), bulk.SCHOLARSHIP_FIELDS, write, report,
+                        partial_updates=True)
+        return jsonify({'success': True, **report.as_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e), **report.as_dict()}), 500
+    finally:
+        if report.inserted or report.updated:
+            versions.bump(SPONSOR_DATABASE, 'scholarships')
+
+SCHOLARSHIP_EXPORT_COLUMNS = ['id', 'sponsor_id', 'title', 'description', 'amount', 'currency', 'gender_criteria',
+                              'family_income_max', 'location_type', 'min_academic_percentage',
+                              'application_deadline', 'is_active', 'created_at', 'updated_at']
+
+@app.route('/api/scholarships/export', methods=['GET'])
+@admin_required
+def export_scholarships():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in bulk.FORMATS:
+        return jsonify({'success': False, 'message': f'format must be one of: {", ".join(bulk.FORMATS)}'}), 400
+    try:
+        c = get_db(SPONSOR_DATABASE).cursor()
+        where = 'WHERE is_active = 1 ' if request.args.get('active') in ('1', 'true') else ''
+        c.execute(f'SELECT {", ".join(SCHOLARSHIP_EXPORT_COLUMNS)} FROM scholarships {where}ORDER BY id')
+        return bulk.stream_records(SCHOLARSHIP_EXPORT_COLUMNS, jsonstream.iter_rows(c), fmt, 'scholarships')
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+def parse_eligibility_limit(data):
+    """Optional top-k from a request body; raises ValueError when it isn't a positive integer."""
+    limit = data.get('limit')
+    if limit is None:
+        return None
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return limit
+
 @app.route('/api/scholarships/eligible', methods=['POST'])
 def get_eligible_scholarships():
-    # Get scholarships that match student criteria
+    # Get scholarships that match student criteria, highest amount first
     try:
         data = request.get_json()
-        student_gender = data.get('gender')
-        student_family_income = data.get('family_income')
-        student_location_type = data.get('location_type')
-        student_academic_percentage = data.get('academic_percentage')
-        
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        # Build query with criteria matching
-        query = '''
-            SELECT s.*, sp.name as sponsor_name, sp.company_name 
-            FROM scholarships s 
-            JOIN sponsor_profiles sp ON s.sponsor_id = sp.id 
-            WHERE s.is_active = 1
-        '''
-        params = []
-        
-        # Add criteria filters
-        if student_gender and student_gender != 'Any':
-            query += ' AND (s.gender_criteria IS NULL OR s.gender_criteria = ? OR s.gender_criteria = "Any")'
-            params.append(student_gender)
-        
-        if student_family_income is not None:
-            query += ' AND (s.family_income_max IS NULL OR s.family_income_max >= ?)'
-            params.append(student_family_income)
-        
-        if student_location_type:
-            query += ' AND (s.location_type IS NULL OR s.location_type = ? OR s.location_type = "Any")'
-            params.append(student_location_type)
-        
-        if student_academic_percentage is not None:
-            query += ' AND (s.min_academic_percentage IS NULL OR s.min_academic_percentage <= ?)'
-            params.append(student_academic_percentage)
-        
-        query += ' ORDER BY s.amount DESC'
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': 'Invalid student criteria'}), 400
+        try:
+            limit = parse_eligibility_limit(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
-        c.execute(query, params)
-        scholarships = []
-        for row in c.fetchall():
-            scholarships.append({
-                'id': row[0],
-                'sponsor_id': row[1],
-                'title': row[2],
-                'description': row[3],
-                'amount': row[4],
-                'currency': row[5],
-                'gender_criteria': row[6],
-                'family_income_max': row[7],
-                'location_type': row[8],
-                'min_academic_percentage': row[9],
-                'application_deadline': row[10],
-                'is_active': row[11],
-                'created_at': row[12],
-                'updated_at': row[13],
-                'sponsor_name': row[14],
-                'company_name': row[15]
+        scholarships = eligibility.get_index(SPONSOR_DATABASE).eligible(data, limit)
+        return jsonify({'success': True, 'scholarships': scholarships})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+ELIGIBILITY_BATCH_MAX_STUDENTS = 10000
+
+@app.route('/api/scholarships/eligible/batch', methods=['POST'])
+def get_eligible_scholarships_batch():
+    # Match many students in one call; scholarship details are listed once
+    try:
+        data = request.get_json()
+        students = data.get('students') if isinstance(data, dict) else None
+        if not isinstance(students, list) or not all(isinstance(s, dict) for s in students):
+            return jsonify({'success': False, 'message': 'students must be a list of criteria objects'}), 400
+        if len(students) > ELIGIBILITY_BATCH_MAX_STUDENTS:
+            return jsonify({
+                'success': False,
+                'message': f'At most {ELIGIBILITY_BATCH_MAX_STUDENTS} students per request'
+            }), 400
+        try:
+            limit = parse_eligibility_limit(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        matches, records = eligibility.get_index(SPONSOR_DATABASE).eligible_batch(students, limit)
+        results = []
+        for i, (student, scholarship_ids) in enumerate(zip(students, matches)):
+            results.append({
+                'student_id': student.get('id', i),
+                'scholarship_ids': scholarship_ids
             })
-        conn.close()
         
-        return jsonify({'success': True, 'scholarships': scholarships})
+        return jsonify({
+            'success': True,
+            'results': results,
+            'scholarships': sorted(records.values(), key=lambda r: r['id'])
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 # Scholarship Applications API endpoints
+# Submissions are batched by one writer thread per process (see groupcommit.py)
+application_writer = groupcommit.GroupCommitter(APPLICATIONS_DATABASE, '''
+    INSERT INTO scholarship_applications (scholarship_id, student_data, application_message,
+                                          applicant_gender, applicant_family_income,
+                                          applicant_academic_percentage, applicant_location_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+''', 'applications')
+
 @app.route('/api/scholarship-applications', methods=['POST'])
 def apply_for_scholarship():
     try:
@@ -955,65 +1485,226 @@ def apply_for_scholarship():
         
         if not scholarship_id:
             return jsonify({'success': False, 'message': 'Missing scholarship ID'}), 400
+        if isinstance(scholarship_id, str) and scholarship_id.isdigit():
+            scholarship_id = int(scholarship_id)
         
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        
-        # Check if scholarship exists and is active
-        c.execute('SELECT id FROM scholarships WHERE id = ? AND is_active = 1', (scholarship_id,))
-        if not c.fetchone():
-            conn.close()
+        # Check if scholarship exists and is active, against the in-memory copy
+        if not eligibility.get_index(SPONSOR_DATABASE).is_active(scholarship_id):
             return jsonify({'success': False, 'message': 'Scholarship not found or inactive'}), 404
         
-        # Insert application
-        c.execute('''
-            INSERT INTO scholarship_applications (scholarship_id, student_data, application_message)
-            VALUES (?, ?, ?)
-        ''', (scholarship_id, json.dumps(student_data), application_message))
-        
-        conn.commit()
-        conn.close()
+        # Insert application; the attributes sponsors filter on get their own
+        # columns. Returns once the batch it was committed in is durable.
+        application_writer.submit((scholarship_id, json.dumps(student_data), application_message)
+                                  + applicants.column_values(student_data))
         
         return jsonify({'success': True, 'message': 'Application submitted successfully'})
+    except groupcommit.TimeoutError:
+        return jsonify({'success': False, 'message': 'Too many applications right now, please retry'}), 503
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/admin/application-queue', methods=['GET'])
+@admin_required
+def get_application_queue_stats():
+    return jsonify({
+        'success': True,
+        'queued': application_writer.queued(),
+        'batch_rows_limit': application_writer.batch_rows,
+        'batch_delay_ms': application_writer.batch_delay * 1000,
+        **application_writer.stats.snapshot()
+    })
+
+# Fields the applications list can return, and the column behind each
+APPLICATION_FIELDS = {
+    'id': 'sa.id',
+    'scholarship_id': 'sa.scholarship_id',
+    'student_data': 'sa.student_data',
+    'application_message': 'sa.application_message',
+    'status': 'sa.status',
+    'applied_at': 'sa.applied_at',
+    'reviewed_at': 'sa.reviewed_at',
+    'scholarship_title': 's.title',
+    'amount': 's.amount',
+    'currency': 's.currency',
+    'sponsor_name': 'sp.name',
+    'company_name': 'sp.company_name',
+    'gender': 'sa.applicant_gender',
+    'family_income': 'sa.applicant_family_income',
+    'academic_percentage': 'sa.applicant_academic_percentage',
+    'location_type': 'sa.applicant_location_type',
+}
+APPLICATION_SORTS = {
+    'applied_at': 'sa.applied_at',
+    'academic_percentage': 'sa.applicant_academic_percentage',
+    'family_income': 'sa.applicant_family_income',
+}
+APPLICATION_STATUSES = ('pending', 'accepted', 'rejected')
+APPLICATIONS_PAGE_SIZE = 50
+APPLICATIONS_MAX_LIMIT = 1000
+APPLICATION_FILTERS = ('scholarship_id', 'status', 'gender', 'location_type',
+                       'min_percentage', 'max_percentage', 'min_income', 'max_income')
+STATUS_BATCH_MAX = 10000
+
+def application_keyset(column, direction, value, last_id, nullable):
+    """Condition for rows after (value, last_id) in `direction` order; NULLs sort first ascending."""
+    if direction == 'DESC':
+        if value is None:
+            return f'({column} IS NULL AND sa.id < ?)', [last_id]
+        condition = f'{column} < ? OR ({column} = ? AND sa.id < ?)'
+        if nullable:
+            condition += f' OR {column} IS NULL'
+        return f'({condition})', [value, value, last_id]
+    if value is None:
+        return f'(({column} IS NULL AND sa.id > ?) OR {column} IS NOT NULL)', [last_id]
+    return f'({column} > ? OR ({column} = ? AND sa.id > ?))', [value, value, last_id]
+
+def parse_application_filters(args):
+    """Build (conditions, params) on `sa` columns from the filter arguments.
+
+    Raises ValueError with a message for the client on bad input.
+    """
+    conditions = []
+    params = []
+    if args.get('scholarship_id'):
+        if not args['scholarship_id'].isdigit():
+            raise ValueError('scholarship_id must be an integer')
+        conditions.append('sa.scholarship_id = ?')
+        params.append(int(args['scholarship_id']))
+    if args.get('status'):
+        if args['status'] not in APPLICATION_STATUSES:
+            raise ValueError(f"status must be one of: {', '.join(APPLICATION_STATUSES)}")
+        conditions.append('sa.status = ?')
+        params.append(args['status'])
+    for name in ('gender', 'location_type'):
+        if args.get(name):
+            conditions.append(f'{APPLICATION_FIELDS[name]} = ?')
+            params.append(args[name])
+    for name, prefix in (('academic_percentage', 'percentage'), ('family_income', 'income')):
+        for bound, operator in (('min', '>='), ('max', '<=')):
+            value = args.get(f'{bound}_{prefix}')
+            if value in (None, ''):
+                continue
+            number = applicants.to_number(value)
+            if number is None:
+                raise ValueError(f'{bound}_{prefix} must be a number')
+            conditions.append(f'{APPLICATION_FIELDS[name]} {operator} ?')
+            params.append(number)
+    return conditions, params
+
+def parse_application_query(args):
+    """Build (fields, where, params, sort, limit) from the list's query string.
+
+    `sort` is (name, column, direction). `limit` is None when every
+    matching application should be returned. Raises ValueError with a
+    message for the client on bad input.
+    """
+    fields = list(APPLICATION_FIELDS)
+    if args.get('fields'):
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in APPLICATION_FIELDS]
+        if unknown or not fields:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}" if unknown else 'No fields requested')
+    
+    conditions, params = parse_application_filters(args)
+    
+    sort = args.get('sort', '-applied_at')
+    direction = 'DESC' if sort.startswith('-') else 'ASC'
+    column = APPLICATION_SORTS.get(sort.lstrip('-'))
+    if column is None:
+        raise ValueError(f"sort must be one of: {', '.join(APPLICATION_SORTS)} (prefix - for descending)")
+    
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= APPLICATIONS_MAX_LIMIT:
+            raise ValueError(f'limit must be between 1 and {APPLICATIONS_MAX_LIMIT}')
+        limit = int(limit)
+    
+    cursor = decode_cursor(args.get('cursor'))
+    if cursor is not None:
+        # The cursor carries the sort it was made for and the last row's key
+        if not isinstance(cursor, list) or len(cursor) != 3 or cursor[0] != sort \
+                or not isinstance(cursor[2], int):
+            raise ValueError('Invalid cursor')
+        condition, values = application_keyset(column, direction, cursor[1], cursor[2],
+                                               sort.lstrip('-') != 'applied_at')
+        conditions.append(condition)
+        params.extend(values)
+        if limit is None:
+            limit = APPLICATIONS_PAGE_SIZE
+    
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return fields, where, params, (sort, column, direction), limit
+
 @app.route('/api/scholarship-applications', methods=['GET'])
 def get_scholarship_applications():
     try:
-        conn = sqlite3.connect(DATABASE)
+        fields, where, params, (sort, sort_column, direction), limit = parse_application_query(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    try:
+        conn = get_db(APPLICATIONS_DATABASE)
         c = conn.cursor()
         
-        # Get all applications with scholarship and sponsor details
-        c.execute('''
-            SELECT sa.*, s.title as scholarship_title, s.amount, s.currency,
-                   sp.name as sponsor_name, sp.company_name
+        # Applications with scholarship and sponsor details; only the
+        # requested columns are read and only returned rows are decoded.
+        # The sort key and id trail the requested columns for the cursor.
+        query = f'''
+            SELECT {', '.join(APPLICATION_FIELDS[f] for f in fields)}, {sort_column}, sa.id
             FROM scholarship_applications sa
             JOIN scholarships s ON sa.scholarship_id = s.id
             JOIN sponsor_profiles sp ON s.sponsor_id = sp.id
-            ORDER BY sa.applied_at DESC
-        ''')
+            {where}
+            ORDER BY {sort_column} {direction}, sa.id {direction}
+        '''
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        c.execute(query, params)
         
-        applications = []
-        for row in c.fetchall():
-            student_data = json.loads(row[2]) if row[2] else {}
-            applications.append({
-                'id': row[0],
-                'scholarship_id': row[1],
-                'student_data': student_data,
-                'application_message': row[3],
-                'status': row[4],
-                'applied_at': row[5],
-                'reviewed_at': row[6],
-                'scholarship_title': row[7],
-                'amount': row[8],
-                'currency': row[9],
-                'sponsor_name': row[10],
-                'company_name': row[11]
-            })
+        # Rows are decoded and sent as they are read; the cursor for the
+        # next page is known once the extra (limit + 1)th row shows up.
+        page = {'last': None, 'next_cursor': None}
+        
+        def applications():
+            for count, row in enumerate(jsonstream.iter_rows(c)):
+                if count == limit:
+                    last = page['last']
+                    page['next_cursor'] = encode_cursor([sort, last[-2], last[-1]])
+                    break
+                page['last'] = row
+                application = dict(zip(fields, row))
+                if 'student_data' in application:
+                    application['student_data'] = json.loads(application['student_data'] or '{}')
+                yield application
+        
+        return jsonstream.stream_list({'success': True}, 'applications', applications(),
+                                      trailer=lambda: {'next_cursor': page['next_cursor']})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/scholarship-applications/counts', methods=['GET'])
+def get_application_counts():
+    # Served from the trigger-maintained counter table, never the applications
+    scholarship_id = request.args.get('scholarship_id')
+    if scholarship_id and not scholarship_id.isdigit():
+        return jsonify({'success': False, 'message': 'scholarship_id must be an integer'}), 400
+    
+    try:
+        conn = get_db(APPLICATIONS_DATABASE)
+        c = conn.cursor()
+        if scholarship_id:
+            c.execute('SELECT status, count FROM application_status_counts WHERE scholarship_id = ?',
+                      (int(scholarship_id),))
+        else:
+            c.execute('SELECT status, SUM(count) FROM application_status_counts GROUP BY status')
         
-        conn.close()
-        return jsonify({'success': True, 'applications': applications})
+        counts = {status: 0 for status in APPLICATION_STATUSES}
+        for status, count in c.fetchall():
+            if count:
+                counts[status] = count
+        
+        return jsonify({'success': True, 'counts': counts, 'total': sum(counts.values())})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
@@ -1026,7 +1717,7 @@ def update_application_status(application_id):
         if status not in ['accepted', 'rejected', 'pending']:
             return jsonify({'success': False, 'message': 'Invalid status'}), 400
         
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db(APPLICATIONS_DATABASE)
         c = conn.cursor()
         
         # Update application status
@@ -1037,15 +1728,147 @@ def update_application_status(application_id):
         ''', (status, application_id))
         
         if c.rowcount == 0:
-            conn.close()
             return jsonify({'success': False, 'message': 'Application not found'}), 404
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'message': f'Application {status} successfully'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+def parse_status_batch(data):
+    """Return (statuses, status, filter) for a batch status change.
+
+    Either `statuses` maps application id to its new status (the last
+    entry for an id wins), or every application matching `filter`, as
+    (conditions, params) on `sa` columns, moves to `status`.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    
+    updates = data.get('updates')
+    if updates is not None:
+        if data.get('filter') is not None:
+            raise ValueError('Send either updates or a filter, not both')
+        if not isinstance(updates, list) or not 1 <= len(updates) <= STATUS_BATCH_MAX:
+            raise ValueError(f'updates must be a list of 1 to {STATUS_BATCH_MAX} items')
+        statuses = {}
+        for update in updates:
+            application_id = update.get('id') if isinstance(update, dict) else None
+            if not isinstance(application_id, int) or isinstance(application_id, bool):
+                raise ValueError('Every update needs an integer id')
+            if update.get('status') not in APPLICATION_STATUSES:
+                raise ValueError(f"status must be one of: {', '.join(APPLICATION_STATUSES)}")
+            statuses[application_id] = update['status']
+        return statuses, None, None
+    
+    status = data.get('status')
+    if status not in APPLICATION_STATUSES:
+        raise ValueError(f"status must be one of: {', '.join(APPLICATION_STATUSES)}")
+    filters = data.get('filter')
+    if not isinstance(filters, dict):
+        raise ValueError('Send updates, or a status and a filter')
+    unknown = [name for name in filters if name not in APPLICATION_FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown filter: {', '.join(unknown)}")
+    args = {}
+    for name, value in filters.items():
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f'{name} must be a string or a number')
+        args[name] = str(value)
+    conditions, params = parse_application_filters(args)
+    # An empty filter would change every application in the system
+    if not conditions:
+        raise ValueError('filter must name at least one condition')
+    return None, status, (conditions, params)
+
+@app.route('/api/scholarship-applications/status', methods=['POST'])
+def update_application_statuses():
+    try:
+        statuses, status, filters = parse_status_batch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    try:
+        conn = get_db(APPLICATIONS_DATABASE)
+        c = conn.cursor()
+        # Formatted like SQLite's CURRENT_TIMESTAMP, which the single update uses
+        reviewed_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        
+        # The whole review session is one transaction with one reviewed_at. It
+        # opens with an UPDATE rather than BEGIN IMMEDIATE, which would also
+        # take the write lock of the attached sponsorship database.
+        try:
+            if statuses is not None:
+                updated = {}
+                for application_id, new_status in statuses.items():
+                    c.execute('''
+                        UPDATE scholarship_applications SET status = ?, reviewed_at = ?
+                        WHERE id = ? AND status IS NOT ?
+                        RETURNING scholarship_id
+                    ''', (new_status, reviewed_at, application_id, new_status))
+                    row = c.fetchone()
+                    if row:
+                        updated[application_id] = row[0]
+                
+                # Of the rest, the ones that exist already had their status
+                existing = set()
+                rest = [application_id for application_id in statuses if application_id not in updated]
+                for start in range(0, len(rest), 500):
+                    chunk = rest[start:start + 500]
+                    c.execute(f'''
+                        SELECT id FROM scholarship_applications
+                        WHERE id IN ({', '.join('?' * len(chunk))})
+                    ''', chunk)
+                    existing.update(row[0] for row in c.fetchall())
+                
+                results = [{
+                    'id': application_id,
+                    'status': new_status,
+                    'result': 'updated' if application_id in updated
+                              else 'unchanged' if application_id in existing else 'not_found'
+                } for application_id, new_status in statuses.items()]
+                scholarship_ids = set(updated.values())
+            else:
+                conditions, params = filters
+                # Applications already in the target status keep their reviewed_at
+                c.execute(f'''
+                    UPDATE scholarship_applications SET status = ?, reviewed_at = ?
+                    WHERE id IN (
+                        SELECT sa.id FROM scholarship_applications sa
+                        WHERE {' AND '.join(conditions)} AND sa.status IS NOT ?
+                    )
+                    RETURNING id, scholarship_id
+                ''', [status, reviewed_at, *params, status])
+                rows = sorted(c.fetchall())
+                results = [{'id': application_id, 'status': status, 'result': 'updated'}
+                           for application_id, _scholarship_id in rows]
+                scholarship_ids = {scholarship_id for _id, scholarship_id in rows}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        # Status totals for every scholarship touched, read once the write lock is released
+        counts = {scholarship_id: {name: 0 for name in APPLICATION_STATUSES} for scholarship_id in scholarship_ids}
+        if scholarship_ids:
+            c.execute(f'''
+                SELECT scholarship_id, status, count FROM application_status_counts
+                WHERE scholarship_id IN ({', '.join('?' * len(scholarship_ids))})
+            ''', list(scholarship_ids))
+            for scholarship_id, name, count in c.fetchall():
+                if name in APPLICATION_STATUSES:
+                    counts[scholarship_id][name] = count
+        
+        return jsonify({
+            'success': True,
+            'reviewed_at': reviewed_at,
+            'updated': sum(1 for result in results if result['result'] == 'updated'),
+            'results': results,
+            'counts': {str(scholarship_id): counts[scholarship_id] for scholarship_id in sorted(counts)}
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
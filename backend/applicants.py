@@ -0,0 +1,114 @@
+"""
+Applicant attributes extracted from scholarship_applications.student_data.
+
+student_data is the profile the student's browser sent. Today that is the
+{personal, academic, residential} object of /api/student/profile; older
+applications used personal_data/academic_data/residential_data or flat
+keys. extract() pulls family income and academic percentage out of any of
+them so they can be stored in indexed columns when the application is
+inserted. The profile form doesn't ask for gender or location type, so
+those are only found in flat keys sent by other clients.
+"""
+
+import json
+import math
+
+# Attribute -> (column, candidate key paths inside student_data)
+ATTRIBUTES = {
+    'gender': ('applicant_gender', [('gender',)]),
+    'family_income': ('applicant_family_income', [
+        ('personal', 'financial'), ('personal_data', 'financial'), ('family_income',),
+    ]),
+    # School students give last year's percentage, college students their
+    # class 12 and class 10 results.
+    'academic_percentage': ('applicant_academic_percentage', [
+        ('academic', 'schoolPercent'), ('academic', 'class12Perc'), ('academic', 'class10Perc'),
+        ('academic_data', 'schoolPercent'), ('academic_data', 'class12Perc'), ('academic_data', 'class10Perc'),
+        ('academic_percentage',),
+    ]),
+    'location_type': ('applicant_location_type', [('location_type',)]),
+}
+
+# The profile form's income ranges, stored as their upper bound so that a
+# scholarship's family_income_max compares the way a sponsor expects. The
+# open-ended range sorts just above the 10 lakh cap.
+INCOME_RANGES = {
+    'Below 1 Lakh': 100000,
+    '1-3 Lakhs': 300000,
+    '3-5 Lakhs': 500000,
+    '5-10 Lakhs': 1000000,
+    'Above 10 Lakhs': 1000001,
+}
+
+COLUMNS = [column for column, _paths in ATTRIBUTES.values()]
+
+
+def _lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def to_number(value):
+    """Parse numbers the forms send as text ("85", "2,50,000"); None when it isn't one."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        try:
+            value = float(value.replace(',', '').strip())
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and math.isfinite(value):
+        return value
+    return None
+
+
+def to_income(value):
+    """Parse a family income: one of the form's INCOME_RANGES or a plain number."""
+    if isinstance(value, str) and value.strip() in INCOME_RANGES:
+        return INCOME_RANGES[value.strip()]
+    return to_number(value)
+
+
+NUMERIC_ATTRIBUTES = {'family_income': to_income, 'academic_percentage': to_number}
+
+
+def extract(student_data):
+    """Return {attribute: value} for a decoded student_data object."""
+    values = {}
+    for name, (_column, paths) in ATTRIBUTES.items():
+        value = None
+        for path in paths:
+            value = _lookup(student_data, path)
+            if value not in (None, ''):
+                break
+        if name in NUMERIC_ATTRIBUTES:
+            value = NUMERIC_ATTRIBUTES[name](value)
+        elif not isinstance(value, str) or not value.strip():
+            value = None
+        else:
+            value = value.strip()
+        values[name] = value
+    return values
+
+
+def column_values(student_data):
+    """extract() as a tuple in COLUMNS order, ready to bind into an INSERT."""
+    values = extract(student_data)
+    return tuple(values[name] for name in ATTRIBUTES)
+
+
+def backfill(conn):
+    """Migration step: fill the applicant columns of existing applications."""
+    rows = conn.execute('SELECT id, student_data FROM scholarship_applications').fetchall()
+    updates = []
+    for application_id, student_data in rows:
+        try:
+            decoded = json.loads(student_data) if student_data else {}
+        except ValueError:
+            decoded = {}
+        updates.append(column_values(decoded) + (application_id,))
+    assignments = ', '.join(f'{column} = ?' for column in COLUMNS)
+    conn.executemany(f'UPDATE scholarship_applications SET {assignments} WHERE id = ?', updates)
@@ -0,0 +1,198 @@
+"""
+Content-addressed store for uploaded files.
+
+Every uploaded file is hashed (SHA-256) as it is received and kept once
+under uploads/blobs/<aa>/<bb>/<digest>. The blobs table counts how many
+rows point at each digest; a file is only removed when its last reference
+goes away.
+
+add_ref() and release_ref() must run inside the caller's write transaction
+(they issue the write that takes SQLite's lock before touching the file
+system), so placing and removing a blob can't interleave across workers.
+
+Run `python blobstore.py migrate-uploads` once to move files uploaded before
+the store existed into it.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+UPLOAD_ROOT = os.path.join(BACKEND_DIR, 'uploads')
+BLOB_ROOT = os.path.join(UPLOAD_ROOT, 'blobs')
+TEMP_DIR = os.path.join(UPLOAD_ROOT, '.partial')
+
+COPY_BUFFER_SIZE = 1024 * 1024
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def blob_relpath(digest):
+    """Path of a blob relative to the backend directory, as stored in file_path columns."""
+    return os.path.join('uploads', 'blobs', digest[:2], digest[2:4], digest)
+
+
+def blob_path(digest):
+    return os.path.join(BACKEND_DIR, blob_relpath(digest))
+
+
+def receive(stream):
+    """Copy `stream` to a temp file while hashing it; returns (temp_path, digest, size)."""
+    os.makedirs(TEMP_DIR, exist_ok=True)
+    temp_path = os.path.join(TEMP_DIR, f'{uuid.uuid4().hex}.tmp')
+    sha = hashlib.sha256()
+    size = 0
+    with open(temp_path, 'wb') as f:
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b''):
+            sha.update(block)
+            f.write(block)
+            size += len(block)
+    return temp_path, sha.hexdigest(), size
+
+
+def hash_file(path):
+    """Return (digest, size) of a file already on disk."""
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b''):
+            sha.update(block)
+            size += len(block)
+    return sha.hexdigest(), size
+
+
+def add_ref(c, temp_path, digest, size):
+    """Reference the blob for `digest`, moving `temp_path` into place if it is new.
+
+    The temp file is consumed either way. Returns the blob's relative path.
+    """
+    c.execute('''
+        INSERT INTO blobs (digest, size, ref_count) VALUES (?, ?, 1)
+        ON CONFLICT (digest) DO UPDATE SET ref_count = ref_count + 1
+    ''', (digest, size))
+    path = blob_path(digest)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    return blob_relpath(digest)
+
+
+def release_ref(c, digest):
+    """Drop one reference to `digest`.
+
+    When it was the last one the blob is moved aside and its trash path is
+    returned: pass it to empty_trash() after commit, or restore() on rollback.
+    """
+    c.execute('UPDATE blobs SET ref_count = ref_count - 1 WHERE digest = ?', (digest,))
+    c.execute('DELETE FROM blobs WHERE digest = ? AND ref_count <= 0', (digest,))
+    if c.rowcount == 0:
+        return None
+    path = blob_path(digest)
+    trash_path = f'{path}.{uuid.uuid4().hex}.deleted'
+    try:
+        os.replace(path, trash_path)
+    except FileNotFoundError:
+        return None
+    return trash_path
+
+
+def empty_trash(trash_path):
+    if not trash_path:
+        return
+    try:
+        os.remove(trash_path)
+    except OSError as e:
+        print(f"Warning: Could not delete file {trash_path}: {e}")
+
+
+def restore(trash_path):
+    if trash_path:
+        os.replace(trash_path, trash_path.rsplit('.', 2)[0])
+
+
+def discard(temp_path):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def locate_file(file_path):
+    """Absolute path of the file a row's file_path refers to, or None if it is gone."""
+    # Rows written before the store hold absolute paths from whichever
+    # machine uploaded them; fall back to the part below "uploads".
+    if not file_path:
+        return None
+    candidates = [file_path, os.path.join(BACKEND_DIR, file_path)]
+    parts = file_path.replace('\\', '/').split('/')
+    if 'uploads' in parts:
+        last = len(parts) - 1 - parts[::-1].index('uploads')
+        candidates.append(os.path.join(UPLOAD_ROOT, *parts[last + 1:]))
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return os.path.abspath(candidate)
+    return None
+
+
+LEGACY_COLUMNS = [
+    ('uploaded_notes', 'file_path', 'blob_digest'),
+    ('uploaded_videos', 'file_path', 'blob_digest'),
+    ('sponsor_profiles', 'tax_registration_path', 'tax_registration_digest'),
+]
+
+
+def migrate_uploads(database):
+    """Move every file referenced by a pre-store row into the blob store."""
+    import domains
+    from db import connect
+    from migrations import MAIN_MIGRATIONS, SPONSORSHIP_MIGRATIONS, migrate
+
+    migrate(database, MAIN_MIGRATIONS)
+    sponsorship = domains.paths(database)[0]
+    migrate(sponsorship, SPONSORSHIP_MIGRATIONS)
+    # Sponsor documents are referenced from the sponsorship database
+    conn = connect(database, {'sponsorship': sponsorship})
+    c = conn.cursor()
+    originals = set()
+    migrated = missing = 0
+    for table, path_column, digest_column in LEGACY_COLUMNS:
+        c.execute(f'SELECT id, {path_column} FROM {table} '
+                  f'WHERE {digest_column} IS NULL AND {path_column} IS NOT NULL')
+        for row_id, file_path in c.fetchall():
+            source = locate_file(file_path)
+            if source is None:
+                missing += 1
+                continue
+            digest, size = hash_file(source)
+            os.makedirs(TEMP_DIR, exist_ok=True)
+            temp_path = os.path.join(TEMP_DIR, f'{uuid.uuid4().hex}.tmp')
+            with open(source, 'rb') as src, open(temp_path, 'wb') as dst:
+                for block in iter(lambda: src.read(COPY_BUFFER_SIZE), b''):
+                    dst.write(block)
+            relpath = add_ref(c, temp_path, digest, size)
+            c.execute(f'UPDATE {table} SET {path_column} = ?, {digest_column} = ? WHERE id = ?',
+                      (relpath, digest, row_id))
+            conn.commit()
+            originals.add(source)
+            migrated += 1
+
+    # Originals go only once every row that pointed at them has moved
+    for source in originals:
+        os.remove(source)
+    conn.close()
+    return migrated, missing
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['migrate-uploads']:
+        os.chdir(BACKEND_DIR)
+        database = sys.argv[2] if len(sys.argv) > 2 else 'teacher_profiles.db'
+        migrated, missing = migrate_uploads(database)
+        print(f'Moved {migrated} files into the blob store; {missing} rows point at missing files')
+    else:
+        print('usage: python blobstore.py migrate-uploads [database]')
+        sys.exit(2)
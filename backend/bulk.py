@@ -0,0 +1,515 @@
+"""
+Bulk import and export of scholarships and study-material metadata.
+
+Both directions speak NDJSON (one JSON object per line) and CSV (a header
+row, then one row per record), and both stream. An import reads the request
+body a line at a time, validates each record on its own and writes the
+valid ones with executemany(), CHUNK_ROWS to a transaction, so memory holds
+one chunk whatever the size of the upload and request writers get the lock
+between chunks. Records that fail validation, or are refused when written
+(an unknown id, for example), are listed in the report by line number; the
+rest are imported. An export is streamed from a cursor with fetchmany()
+and emits the columns an import accepts, so exported files can be edited
+and imported back: records that carry an id update that row (a material's
+file stays as it is; only a link video's URL can change).
+"""
+
+import csv
+import io
+import json
+import math
+import os
+from datetime import date
+
+from flask import current_app, stream_with_context
+
+import blobstore
+import db
+from jsonstream import CHUNK_BYTES
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+CHUNK_ROWS = int(os.environ.get('EDVANCE_IMPORT_CHUNK_ROWS', '500'))
+# The report lists this many failed records; the rest are only counted
+MAX_ERRORS = 1000
+
+
+def request_format(mimetype, requested=None):
+    """The format named by `requested`, or else by the body's `mimetype`; None if unsupported."""
+    if requested:
+        return requested if requested in FORMATS else None
+    for name, format_mimetype in FORMATS.items():
+        if mimetype == format_mimetype:
+            return name
+    return 'ndjson' if mimetype in ('application/ndjson', 'application/jsonl') else None
+
+
+# Reading
+
+def read_records(stream, fmt):
+    """Yield (line, record) for each record in `stream`; record is a dict, or a
+    string saying why the line couldn't be read."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                if None in row:
+                    yield reader.line_num, f'has {len(row[None])} more fields than the header'
+                else:
+                    yield reader.line_num, row
+        except (csv.Error, UnicodeDecodeError) as e:
+            yield reader.line_num, f'unreadable CSV: {e}'
+        return
+    line = 0
+    try:
+        for line, text_line in enumerate(text, 1):
+            if not text_line.strip():
+                continue
+            try:
+                record = json.loads(text_line)
+            except ValueError as e:
+                yield line, f'invalid JSON: {e}'
+                continue
+            yield line, record if isinstance(record, dict) else 'not a JSON object'
+    except UnicodeDecodeError as e:
+        yield line + 1, f'not UTF-8: {e}'
+
+
+# Validation. Each field check takes the raw value (a string from CSV, any
+# JSON value from NDJSON) and returns the value to store or raises ValueError.
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def text(required=False, max_length=500):
+    def check(value):
+        if _blank(value):
+            if required:
+                raise ValueError('is required')
+            return None
+        if not isinstance(value, str):
+            raise ValueError('must be a string')
+        value = value.strip()
+        if len(value) > max_length:
+            raise ValueError(f'must be at most {max_length} characters')
+        return value
+    return check
+
+
+def number(required=False, minimum=None, maximum=None):
+    def check(value):
+        if _blank(value):
+            if required:
+                raise ValueError('is required')
+            return None
+        if isinstance(value, bool):
+            raise ValueError('must be a number')
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise ValueError('must be a number') from None
+        if not math.isfinite(value):
+            raise ValueError('must be a number')
+        if minimum is not None and value < minimum:
+            raise ValueError(f'must be at least {minimum}')
+        if maximum is not None and value > maximum:
+            raise ValueError(f'must be at most {maximum}')
+        return value
+    return check
+
+
+def identifier(value):
+    if _blank(value):
+        return None
+    if isinstance(value, bool):
+        raise ValueError('must be a positive integer')
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('must be a positive integer') from None
+    if value < 1:
+        raise ValueError('must be a positive integer')
+    return value
+
+
+def iso_date(value):
+    if _blank(value):
+        return None
+    try:
+        return date.fromisoformat(str(value).strip()).isoformat()
+    except ValueError:
+        raise ValueError('must be a date (YYYY-MM-DD)') from None
+
+
+def flag(default):
+    def check(value):
+        if _blank(value):
+            return default
+        if isinstance(value, bool) or value in (0, 1):
+            return int(value)
+        if isinstance(value, str) and value.strip().lower() in ('1', 'true', 'yes'):
+            return 1
+        if isinstance(value, str) and value.strip().lower() in ('0', 'false', 'no'):
+            return 0
+        raise ValueError('must be true or false')
+    return check
+
+
+def choice(*options, required=False):
+    def check(value):
+        if _blank(value):
+            if required:
+                raise ValueError('is required')
+            return None
+        if value not in options:
+            raise ValueError(f'must be one of: {", ".join(options)}')
+        return value
+    return check
+
+
+def currency(value):
+    if _blank(value):
+        return 'INR'
+    if not (isinstance(value, str) and len(value.strip()) == 3 and value.strip().isalpha()):
+        raise ValueError('must be a three-letter currency code')
+    return value.strip().upper()
+
+
+def digest(value):
+    if _blank(value):
+        return None
+    if not (isinstance(value, str) and blobstore.DIGEST.match(value.strip().lower())):
+        raise ValueError('must be a SHA-256 hex digest')
+    return value.strip().lower()
+
+
+SCHOLARSHIP_FIELDS = {
+    'id': identifier,
+    'sponsor_id': identifier,
+    'title': text(required=True, max_length=200),
+    'description': text(required=True, max_length=5000),
+    'amount': number(required=True, minimum=0),
+    'currency': currency,
+    'gender_criteria': text(max_length=50),
+    'family_income_max': number(minimum=0),
+    'location_type': text(max_length=50),
+    'min_academic_percentage': number(minimum=0, maximum=100),
+    'application_deadline': iso_date,
+    'is_active': flag(default=1),
+}
+
+MATERIAL_FIELDS = {
+    'type': choice('notes', 'videos', required=True),
+    'id': identifier,
+    'standard': text(required=True, max_length=100),
+    'subject': text(required=True, max_length=100),
+    'topic': text(required=True, max_length=200),
+    'file_name': text(max_length=255),
+    'video_url': text(max_length=2000),
+    'blob_digest': digest,
+}
+
+
+def validate(record, fields, partial=False):
+    """Return (values, errors) for `record`; fields it doesn't know are ignored.
+
+    With `partial`, fields the record leaves out are left out of `values`
+    too, rather than checked as blank.
+    """
+    values = {}
+    errors = {}
+    for name, check in fields.items():
+        if partial and name not in record:
+            continue
+        try:
+            values[name] = check(record.get(name))
+        except ValueError as e:
+            errors[name] = str(e)
+    return values, errors
+
+
+def check_material(values):
+    """Cross-field rules for a material record; returns errors by field."""
+    if values['id'] is not None:
+        # An existing material keeps its file; blob_digest is ignored
+        return {}
+    if values['type'] == 'notes' and not values['blob_digest']:
+        return {'blob_digest': 'a new note needs the digest of a file in the blob store'}
+    if values['type'] == 'videos' and bool(values['blob_digest']) == bool(values['video_url']):
+        return {'video_url': 'a new video needs either video_url or blob_digest'}
+    return {}
+
+
+class ImportReport:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def merge(self, other):
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.failed += other.failed
+        self.errors.extend(other.errors[:MAX_ERRORS - len(self.errors)])
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'failed': self.failed,
+            # Records refused when written come after the chunk's invalid ones
+            'errors': sorted(self.errors, key=lambda error: error['line']),
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def run_import(records, fields, write, report, check=None, partial_updates=False):
+    """Validate `records` and pass the valid ones to `write` CHUNK_ROWS at a time.
+
+    `write(chunk, report)` gets a list of (line, values), writes them in one
+    transaction and records what happened in `report`. `check(values)` adds
+    rules across fields. With `partial_updates`, records that carry an id
+    are validated with validate(partial=True), so `write` only sees the
+    fields they give.
+    """
+    chunk = []
+    for line, record in records:
+        report.received += 1
+        if isinstance(record, str):
+            report.fail(line, {'record': record})
+            continue
+        partial = partial_updates and not _blank(record.get('id'))
+        values, errors = validate(record, fields, partial)
+        if not errors and check is not None:
+            errors = check(values)
+        if errors:
+            report.fail(line, errors)
+            continue
+        chunk.append((line, values))
+        if len(chunk) >= CHUNK_ROWS:
+            _write_chunk(write, chunk, report)
+            chunk = []
+    if chunk:
+        _write_chunk(write, chunk, report)
+    return report
+
+
+def _write_chunk(write, chunk, report):
+    # What write() records only counts once its transaction has committed
+    written = ImportReport()
+    try:
+        write(chunk, written)
+    except Exception as e:
+        # write() rolled back: nothing from this chunk was stored
+        for line, _values in chunk:
+            report.fail(line, {'record': f'not stored: {e}'})
+        return
+    report.merge(written)
+
+
+def _existing_ids(c, table, ids):
+    ids = list(ids)
+    found = set()
+    # Stay well below SQLite's bound-parameter limit
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start + 500]
+        c.execute(f'SELECT id FROM {table} WHERE id IN ({", ".join("?" * len(batch))})', batch)
+        found.update(row[0] for row in c.fetchall())
+    return found
+
+
+def _split_updates(c, table, chunk, report, label):
+    """Split `chunk` into (inserts, updates), failing records whose id doesn't exist."""
+    existing = _existing_ids(c, table, {values['id'] for _line, values in chunk if values['id'] is not None})
+    inserts, updates = [], []
+    for line, values in chunk:
+        if values['id'] is None:
+            inserts.append((line, values))
+        elif values['id'] in existing:
+            updates.append((line, values))
+        else:
+            report.fail(line, {'id': f'{label} {values["id"]} not found'})
+    return inserts, updates
+
+
+def write_scholarships(conn, default_sponsor_id):
+    """A `write` for run_import(partial_updates=True) storing scholarship records through `conn`.
+
+    An update only sets the columns its record gives; a blank sponsor_id
+    keeps the scholarship's sponsor. New scholarships without a sponsor_id
+    go to `default_sponsor_id`.
+    """
+    columns = [name for name in SCHOLARSHIP_FIELDS if name != 'id']
+    insert = (f'INSERT INTO scholarships ({", ".join(columns)}) '
+              f'VALUES ({", ".join("?" * len(columns))})')
+
+    def write(chunk, report):
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            sponsors = {values['sponsor_id'] for _line, values in chunk if values.get('sponsor_id') is not None}
+            known_sponsors = _existing_ids(c, 'sponsor_profiles', sponsors)
+            accepted = []
+            for line, values in chunk:
+                if values.get('sponsor_id') is None:
+                    if values['id'] is not None:
+                        values.pop('sponsor_id', None)
+                        accepted.append((line, values))
+                        continue
+                    values['sponsor_id'] = default_sponsor_id
+                if values['sponsor_id'] is None:
+                    report.fail(line, {'sponsor_id': 'is required when there is no sponsor profile'})
+                elif values['sponsor_id'] in known_sponsors or values['sponsor_id'] == default_sponsor_id:
+                    accepted.append((line, values))
+                else:
+                    report.fail(line, {'sponsor_id': f'sponsor {values["sponsor_id"]} not found'})
+            inserts, updates = _split_updates(c, 'scholarships', accepted, report, 'scholarship')
+            c.executemany(insert, [[values[name] for name in columns] for _line, values in inserts])
+            # One statement per set of columns given
+            by_columns = {}
+            for _line, values in updates:
+                given = tuple(name for name in columns if name in values)
+                by_columns.setdefault(given, []).append([values[name] for name in given] + [values['id']])
+            for given, rows in by_columns.items():
+                assignments = ''.join(f'{name} = ?, ' for name in given)
+                c.executemany(f'UPDATE scholarships SET {assignments}updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                              rows)
+            c.execute('COMMIT')
+        except Exception:
+            c.execute('ROLLBACK')
+            raise
+        report.inserted += len(inserts)
+        report.updated += len(updates)
+
+    return write
+
+
+MATERIAL_TABLES = {'notes': 'uploaded_notes', 'videos': 'uploaded_videos'}
+# What media_jobs and error messages call one of each
+MATERIAL_ITEMS = {'notes': 'note', 'videos': 'video'}
+
+
+def write_materials(conn):
+    """A `write` for run_import() storing study-material records through `conn`.
+
+    New notes and video files refer to a blob already in the store (one
+    uploaded to another material, or moved in with `blobstore.py`); new
+    link videos carry their URL. Inserted notes and video files are queued
+    for ingestion like uploads; call ingest.notify() afterwards.
+    """
+    import ingest
+
+    def write(chunk, report):
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            # Blob references are taken in this transaction, as uploads take them
+            digests = list({values['blob_digest'] for _line, values in chunk if values['blob_digest']})
+            known = set()
+            for start in range(0, len(digests), 500):
+                batch = digests[start:start + 500]
+                c.execute(f'SELECT digest FROM blobs WHERE digest IN ({", ".join("?" * len(batch))})', batch)
+                known.update(row[0] for row in c.fetchall())
+            inserted = updated = 0
+            for kind, table in MATERIAL_TABLES.items():
+                rows = []
+                for line, values in chunk:
+                    if values['type'] != kind:
+                        continue
+                    if values['blob_digest'] and values['blob_digest'] not in known:
+                        report.fail(line, {'blob_digest': 'no file with this digest in the blob store'})
+                        continue
+                    rows.append((line, values))
+                inserts, updates = _split_updates(c, table, rows, report, MATERIAL_ITEMS[kind])
+
+                # Keep the current file name (and link) when an update leaves it out
+                if kind == 'notes':
+                    c.executemany('''
+                        UPDATE uploaded_notes SET standard = ?, subject = ?, topic = ?, file_name = coalesce(?, file_name)
+                        WHERE id = ?
+                    ''', [(v['standard'], v['subject'], v['topic'], v['file_name'], v['id']) for _line, v in updates])
+                else:
+                    c.executemany('''
+                        UPDATE uploaded_videos SET standard = ?, subject = ?, topic = ?, file_name = coalesce(?, file_name),
+                            video_url = CASE WHEN video_type = 'link' THEN coalesce(?, video_url) ELSE video_url END
+                        WHERE id = ?
+                    ''', [(v['standard'], v['subject'], v['topic'], v['file_name'], v['video_url'], v['id'])
+                          for _line, v in updates])
+                updated += len(updates)
+
+                c.execute(f'SELECT coalesce(max(id), 0) FROM {table}')
+                last_id = c.fetchone()[0]
+                files = [v for _line, v in inserts if v['blob_digest']]
+                c.executemany('UPDATE blobs SET ref_count = ref_count + 1 WHERE digest = ?',
+                              [(v['blob_digest'],) for v in files])
+                if kind == 'notes':
+                    c.executemany('''
+                        INSERT INTO uploaded_notes (standard, subject, topic, file_path, file_name, blob_digest)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(v['standard'], v['subject'], v['topic'], blobstore.blob_relpath(v['blob_digest']),
+                           v['file_name'] or f'{v["topic"]}.pdf', v['blob_digest']) for v in files])
+                else:
+                    c.executemany('''
+                        INSERT INTO uploaded_videos (standard, subject, topic, video_type, file_path, file_name,
+                                                     blob_digest, processing_status)
+                        VALUES (?, ?, ?, 'file', ?, ?, ?, 'processing')
+                    ''', [(v['standard'], v['subject'], v['topic'], blobstore.blob_relpath(v['blob_digest']),
+                           v['file_name'] or v['topic'], v['blob_digest']) for v in files])
+                    c.executemany('''
+                        INSERT INTO uploaded_videos (standard, subject, topic, video_type, video_url, file_name)
+                        VALUES (?, ?, ?, 'link', ?, ?)
+                    ''', [(v['standard'], v['subject'], v['topic'], v['video_url'], v['file_name'] or 'External Video')
+                          for _line, v in inserts if v['video_url']])
+                # Ids are handed out in order, so the new file rows are the ones past last_id
+                c.execute(f'INSERT INTO media_jobs (kind, item_id) SELECT ?, id FROM {table} '
+                          'WHERE id > ? AND blob_digest IS NOT NULL', (MATERIAL_ITEMS[kind], last_id))
+                inserted += len(inserts)
+            c.execute('COMMIT')
+        except Exception:
+            c.execute('ROLLBACK')
+            raise
+        report.inserted += inserted
+        report.updated += updated
+        if inserted:
+            ingest.notify()
+
+    return write
+
+
+# Writing
+
+def stream_records(columns, rows, fmt, filename):
+    """Return a response streaming `rows` (tuples in `columns` order) as `fmt`."""
+    def generate():
+        buffer = io.StringIO()
+        if fmt == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                if buffer.tell() >= CHUNK_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(zip(columns, row)), separators=(',', ':'), ensure_ascii=False))
+                buffer.write('\n')
+                if buffer.tell() >= CHUNK_BYTES:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return db.release_after(response)
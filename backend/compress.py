@@ -0,0 +1,174 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+compress_response() is registered as an after_request hook and gzips (or,
+when the `brotli` package is installed, brotli-compresses) JSON, HTML and
+other text bodies above MIN_BYTES; streamed JSON (see jsonstream.py) is
+compressed chunk by chunk as it is sent. Files served by fileserve.py stream
+straight from disk and are left alone, as are types that are already
+compressed, such as PDF and MP4, which are not in COMPRESSIBLE_TYPES.
+
+respcache.py calls negotiate() and encode() itself, so cached responses
+are compressed once per encoding rather than once per request.
+"""
+
+import gzip
+import os
+import threading
+import time
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = int(os.environ.get('EDVANCE_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('EDVANCE_GZIP_LEVEL', '6'))
+# Quality 5 compresses about as fast as gzip -6 and noticeably smaller
+BROTLI_QUALITY = int(os.environ.get('EDVANCE_BROTLI_QUALITY', '5'))
+
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/javascript',
+    'application/x-ndjson',
+    'application/xml',
+    'image/svg+xml',
+}
+
+# Preferred first when the client weighs them equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class CompressionStats:
+    """Per-encoding totals since the process started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, encoding, bytes_in, bytes_out, cpu_seconds=0.0, cached=False):
+        with self._lock:
+            totals = self._totals.setdefault(encoding, {
+                'responses': 0, 'cached_responses': 0, 'compressions': 0,
+                'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0,
+            })
+            totals['responses'] += 1
+            if cached:
+                totals['cached_responses'] += 1
+            else:
+                totals['compressions'] += 1
+                totals['bytes_in'] += bytes_in
+                totals['bytes_out'] += bytes_out
+                totals['cpu_seconds'] += cpu_seconds
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for encoding, totals in self._totals.items():
+                totals = dict(totals)
+                totals['ratio'] = round(totals['bytes_out'] / totals['bytes_in'], 4) if totals['bytes_in'] else None
+                result[encoding] = totals
+            return result
+
+
+stats = CompressionStats()
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def negotiate(mimetype, size=None):
+    """Pick the encoding for a body of `size` bytes, or None to send it as is.
+
+    Streamed bodies, whose size isn't known, are assumed to be large.
+    """
+    if (size is not None and size < MIN_BYTES) or not is_compressible(mimetype):
+        return None
+    accepted = request.accept_encodings
+    best = None
+    best_quality = 0
+    for encoding in ENCODINGS:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encode(body, encoding):
+    """Compress `body` with `encoding` and count the work in `stats`."""
+    started = time.thread_time()
+    if encoding == 'br':
+        data = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    stats.record(encoding, len(body), len(data), time.thread_time() - started)
+    return data
+
+
+def encode_stream(chunks, encoding):
+    """Compress an iterable of chunks incrementally, counting the work in `stats`."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    bytes_in = bytes_out = 0
+    cpu_seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            started = time.thread_time()
+            data = process(chunk)
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(data)
+            if data:
+                yield data
+        started = time.thread_time()
+        data = finish()
+        cpu_seconds += time.thread_time() - started
+        bytes_out += len(data)
+        yield data
+        stats.record(encoding, bytes_in, bytes_out, cpu_seconds)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def set_encoded(response, data, encoding):
+    if response.is_streamed:
+        response.response = encode_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # The same resource in another encoding is a different byte sequence
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    """after_request hook: compress the body when the client accepts it."""
+    if not is_compressible(response.mimetype):
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    if response.is_streamed:
+        encoding = negotiate(response.mimetype)
+        if encoding is not None:
+            set_encoded(response, None, encoding)
+        return response
+    body = response.get_data()
+    encoding = negotiate(response.mimetype, len(body))
+    if encoding is not None:
+        set_encoded(response, encode(body, encoding), encoding)
+    return response
@@ -0,0 +1,201 @@
+"""
+Shared SQLite connection layer.
+
+Every route gets its connection from get_db(), which checks one out of a
+small per-process pool the first time it is called during a request and
+hands it back when the app context is torn down. Pooled connections are
+opened once with WAL journaling and tuned pragmas, and keep their compiled
+statement cache between requests.
+
+A database can be registered with attach() to have other database files
+ATTACHed to each of its connections, so queries join across them while
+every file keeps its own write lock.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g
+
+import metrics
+
+POOL_SIZE = int(os.environ.get('EDVANCE_DB_POOL_SIZE', '16'))
+POOL_TIMEOUT = float(os.environ.get('EDVANCE_DB_POOL_TIMEOUT', '10'))
+BUSY_TIMEOUT_MS = int(os.environ.get('EDVANCE_DB_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE_KB = int(os.environ.get('EDVANCE_DB_CACHE_SIZE_KB', '16384'))
+MMAP_SIZE = int(os.environ.get('EDVANCE_DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+    'PRAGMA temp_store = MEMORY',
+)
+# Set on the main database and on every attached one. auto_vacuum only takes
+# effect on new files (and at the next VACUUM); maintenance.py reclaims the
+# free pages a bit at a time.
+SCHEMA_PRAGMAS = (
+    'PRAGMA {schema}.auto_vacuum = INCREMENTAL',
+    'PRAGMA {schema}.journal_mode = WAL',
+    'PRAGMA {schema}.synchronous = NORMAL',
+    f'PRAGMA {{schema}}.cache_size = -{CACHE_SIZE_KB}',
+    f'PRAGMA {{schema}}.mmap_size = {MMAP_SIZE}',
+)
+
+
+def connect(path, attached=None):
+    """Open a tuned connection to `path` outside of the pool.
+
+    `attached` maps schema names to database files to ATTACH.
+    """
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=metrics.connection_factory(),
+    )
+    attached = attached or {}
+    for schema, other in attached.items():
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (other,))
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    for schema in ('main', *attached):
+        for pragma in SCHEMA_PRAGMAS:
+            conn.execute(pragma.format(schema=schema))
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of connections to a single database file."""
+
+    def __init__(self, path, size=POOL_SIZE, attached=None):
+        self.path = path
+        self.size = size
+        self.attached = attached
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _check_fork(self):
+        # SQLite connections must not cross fork(); a child starts with an
+        # empty pool and leaves the inherited handles to its parent.
+        if self._pid != os.getpid():
+            self._inherited = self._idle
+            self._reset()
+
+    def acquire(self):
+        self._check_fork()
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=POOL_TIMEOUT)
+        metrics.observe_pool_wait(os.path.basename(self.path), time.perf_counter() - started)
+        if not acquired:
+            raise sqlite3.OperationalError(f'connection pool for {self.path} exhausted')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return connect(self.path, self.attached)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            self._slots.release()
+            return
+        self._idle.put(conn)
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_attachments = {}
+
+
+def attach(path, **databases):
+    """ATTACH `databases` (schema name=file) to every pooled connection to `path`.
+
+    Call before the first get_db(path).
+    """
+    _attachments[path] = databases
+
+
+def get_pool(path):
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(path, ConnectionPool(path, attached=_attachments.get(path)))
+    return pool
+
+
+def get_db(path):
+    """Return this request's connection to `path`, checking one out if needed."""
+    conns = g.setdefault('_db_conns', {})
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = get_pool(path).acquire()
+    return conn
+
+
+def close_db(exc=None):
+    conns = g.pop('_db_conns', None)
+    if not conns:
+        return
+    for path, conn in conns.items():
+        get_pool(path).release(conn)
+
+
+def release_after(response):
+    """Keep this request's connections checked out until `response` is sent.
+
+    A streamed body goes on reading its cursor after the request has been
+    torn down, so the connections must not go back to the pool (and to
+    another thread) before the body has run out or the response is closed.
+    """
+    conns = g.pop('_db_conns', None)
+    if not conns:
+        return response
+
+    def release():
+        while conns:
+            path, conn = conns.popitem()
+            get_pool(path).release(conn)
+
+    def body(chunks):
+        try:
+            yield from chunks
+        finally:
+            release()
+
+    response.response = body(response.response)
+    response.call_on_close(release)
+    return response
+
+
+def close_all():
+    for pool in list(_pools.values()):
+        pool.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
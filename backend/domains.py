@@ -0,0 +1,146 @@
+"""
+Per-domain database files.
+
+Study content (teacher profile, notes, videos, uploads, search) stays in
+the main database. Sponsors and scholarships live in sponsorship.db and
+scholarship applications in applications.db, both next to it. Each file
+has its own WAL and its own write lock, so a burst of applications never
+waits behind a note upload or a sponsor edit, and each file checkpoints
+and backs up on its own. Connections to the applications database ATTACH
+the sponsorship one for their joins (see db.attach()).
+
+Databases from before the split hold every table in the main file.
+Migration 12 of the main database moves the sponsorship and application
+rows out with move_tables(); `python domains.py split [database]` does the
+same ahead of a deploy, checks the row counts and compacts the main file.
+"""
+
+import os
+import sys
+
+from db import connect
+
+SPONSORSHIP_FILE = 'sponsorship.db'
+APPLICATIONS_FILE = 'applications.db'
+
+# Tables moved to each domain in insert order, and the tables the target's
+# triggers rebuild as those rows arrive
+SPONSORSHIP_TABLES = ('sponsor_profiles', 'scholarships')
+SPONSORSHIP_DERIVED = ('scholarship_changes',)
+APPLICATION_TABLES = ('scholarship_applications',)
+APPLICATION_DERIVED = ('application_status_counts',)
+
+
+def paths(database):
+    """The (sponsorship, applications) database files that go with the main `database`."""
+    directory = os.path.dirname(database)
+    return os.path.join(directory, SPONSORSHIP_FILE), os.path.join(directory, APPLICATIONS_FILE)
+
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+
+def _copy_tables(source, target, tables, derived):
+    """Replace the rows of `tables` in the `target` database with those in `source`."""
+    conn = connect(target)
+    conn.isolation_level = None
+    try:
+        conn.execute('ATTACH DATABASE ? AS legacy', (source,))
+        # Deferred: IMMEDIATE would also want the write lock on the source,
+        # which the migration holds
+        conn.execute('BEGIN')
+        try:
+            # Rows left by an attempt that copied but never dropped the
+            # originals are stale; the originals are still authoritative
+            for table in (*reversed(tables), *derived):
+                conn.execute(f'DELETE FROM main.{table}')
+            for table in tables:
+                columns = ', '.join(row[1] for row in conn.execute(f'PRAGMA legacy.table_info({table})'))
+                conn.execute(f'INSERT INTO main.{table} ({columns}) SELECT {columns} FROM legacy.{table}')
+            # Keep ids of deleted rows from being handed out again
+            placeholders = ', '.join('?' * len(tables))
+            conn.execute(f'DELETE FROM main.sqlite_sequence WHERE name IN ({placeholders})', tables)
+            conn.execute('INSERT INTO main.sqlite_sequence (name, seq) '
+                         f'SELECT name, seq FROM legacy.sqlite_sequence WHERE name IN ({placeholders})', tables)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+
+def move_tables(conn):
+    """Migration step: move the sponsorship and application tables into their own databases.
+
+    The rows are committed in the domain databases before the originals are
+    dropped, so an interrupted move is simply repeated.
+    """
+    from migrations import APPLICATION_MIGRATIONS, SPONSORSHIP_MIGRATIONS, migrate
+
+    database = conn.execute('PRAGMA database_list').fetchone()[2]
+    sponsorship, applications = paths(database)
+    migrate(sponsorship, SPONSORSHIP_MIGRATIONS)
+    migrate(applications, APPLICATION_MIGRATIONS)
+    _copy_tables(database, sponsorship, SPONSORSHIP_TABLES, SPONSORSHIP_DERIVED)
+    _copy_tables(database, applications, APPLICATION_TABLES, APPLICATION_DERIVED)
+    for table in (*APPLICATION_DERIVED, *reversed(APPLICATION_TABLES),
+                  *SPONSORSHIP_DERIVED, *reversed(SPONSORSHIP_TABLES)):
+        conn.execute(f'DROP TABLE IF EXISTS {table}')
+
+
+def split(database):
+    """Split a main database that still holds every table; returns rows moved per table.
+
+    Returns None when `database` has already been split. Run it while the
+    server is stopped, so nothing writes between counting and checking.
+    """
+    from migrations import MAIN_MIGRATIONS, migrate
+
+    conn = connect(database)
+    try:
+        tables = (*SPONSORSHIP_TABLES, *APPLICATION_TABLES)
+        if not _table_exists(conn, tables[-1]):
+            return None
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+    migrate(database, MAIN_MIGRATIONS)
+
+    sponsorship, applications = paths(database)
+    conn = connect(applications, {'sponsorship': sponsorship})
+    try:
+        for table, expected in counts.items():
+            moved = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+            if moved != expected:
+                raise RuntimeError(f'{table}: expected {expected} rows after the move, found {moved}')
+    finally:
+        conn.close()
+
+    # Give the space the moved tables took back to the file system
+    conn = connect(database)
+    try:
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+    return counts
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['split']:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        database = sys.argv[2] if len(sys.argv) > 2 else 'teacher_profiles.db'
+        counts = split(database)
+        if counts is None:
+            print(f'{database} is already split')
+        else:
+            sponsorship, applications = paths(database)
+            moved = ', '.join(f'{count} {table}' for table, count in counts.items())
+            print(f'Moved {moved} into {sponsorship} and {applications}')
+    else:
+        print('usage: python domains.py split [database]')
+        sys.exit(2)
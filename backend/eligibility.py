@@ -0,0 +1,343 @@
+"""
+In-memory index of active scholarships for eligibility matching.
+
+Every active scholarship owns a bit position. Gender and location criteria
+are kept as one bitset per value (plus one for "no restriction"), and the
+income and percentage thresholds as sorted arrays, so matching a student is
+a few binary searches and integer ANDs instead of a query.
+
+Each process keeps its own index. Writers bump the 'scholarships' counter
+(see versions.py) after committing; the next lookup notices and applies
+just the rows listed in scholarship_changes since it last looked.
+"""
+
+import threading
+from bisect import bisect_left, bisect_right
+
+import metrics
+import versions
+from db import get_db
+
+# Checkpoint every BLOCK entries of a threshold array; a lookup ORs at most
+# BLOCK - 1 single bits on top of a checkpoint.
+BLOCK = 64
+# Beyond this many changed rows a full reload is cheaper than patching
+MAX_PATCH_ROWS = 256
+
+COLUMNS = [
+    'id', 'sponsor_id', 'title', 'description', 'amount', 'currency', 'gender_criteria',
+    'family_income_max', 'location_type', 'min_academic_percentage', 'application_deadline',
+    'is_active', 'created_at', 'updated_at', 'sponsor_name', 'company_name',
+]
+
+SELECT_ACTIVE = '''
+    SELECT s.id, s.sponsor_id, s.title, s.description, s.amount, s.currency, s.gender_criteria,
+           s.family_income_max, s.location_type, s.min_academic_percentage, s.application_deadline,
+           s.is_active, s.created_at, s.updated_at, sp.name, sp.company_name
+    FROM scholarships s
+    JOIN sponsor_profiles sp ON s.sponsor_id = sp.id
+    WHERE s.is_active = 1
+'''
+
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _open_criterion(value):
+    return value is None or value == 'Any'
+
+
+class ThresholdArray:
+    """Bit positions sorted by a numeric threshold; None thresholds always match."""
+
+    def __init__(self):
+        self.values = []
+        self.slots = []
+        self.unbounded = 0
+        self._prefix = None
+        self._suffix = None
+
+    def add(self, value, slot):
+        if value is None:
+            self.unbounded |= 1 << slot
+            return
+        i = bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.slots.insert(i, slot)
+        self._prefix = self._suffix = None
+
+    def remove(self, value, slot):
+        if value is None:
+            self.unbounded &= ~(1 << slot)
+            return
+        i = bisect_left(self.values, value)
+        while self.slots[i] != slot:
+            i += 1
+        del self.values[i]
+        del self.slots[i]
+        self._prefix = self._suffix = None
+
+    def _checkpoints(self):
+        # _prefix[b] covers slots[:b * BLOCK], _suffix[b] covers slots[b * BLOCK:]
+        blocks = len(self.slots) // BLOCK + 1
+        prefix = [0] * (blocks + 1)
+        for b in range(1, blocks + 1):
+            bits = prefix[b - 1]
+            for slot in self.slots[(b - 1) * BLOCK:b * BLOCK]:
+                bits |= 1 << slot
+            prefix[b] = bits
+        suffix = [0] * (blocks + 1)
+        for b in range(blocks - 1, -1, -1):
+            bits = suffix[b + 1]
+            for slot in self.slots[b * BLOCK:(b + 1) * BLOCK]:
+                bits |= 1 << slot
+            suffix[b] = bits
+        self._prefix, self._suffix = prefix, suffix
+
+    def _head(self, k):
+        # Bits of slots[:k]
+        if self._prefix is None:
+            self._checkpoints()
+        b = k // BLOCK
+        bits = self._prefix[b]
+        for slot in self.slots[b * BLOCK:k]:
+            bits |= 1 << slot
+        return bits
+
+    def _tail(self, k):
+        # Bits of slots[k:]
+        if self._suffix is None:
+            self._checkpoints()
+        b = -(-k // BLOCK)
+        bits = self._suffix[b]
+        for slot in self.slots[k:b * BLOCK]:
+            bits |= 1 << slot
+        return bits
+
+    def at_least(self, x):
+        """Bits whose threshold is >= x."""
+        return self.unbounded | self._tail(bisect_left(self.values, x))
+
+    def at_most(self, x):
+        """Bits whose threshold is <= x."""
+        return self.unbounded | self._head(bisect_right(self.values, x))
+
+
+class EligibilityIndex:
+    def __init__(self, database):
+        self.database = database
+        self.version = None
+        self.seq = None
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.records = {}
+        self.slot_of = {}
+        self.ids = []
+        self.free = []
+        self.all_bits = 0
+        self.gender_open = 0
+        self.gender_bits = {}
+        self.location_open = 0
+        self.location_bits = {}
+        self.income = ThresholdArray()
+        self.percentage = ThresholdArray()
+        self.ranked = []
+        self.rank = {}
+
+    # Maintenance
+
+    def _add(self, record):
+        slot = self.free.pop() if self.free else len(self.ids)
+        if slot == len(self.ids):
+            self.ids.append(None)
+        self.ids[slot] = record['id']
+        self.slot_of[record['id']] = slot
+        self.records[record['id']] = record
+        bit = 1 << slot
+        self.all_bits |= bit
+        if _open_criterion(record['gender_criteria']):
+            self.gender_open |= bit
+        else:
+            key = record['gender_criteria']
+            self.gender_bits[key] = self.gender_bits.get(key, 0) | bit
+        if _open_criterion(record['location_type']):
+            self.location_open |= bit
+        else:
+            key = record['location_type']
+            self.location_bits[key] = self.location_bits.get(key, 0) | bit
+        self.income.add(_number(record['family_income_max']), slot)
+        self.percentage.add(_number(record['min_academic_percentage']), slot)
+
+    def _remove(self, scholarship_id):
+        slot = self.slot_of.pop(scholarship_id, None)
+        if slot is None:
+            return
+        record = self.records.pop(scholarship_id)
+        mask = ~(1 << slot)
+        self.all_bits &= mask
+        self.gender_open &= mask
+        self.location_open &= mask
+        for bitsets, key in ((self.gender_bits, record['gender_criteria']),
+                             (self.location_bits, record['location_type'])):
+            if key in bitsets:
+                bitsets[key] &= mask
+                if not bitsets[key]:
+                    del bitsets[key]
+        self.income.remove(_number(record['family_income_max']), slot)
+        self.percentage.remove(_number(record['min_academic_percentage']), slot)
+        self.ids[slot] = None
+        self.free.append(slot)
+
+    def _rerank(self):
+        # Highest amount first, like the listing ORDER BY amount DESC
+        order = sorted(self.records.values(), key=lambda r: (-(_number(r['amount']) or 0), r['id']))
+        self.ranked = [self.slot_of[r['id']] for r in order]
+        self.rank = {slot: i for i, slot in enumerate(self.ranked)}
+
+    def _reload(self, c):
+        self._clear()
+        c.execute(SELECT_ACTIVE)
+        for row in c.fetchall():
+            self._add(dict(zip(COLUMNS, row)))
+
+    def _sync(self):
+        version = versions.current(self.database, 'scholarships')
+        if version == self.version and self.seq is not None:
+            return
+        conn = get_db(self.database)
+        c = conn.cursor()
+        # One read transaction, so the log position matches the rows read
+        c.execute('BEGIN')
+        try:
+            c.execute('SELECT coalesce(max(seq), 0), coalesce(min(seq), 1) FROM scholarship_changes')
+            latest, oldest = c.fetchone()
+            changed = None
+            if self.seq is not None and oldest <= self.seq + 1:
+                c.execute('SELECT DISTINCT scholarship_id FROM scholarship_changes WHERE seq > ?', (self.seq,))
+                changed = [row[0] for row in c.fetchall()]
+            if changed is None or len(changed) > MAX_PATCH_ROWS:
+                self._reload(c)
+            elif changed:
+                for scholarship_id in changed:
+                    self._remove(scholarship_id)
+                placeholders = ', '.join('?' * len(changed))
+                c.execute(f'{SELECT_ACTIVE} AND s.id IN ({placeholders})', changed)
+                for row in c.fetchall():
+                    self._add(dict(zip(COLUMNS, row)))
+        except Exception:
+            # Half-applied changes: start over from a full load next time
+            self.seq = None
+            raise
+        finally:
+            conn.commit()
+        self._rerank()
+        self.seq = latest
+        self.version = version
+
+    # Lookups
+
+    def _match(self, gender, income, location, percentage):
+        bits = self.all_bits
+        if gender and gender != 'Any':
+            bits &= self.gender_open | self.gender_bits.get(gender, 0)
+        if location:
+            bits &= self.location_open | self.location_bits.get(location, 0)
+        if income is not None:
+            bits &= self.income.at_least(income)
+        if percentage is not None:
+            bits &= self.percentage.at_most(percentage)
+        return bits
+
+    def _ordered(self, bits, limit):
+        count = bits.bit_count()
+        if count * 4 > len(self.ranked) or (limit is not None and count > limit * 8):
+            # Dense result: walk scholarships by amount until `limit` match
+            mask = bits.to_bytes((len(self.ids) + 7) // 8 or 1, 'little')
+            picked = []
+            for slot in self.ranked:
+                if mask[slot >> 3] >> (slot & 7) & 1:
+                    picked.append(slot)
+                    if len(picked) == limit:
+                        break
+        else:
+            text = bin(bits)[:1:-1]
+            picked = []
+            position = text.find('1')
+            while position != -1:
+                picked.append(position)
+                position = text.find('1', position + 1)
+            picked.sort(key=self.rank.__getitem__)
+            if limit is not None:
+                del picked[limit:]
+        return [self.ids[slot] for slot in picked]
+
+    def eligible_ids(self, student, limit=None):
+        """Ids of the active scholarships `student` qualifies for, highest amount first."""
+        with metrics.waiting(self._lock):
+            self._sync()
+            bits = self._match(student.get('gender'), _number(student.get('family_income')),
+                               student.get('location_type'), _number(student.get('academic_percentage')))
+            return self._ordered(bits, limit)
+
+    def is_active(self, scholarship_id):
+        """Whether `scholarship_id` is an active scholarship."""
+        with metrics.waiting(self._lock):
+            self._sync()
+            return scholarship_id in self.records
+
+    def eligible(self, student, limit=None):
+        with metrics.waiting(self._lock):
+            return [self.records[i] for i in self.eligible_ids(student, limit)]
+
+    def eligible_batch(self, students, limit=None):
+        """eligible_ids() for many students, sharing work between equal criteria.
+
+        Returns the id lists and a dict of every scholarship they mention.
+        """
+        with metrics.waiting(self._lock):
+            self._sync()
+            categorical = {}
+            income_bits = {}
+            percentage_bits = {}
+            ordered = {}
+            results = []
+            for student in students:
+                key = (student.get('gender'), student.get('location_type'))
+                bits = categorical.get(key)
+                if bits is None:
+                    bits = categorical[key] = self._match(key[0], None, key[1], None)
+                income = _number(student.get('family_income'))
+                if income is not None:
+                    if income not in income_bits:
+                        income_bits[income] = self.income.at_least(income)
+                    bits &= income_bits[income]
+                percentage = _number(student.get('academic_percentage'))
+                if percentage is not None:
+                    if percentage not in percentage_bits:
+                        percentage_bits[percentage] = self.percentage.at_most(percentage)
+                    bits &= percentage_bits[percentage]
+                if bits not in ordered:
+                    ordered[bits] = self._ordered(bits, limit)
+                results.append(ordered[bits])
+            mentioned = {i for ids in results for i in ids}
+            return results, {i: self.records[i] for i in mentioned}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(database):
+    index = _indexes.get(database)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.setdefault(database, EligibilityIndex(database))
+    return index
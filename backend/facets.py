@@ -0,0 +1,45 @@
+"""
+Facet counts for the study-material filters.
+
+study_material_facets holds the number of notes and videos for every
+(standard, subject) pair. Triggers on uploaded_notes and uploaded_videos
+keep it current inside the writing transaction, so the filters endpoint
+reads one row per facet instead of scanning the catalogue.
+
+rebuild() recounts everything; it runs as a migration step and from
+POST /api/admin/facets/rebuild.
+"""
+
+MATERIAL_TABLES = (('notes', 'uploaded_notes'), ('videos', 'uploaded_videos'))
+
+
+def rebuild(conn):
+    """Recount every facet from the material tables."""
+    conn.execute('DELETE FROM study_material_facets')
+    for material_type, table in MATERIAL_TABLES:
+        conn.execute(f'''
+            INSERT INTO study_material_facets (standard, subject, material_type, count)
+            SELECT standard, subject, ?, COUNT(*) FROM {table} GROUP BY standard, subject
+        ''', (material_type,))
+
+
+def read_tree(c):
+    """Return the facets as [{standard, count, notes, videos, subjects: [...]}]."""
+    c.execute('''
+        SELECT standard, subject, material_type, count FROM study_material_facets
+        WHERE count > 0 ORDER BY standard, subject
+    ''')
+    tree = []
+    node = leaf = None
+    for standard, subject, material_type, count in c.fetchall():
+        if node is None or node['standard'] != standard:
+            node = {'standard': standard, 'count': 0, 'notes': 0, 'videos': 0, 'subjects': []}
+            tree.append(node)
+            leaf = None
+        if leaf is None or leaf['subject'] != subject:
+            leaf = {'subject': subject, 'count': 0, 'notes': 0, 'videos': 0}
+            node['subjects'].append(leaf)
+        for entry in (node, leaf):
+            entry['count'] += count
+            entry[material_type] += count
+    return tree
@@ -0,0 +1,221 @@
+"""
+File serving for uploaded notes, videos and sponsor documents.
+
+serve_file() answers conditional requests against a content-hash ETag,
+returns single and multi-range 206 responses, hands open-ended ranges to
+the server's wsgi.file_wrapper (which uses os.sendfile on servers that
+support it), and can offload the transfer to a front proxy with
+X-Accel-Redirect (nginx) or X-Sendfile (Apache/lighttpd).
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import current_app, request
+
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+
+# '' serves bytes from Python, 'x-accel' emits X-Accel-Redirect and
+# 'x-sendfile' emits X-Sendfile.
+OFFLOAD = os.environ.get('EDVANCE_FILE_OFFLOAD', '').lower()
+# Internal nginx location that maps onto the uploads directory
+OFFLOAD_PREFIX = os.environ.get('EDVANCE_FILE_OFFLOAD_PREFIX', '/protected-uploads/')
+
+CHUNK_SIZE = 256 * 1024
+HASH_CACHE_SIZE = 4096
+
+_hash_cache = OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def content_hash(path, st):
+    """SHA-256 of the file at `path`, cached until its size or mtime changes."""
+    key = (path, st.st_size, st.st_mtime_ns, st.st_ino)
+    with _hash_lock:
+        digest = _hash_cache.get(key)
+        if digest is not None:
+            _hash_cache.move_to_end(key)
+            return digest
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    with _hash_lock:
+        _hash_cache[key] = digest
+        while len(_hash_cache) > HASH_CACHE_SIZE:
+            _hash_cache.popitem(last=False)
+    return digest
+
+
+def resolve_ranges(range_header, size):
+    """Turn a parsed Range header into absolute (start, end) pairs.
+
+    Returns None when no satisfiable range remains, and an empty list when
+    the request should be answered with the full body.
+    """
+    if range_header is None or range_header.units != 'bytes':
+        return []
+    ranges = []
+    for start, stop in range_header.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start = max(size + start, 0)
+            end = size - 1
+        else:
+            end = size - 1 if stop is None else min(stop, size) - 1
+        if start <= end and start < size:
+            ranges.append((start, end))
+    if not ranges:
+        return None
+    # Overlapping or adjacent ranges are served as one part
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_span(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            block = f.read(min(CHUNK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _span_body(path, start, end, size):
+    # Ranges that run to EOF can go through the server's file wrapper, which
+    # is sendfile-backed on servers that have it. Bounded ranges are read in
+    # chunks because not every wrapper stops at Content-Length.
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and end == size - 1:
+        f = open(path, 'rb')
+        f.seek(start)
+        return file_wrapper(f, CHUNK_SIZE)
+    return _read_span(path, start, end)
+
+
+def _etag_matches(header_etags, etag):
+    return header_etags is not None and (header_etags.star_tag or header_etags.contains_weak(etag))
+
+
+def _offload_headers(path):
+    if OFFLOAD == 'x-sendfile':
+        return {'X-Sendfile': path}
+    if OFFLOAD == 'x-accel':
+        relative = os.path.relpath(path, UPLOAD_ROOT)
+        if relative.startswith(os.pardir):
+            return None
+        return {'X-Accel-Redirect': OFFLOAD_PREFIX.rstrip('/') + '/' + relative.replace(os.sep, '/')}
+    return None
+
+
+def serve_file(path, download_name=None, as_attachment=False, mimetype=None, etag=None):
+    """Build a response for the file at `path` honouring Range and conditional headers.
+
+    `etag` may be passed when the content hash is already known; otherwise
+    it is computed from the file and cached.
+    """
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    size = st.st_size
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name or path)[0] or 'application/octet-stream'
+    if etag is None:
+        etag = content_hash(path, st)
+
+    response = current_app.response_class(mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = st.st_mtime
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    if download_name:
+        disposition = 'attachment' if as_attachment else 'inline'
+        response.headers.set('Content-Disposition', disposition, filename=download_name)
+
+    if _etag_matches(request.if_none_match, etag):
+        response.status_code = 304
+        return response
+    if request.if_none_match is None and request.if_modified_since is not None \
+            and int(st.st_mtime) <= request.if_modified_since.timestamp():
+        response.status_code = 304
+        return response
+
+    offload = _offload_headers(path)
+    if offload:
+        # The proxy re-applies Range and conditionals to the real file
+        response.headers.update(offload)
+        return response
+
+    ranges = []
+    if request.range is not None:
+        if_range = request.if_range
+        if if_range.etag is not None:
+            use_range = if_range.etag == etag
+        elif if_range.date is not None:
+            use_range = int(st.st_mtime) <= if_range.date.timestamp()
+        else:
+            use_range = True
+        if use_range:
+            ranges = resolve_ranges(request.range, size)
+
+    if ranges is None:
+        response.status_code = 416
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if not ranges:
+        response.response = _span_body(path, 0, size - 1, size) if size else []
+        response.content_length = size
+        response.direct_passthrough = True
+        return response
+
+    response.status_code = 206
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.response = _span_body(path, start, end, size)
+        response.content_length = end - start + 1
+        response.direct_passthrough = True
+        return response
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, end in ranges:
+        header = (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode('latin-1')
+        parts.append((header, start, end))
+    closing = f'--{boundary}--\r\n'.encode('latin-1')
+
+    def body():
+        for i, (header, start, end) in enumerate(parts):
+            yield b'\r\n' + header if i else header
+            yield from _read_span(path, start, end)
+        yield b'\r\n' + closing
+
+    response.response = body()
+    response.headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    response.content_length = (
+        sum(len(header) + end - start + 1 for header, start, end in parts)
+        + 2 * (len(parts) - 1) + 2 + len(closing)
+    )
+    response.direct_passthrough = True
+    return response
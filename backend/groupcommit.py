@@ -0,0 +1,215 @@
+"""
+Group commit for high-rate inserts.
+
+Instead of every request opening its own write transaction, rows are queued
+to one writer thread per process. The writer takes the first queued row,
+waits up to BATCH_DELAY_MS for more (or until it has BATCH_ROWS), inserts
+them all in one transaction and commits with synchronous = FULL, so a single
+WAL fsync makes the whole batch durable and the write lock is taken once per
+batch instead of once per row. submit() returns only after the row's batch
+has committed.
+
+Each row is inserted under its own savepoint: a row that violates a
+constraint fails alone, the rest of its batch still commits.
+"""
+
+import bisect
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+
+import metrics
+from db import connect
+
+BATCH_ROWS = int(os.environ.get('EDVANCE_GROUP_COMMIT_ROWS', '256'))
+BATCH_DELAY_MS = float(os.environ.get('EDVANCE_GROUP_COMMIT_DELAY_MS', '5'))
+# How long submit() waits for a row to be taken into a batch
+SUBMIT_TIMEOUT = float(os.environ.get('EDVANCE_GROUP_COMMIT_TIMEOUT', '30'))
+
+# Upper bounds of the batch size histogram
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+# Latency percentiles are over this many recent batches
+LATENCY_WINDOW = 1024
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def milliseconds(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {'p50': milliseconds(0.50), 'p95': milliseconds(0.95), 'p99': milliseconds(0.99),
+            'max': milliseconds(1.0)}
+
+
+class BatchStats:
+    """Batch sizes and latencies since the process started, for tuning the batch limits."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.failed_rows = 0
+        self.failed_batches = 0
+        self.max_batch_rows = 0
+        self.size_counts = [0] * (len(SIZE_BUCKETS) + 1)
+        self._commit_seconds = deque(maxlen=LATENCY_WINDOW)
+        self._wait_seconds = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, rows, wait_seconds, commit_seconds, failed_rows=0, failed=False):
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+            self.failed_rows += failed_rows
+            if failed:
+                self.failed_batches += 1
+            self.max_batch_rows = max(self.max_batch_rows, rows)
+            self.size_counts[bisect.bisect_left(SIZE_BUCKETS, rows)] += 1
+            self._commit_seconds.append(commit_seconds)
+            self._wait_seconds.append(wait_seconds)
+
+    def snapshot(self):
+        with self._lock:
+            histogram = {f'<={bound}': count for bound, count in zip(SIZE_BUCKETS, self.size_counts)}
+            histogram[f'>{SIZE_BUCKETS[-1]}'] = self.size_counts[-1]
+            return {
+                'batches': self.batches,
+                'rows': self.rows,
+                'failed_rows': self.failed_rows,
+                'failed_batches': self.failed_batches,
+                'mean_batch_rows': round(self.rows / self.batches, 2) if self.batches else None,
+                'max_batch_rows': self.max_batch_rows,
+                'batch_rows_histogram': histogram,
+                # Insert plus COMMIT (with its fsync), per batch
+                'commit_ms': _percentiles(self._commit_seconds),
+                # Time the oldest row in each batch spent queued
+                'queue_wait_ms': _percentiles(self._wait_seconds),
+            }
+
+
+class GroupCommitter:
+    """Single writer thread batching `sql` inserts into `database`."""
+
+    def __init__(self, database, sql, name, batch_rows=BATCH_ROWS, batch_delay_ms=BATCH_DELAY_MS):
+        self.database = database
+        self.sql = sql
+        self.name = name
+        self.batch_rows = batch_rows
+        self.batch_delay = batch_delay_ms / 1000
+        self.stats = BatchStats()
+        self._pid = None
+        self._queue = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_writer(self):
+        # One writer per process, started again in a forked child
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.SimpleQueue()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name=f'group-commit-{self.name}', daemon=True).start()
+
+    def queued(self):
+        return self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+
+    def submit(self, params, timeout=SUBMIT_TIMEOUT):
+        """Insert one row; returns its rowid once the batch holding it is durable.
+
+        Raises the row's or the batch's error, or TimeoutError if the row was
+        still queued after `timeout` seconds (it is then never written).
+        """
+        self._ensure_writer()
+        future = Future()
+        queued_at = time.monotonic()
+        self._queue.put((params, future, queued_at))
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise
+            # Already being committed; the commit itself is bounded by the busy timeout
+            return future.result()
+        finally:
+            metrics.add_time('write_queue', time.monotonic() - queued_at)
+
+    def _connect(self):
+        conn = connect(self.database)
+        try:
+            conn.isolation_level = None
+            conn.execute('PRAGMA synchronous = FULL')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _run(self):
+        # Opened with the first batch, and again after a failed open, so a
+        # database that can't be opened fails its batches, not the writer
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0][2] + self.batch_delay
+            while len(batch) < self.batch_rows:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Rows whose caller gave up are dropped
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if conn is None:
+                started = time.monotonic()
+                try:
+                    conn = self._connect()
+                except Exception as e:
+                    self._fail(batch, started, e)
+                    continue
+            self._commit(conn, batch)
+
+    def _fail(self, batch, started, error):
+        self.stats.record(len(batch), started - batch[0][2], time.monotonic() - started,
+                          failed_rows=len(batch), failed=True)
+        for _params, future, _queued_at in batch:
+            future.set_exception(error)
+
+    def _commit(self, conn, batch):
+        started = time.monotonic()
+        results = []
+        failed_rows = 0
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for params, _future, _queued_at in batch:
+                    conn.execute('SAVEPOINT row')
+                    try:
+                        results.append((True, conn.execute(self.sql, params).lastrowid))
+                    except sqlite3.Error as e:
+                        conn.execute('ROLLBACK TO row')
+                        results.append((False, e))
+                        failed_rows += 1
+                    conn.execute('RELEASE row')
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        except Exception as e:
+            self._fail(batch, started, e)
+            return
+        self.stats.record(len(batch), started - batch[0][2], time.monotonic() - started, failed_rows=failed_rows)
+        for (_params, future, _queued_at), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
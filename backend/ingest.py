@@ -0,0 +1,197 @@
+"""
+Background ingestion of uploaded videos and notes.
+
+Upload routes queue a row in media_jobs inside their own transaction and
+return straight away. A small pool of worker threads per process claims
+queued jobs. For a video it probes the file (duration, resolution,
+bitrate, size) and, for MP4/MOV files whose moov box sits after the media
+data, stores a fast-start copy in the blob store in place of the original.
+For a note it extracts the PDF text into the search index.
+"""
+
+import os
+import sqlite3
+import threading
+import uuid
+
+import blobstore
+import mp4
+import search
+import versions
+from db import connect
+
+WORKERS = int(os.environ.get('EDVANCE_MEDIA_WORKERS', '2'))
+POLL_INTERVAL = 5
+# A job left 'running' this long (worker died mid-way) is picked up again
+JOB_TIMEOUT_MINUTES = 30
+MAX_ATTEMPTS = 3
+
+FASTSTART_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+_wakeup = threading.Event()
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def enqueue(c, item_id, kind='video'):
+    """Queue ingestion of a video or note; call inside the transaction that inserts it."""
+    c.execute('INSERT INTO media_jobs (kind, item_id) VALUES (?, ?)', (kind, item_id))
+
+
+def notify():
+    """Wake this process's workers after a job has been committed."""
+    _wakeup.set()
+
+
+def ensure_workers(database):
+    """Start this process's worker threads once (again after a fork)."""
+    global _started_pid
+    if _started_pid == os.getpid() or WORKERS <= 0:
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        for i in range(WORKERS):
+            threading.Thread(target=_worker, args=(database,), name=f'media-ingest-{i}', daemon=True).start()
+
+
+def _claim(c):
+    # Videos first: their uploader is waiting on them, text extraction can lag
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        c.execute('''
+            SELECT id, kind, item_id, attempts FROM media_jobs
+            WHERE status = 'queued'
+               OR (status = 'running' AND started_at < datetime('now', ?))
+            ORDER BY kind = 'note', id LIMIT 1
+        ''', (f'-{JOB_TIMEOUT_MINUTES} minutes',))
+        job = c.fetchone()
+        if job:
+            c.execute('''
+                UPDATE media_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, attempts = attempts + 1
+                WHERE id = ?
+            ''', (job[0],))
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
+    return job
+
+
+def _worker(database):
+    conn = connect(database)
+    conn.isolation_level = None
+    c = conn.cursor()
+    while True:
+        try:
+            job = _claim(c)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not claim media job: {e}")
+            job = None
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        job_id, kind, item_id, attempts = job
+        try:
+            if kind == 'note':
+                process_note(c, item_id)
+            else:
+                process_video(c, item_id)
+            c.execute('''
+                UPDATE media_jobs SET status = 'done', error = NULL, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (job_id,))
+        except Exception as e:
+            if c.connection.in_transaction:
+                c.execute('ROLLBACK')
+            final = attempts + 1 >= MAX_ATTEMPTS
+            c.execute('''
+                UPDATE media_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', ('failed' if final else 'queued', str(e), job_id))
+            if final and kind == 'video':
+                # The upload is still playable as it was received
+                c.execute("UPDATE uploaded_videos SET processing_status = 'failed' WHERE id = ?", (item_id,))
+        if kind == 'video':
+            # Status and metadata of the video changed either way
+            versions.bump(database, 'uploaded_videos')
+
+
+def process_video(c, video_id):
+    """Probe a video, relocate its moov box if needed, and record the results."""
+    c.execute('SELECT file_path, file_name, blob_digest FROM uploaded_videos WHERE id = ?', (video_id,))
+    row = c.fetchone()
+    if not row or not row[0]:
+        return
+    file_path, file_name, digest = row
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(blobstore.BACKEND_DIR, file_path)
+
+    info = {'size_bytes': os.path.getsize(file_path)}
+    temp_path = None
+    if (file_name or file_path).lower().endswith(FASTSTART_EXTENSIONS):
+        info.update(mp4.probe(file_path))
+        if not info.pop('faststart') and digest:
+            os.makedirs(blobstore.TEMP_DIR, exist_ok=True)
+            temp_path = os.path.join(blobstore.TEMP_DIR, f'{uuid.uuid4().hex}.tmp')
+            mp4.faststart(file_path, temp_path)
+            new_digest, info['size_bytes'] = blobstore.hash_file(temp_path)
+
+    trash_path = None
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        c.execute('SELECT blob_digest FROM uploaded_videos WHERE id = ?', (video_id,))
+        current = c.fetchone()
+        if current is None or current[0] != digest:
+            # Deleted or replaced while we were working on it
+            c.execute('COMMIT')
+            if temp_path:
+                blobstore.discard(temp_path)
+            return
+        if temp_path:
+            new_path = blobstore.add_ref(c, temp_path, new_digest, info['size_bytes'])
+            temp_path = None
+            c.execute('UPDATE uploaded_videos SET file_path = ?, blob_digest = ? WHERE id = ?',
+                      (new_path, new_digest, video_id))
+            trash_path = blobstore.release_ref(c, digest)
+        c.execute('''
+            UPDATE uploaded_videos SET processing_status = 'ready', duration_seconds = ?, width = ?, height = ?,
+            bitrate = ?, size_bytes = ?
+            WHERE id = ?
+        ''', (info.get('duration_seconds'), info.get('width'), info.get('height'), info.get('bitrate'),
+              info['size_bytes'], video_id))
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        blobstore.restore(trash_path)
+        if temp_path:
+            blobstore.discard(temp_path)
+        raise
+    blobstore.empty_trash(trash_path)
+
+
+def process_note(c, note_id):
+    """Extract a note's PDF text into the search index."""
+    c.execute('SELECT file_path, blob_digest FROM uploaded_notes WHERE id = ?', (note_id,))
+    row = c.fetchone()
+    if not row:
+        return
+    file_path, digest = row
+    path = blobstore.locate_file(file_path)
+    if path is None:
+        return
+    text = search.extract_pdf_text(path)
+
+    c.execute('BEGIN IMMEDIATE')
+    try:
+        c.execute('SELECT blob_digest FROM uploaded_notes WHERE id = ?', (note_id,))
+        current = c.fetchone()
+        if current is not None and current[0] == digest:
+            search.set_note_body(c, note_id, text)
+        c.execute('COMMIT')
+    except Exception:
+        c.execute('ROLLBACK')
+        raise
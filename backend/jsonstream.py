@@ -0,0 +1,69 @@
+"""
+Streaming JSON responses for list endpoints.
+
+stream_list() writes {..., "<key>": [item, item, ...], ...} while a cursor
+is being read with fetchmany(), so a request holds one batch of rows and
+one output chunk in memory however long the list is, and the first bytes
+leave before the last row has been read. The items are serialised with
+the app's JSON provider, exactly as jsonify() would.
+"""
+
+from flask import current_app, stream_with_context
+
+import db
+
+FETCH_ROWS = 500
+# Output is sent in chunks of about this size
+CHUNK_BYTES = 64 * 1024
+
+
+def iter_rows(c, size=FETCH_ROWS):
+    """Yield the rows of an executed cursor, `size` at a time from SQLite.
+
+    The cursor is closed when the rows run out or the caller stops early,
+    so a pooled connection isn't handed back still holding a read snapshot.
+    """
+    try:
+        while True:
+            rows = c.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        c.close()
+
+
+def stream_list(fields, key, items, trailer=None):
+    """Return a response streaming `fields` with the `items` list under `key`.
+
+    `trailer`, if given, is called after the last item and returns more
+    fields to close the object with (a next-page cursor, for example).
+    """
+    provider = current_app.json
+
+    def dumps(value):
+        # Compact, like jsonify() outside debug mode
+        return provider.dumps(value, separators=(',', ':'))
+
+    def generate():
+        head = dumps(fields)[:-1]
+        parts = [head + (',' if fields else '') + dumps(key) + ':[']
+        size = 0
+        separator = ''
+        for item in items:
+            text = separator + dumps(item)
+            separator = ','
+            parts.append(text)
+            size += len(text)
+            if size >= CHUNK_BYTES:
+                yield ''.join(parts)
+                parts = []
+                size = 0
+        tail = dumps(trailer())[1:-1] if trailer is not None else ''
+        parts.append(']' + (',' + tail if tail else '') + '}')
+        yield ''.join(parts)
+
+    # Teardown runs before the body is generated, so the request's pooled
+    # connections are handed to the response and go back when it is done.
+    response = current_app.response_class(stream_with_context(generate()), mimetype='application/json')
+    return db.release_after(response)
@@ -0,0 +1,375 @@
+"""
+Load tests and benchmarks against a data set made by seed.py.
+
+    python seed.py /tmp/edvance-bench --scale 0.1
+    python loadtest.py /tmp/edvance-bench                 # in process, through the Flask test client
+    python loadtest.py /tmp/edvance-bench --url http://127.0.0.1:5001
+                                                          # a server started in /tmp/edvance-bench
+
+Each scenario runs `concurrency` simulated users for `duration` seconds,
+each working through sessions drawn from its own seeded generator:
+
+    browse          a student paging through study materials, filtering,
+                    searching and downloading a note
+    apply_burst     students near a deadline: load the scholarship list,
+                    check eligibility, apply to a few
+    sponsor_review  a sponsor paging through a scholarship's pending
+                    applicants by percentage and accepting or rejecting a
+                    few on each page in one batch
+    video_ranges    players fetching 256 KB ranges of videos, one after
+                    the other
+
+The report gives every endpoint's request count, errors (responses other
+than the expected 2xx/304, or failed connections), throughput and
+p50/p95/p99/max latency. --save-baseline keeps the report; --baseline
+compares against it and exits with status 1 when an endpoint's p95 grew,
+or its throughput fell, by more than --threshold, or it started failing.
+
+The apply_burst and sponsor_review scenarios write, so seed a fresh data
+set before taking a baseline. Nothing here needs a network connection
+beyond the server under test.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import applicants
+import seed
+
+DEFAULT_CONCURRENCY = {'browse': 16, 'apply_burst': 64, 'sponsor_review': 8, 'video_ranges': 32}
+DEFAULT_DURATION = 20.0
+DEFAULT_THRESHOLD = 0.25
+RANGE_BYTES = 256 * 1024
+EXPECTED = (200, 206, 304)
+
+
+class HTTPClient:
+    """Keep-alive connections to a running server, one per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class TestClient:
+    """The app in this process, through Flask's test client."""
+
+    def __init__(self, directory):
+        # The app opens its databases relative to the working directory
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(directory)
+        # Expiring scholarships mid-run would change what the scenarios see
+        os.environ.setdefault('EDVANCE_MAINTENANCE', '0')
+        from app import app
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, data=body, headers=headers or {})
+        try:
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+
+class Results:
+    """Latencies and outcomes per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.bytes = {}
+
+    def record(self, label, status, seconds, size):
+        with self._lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            statuses = self.statuses.setdefault(label, {})
+            statuses[status] = statuses.get(status, 0) + 1
+            self.bytes[label] = self.bytes.get(label, 0) + size
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+
+            def milliseconds(q):
+                return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+            statuses = self.statuses[label]
+            endpoints[label] = {
+                'requests': len(ordered),
+                'errors': sum(count for status, count in statuses.items() if status not in EXPECTED),
+                # None: the connection failed
+                'statuses': {str(status): count for status, count in statuses.items()},
+                'rps': round(len(ordered) / elapsed, 1),
+                'mb_per_s': round(self.bytes[label] / elapsed / 1e6, 2),
+                'p50_ms': milliseconds(0.50),
+                'p95_ms': milliseconds(0.95),
+                'p99_ms': milliseconds(0.99),
+                'max_ms': milliseconds(1.0),
+            }
+        return endpoints
+
+
+class Session:
+    """One simulated user's requests, timed under their endpoint labels."""
+
+    def __init__(self, client, rng, dataset, results):
+        self.client = client
+        self.rng = rng
+        self.dataset = dataset
+        self.results = results
+
+    def call(self, label, method, path, params=None, payload=None, headers=None):
+        if params:
+            path += '?' + urlencode(params)
+        headers = dict(headers or {})
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            status, data = self.client.request(method, path, body, headers)
+        except Exception:
+            status, data = None, b''
+        self.results.record(label, status, time.perf_counter() - started, len(data))
+        return status, data
+
+    def call_json(self, *args, **kwargs):
+        status, data = self.call(*args, **kwargs)
+        try:
+            return json.loads(data) if status == 200 else None
+        except ValueError:
+            return None
+
+
+def browse(session):
+    rng, dataset = session.rng, session.dataset
+    session.call('GET /api/study-materials/filters', 'GET', '/api/study-materials/filters')
+    params = {'limit': 20}
+    if rng.random() < 0.8:
+        params['standard'] = rng.choice(dataset['standards'])
+    if rng.random() < 0.6:
+        params['subject'] = rng.choice(dataset['subjects'])
+    materials = []
+    for _page in range(rng.randint(1, 4)):
+        page = session.call_json('GET /api/study-materials', 'GET', '/api/study-materials', params)
+        if page is None:
+            break
+        materials.extend(page['materials'])
+        if not page['next_cursor']:
+            break
+        params['cursor'] = page['next_cursor']
+    if rng.random() < 0.5:
+        words = rng.choice(dataset['topics']).split()
+        query = ' '.join(words[:rng.randint(1, len(words))])
+        session.call('GET /api/search', 'GET', '/api/search', {'q': query[:-1] if rng.random() < 0.3 else query})
+    notes = [m for m in materials if m['type'] == 'notes']
+    if notes and rng.random() < 0.3:
+        session.call('GET /api/notes/<id>/download', 'GET', rng.choice(notes)['download_url'])
+
+
+def apply_burst(session):
+    rng, dataset = session.rng, session.dataset
+    session.call('GET /api/scholarships', 'GET', '/api/scholarships')
+    student = seed.student_data(rng)
+    # The profile has no gender or location; students pick them in the eligibility filters
+    attributes = applicants.extract(student)
+    criteria = {
+        'gender': rng.choices(['Female', 'Male', 'Other'], weights=[48, 50, 2])[0],
+        'family_income': attributes['family_income'],
+        'location_type': rng.choices(['Rural', 'Urban'], weights=[45, 55])[0],
+        'academic_percentage': attributes['academic_percentage'],
+        'limit': 20,
+    }
+    found = session.call_json('POST /api/scholarships/eligible', 'POST', '/api/scholarships/eligible',
+                              payload=criteria)
+    eligible = [s['id'] for s in found['scholarships']] if found else []
+    if not eligible:
+        eligible = [rng.choice(dataset['active_scholarships'])]
+    for scholarship_id in rng.sample(eligible, min(len(eligible), rng.randint(1, 3))):
+        session.call('POST /api/scholarship-applications', 'POST', '/api/scholarship-applications',
+                     payload={'scholarship_id': scholarship_id, 'student_data': student,
+                              'application_message': 'Please consider my application.'})
+
+
+def sponsor_review(session):
+    rng, dataset = session.rng, session.dataset
+    # Sponsors of popular scholarships spend the most time reviewing
+    scholarship_id = rng.choice(dataset['active_scholarships'][:max(1, len(dataset['active_scholarships']) // 20)])
+    session.call('GET /api/scholarship-applications/counts', 'GET', '/api/scholarship-applications/counts',
+                 {'scholarship_id': scholarship_id})
+    params = {'scholarship_id': scholarship_id, 'status': 'pending', 'sort': '-academic_percentage', 'limit': 50,
+              'fields': 'id,student_data,application_message,applied_at,academic_percentage,family_income'}
+    if rng.random() < 0.3:
+        params['min_percentage'] = rng.choice([60, 70, 80])
+    for _page in range(rng.randint(1, 3)):
+        page = session.call_json('GET /api/scholarship-applications', 'GET', '/api/scholarship-applications', params)
+        if page is None:
+            break
+        # A single decision is a PUT; a shortlist goes in one batch
+        picked = rng.sample(page['applications'], min(len(page['applications']), rng.randint(0, 8)))
+        if len(picked) == 1:
+            session.call('PUT /api/scholarship-applications/<id>/status', 'PUT',
+                         f'/api/scholarship-applications/{picked[0]["id"]}/status',
+                         payload={'status': rng.choice(['accepted', 'rejected'])})
+        elif picked:
+            session.call('POST /api/scholarship-applications/status', 'POST', '/api/scholarship-applications/status',
+                         payload={'updates': [{'id': application['id'], 'status': rng.choice(['accepted', 'rejected'])}
+                                              for application in picked]})
+        if not page['next_cursor']:
+            break
+        params['cursor'] = page['next_cursor']
+
+
+def video_ranges(session):
+    rng, dataset = session.rng, session.dataset
+    every = dataset['link_video_every']
+    video_id = rng.randint(1, dataset['counts']['videos'])
+    if video_id % every == 0:
+        video_id = max(1, video_id - 1)
+    start = rng.randrange(0, dataset['video_file_bytes'], RANGE_BYTES)
+    for _chunk in range(rng.randint(2, 8)):
+        if start >= dataset['video_file_bytes']:
+            break
+        session.call('GET /api/videos/<id>/stream (range)', 'GET', f'/api/videos/{video_id}/stream',
+                     headers={'Range': f'bytes={start}-{start + RANGE_BYTES - 1}'})
+        start += RANGE_BYTES
+
+
+SCENARIOS = {
+    'browse': browse,
+    'apply_burst': apply_burst,
+    'sponsor_review': sponsor_review,
+    'video_ranges': video_ranges,
+}
+
+
+def run_scenario(client, dataset, name, concurrency, duration, seed_value):
+    """Run scenario `name`; returns its report."""
+    results = Results()
+    scenario = SCENARIOS[name]
+    deadline = time.monotonic() + duration
+
+    def user(index):
+        rng = random.Random(f'{seed_value}-{name}-{index}')
+        while time.monotonic() < deadline:
+            scenario(Session(client, rng, dataset, results))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return {'concurrency': concurrency, 'seconds': round(elapsed, 2), 'endpoints': results.report(elapsed)}
+
+
+def compare(report, baseline, threshold):
+    """Regressions of `report` against `baseline`, as messages."""
+    problems = []
+    for scenario, old in baseline['scenarios'].items():
+        new = report['scenarios'].get(scenario)
+        if new is None:
+            continue
+        for label, before in old['endpoints'].items():
+            after = new['endpoints'].get(label)
+            if after is None:
+                continue
+            where = f'{scenario} {label}'
+            if after['errors'] and not before['errors']:
+                problems.append(f'{where}: {after["errors"]} errors, none in the baseline')
+            if after['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                problems.append(f'{where}: p95 {after["p95_ms"]} ms, baseline {before["p95_ms"]} ms')
+            if after['rps'] < before['rps'] * (1 - threshold):
+                problems.append(f'{where}: {after["rps"]} req/s, baseline {before["rps"]} req/s')
+    return problems
+
+
+def print_report(name, result):
+    print(f'\n{name}: {result["concurrency"]} users for {result["seconds"]}s')
+    print(f'  {"endpoint":<48} {"requests":>8} {"errors":>6} {"req/s":>8} {"MB/s":>7} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for label, stats in result['endpoints'].items():
+        print(f'  {label:<48} {stats["requests"]:>8} {stats["errors"]:>6} {stats["rps"]:>8} '
+              f'{stats["mb_per_s"]:>7} {stats["p50_ms"]:>8} {stats["p95_ms"]:>8} {stats["p99_ms"]:>8} '
+              f'{stats["max_ms"]:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API against a seeded data set.')
+    parser.add_argument('directory', help='data set made by seed.py')
+    parser.add_argument('--url', help='server to test; by default the app runs in this process')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='scenario to run (repeatable; default: all)')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds per scenario')
+    parser.add_argument('--concurrency', type=int, help='users per scenario (default: per scenario)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='also write the report here')
+    parser.add_argument('--save-baseline', metavar='PATH', help='store the report as the baseline')
+    parser.add_argument('--baseline', metavar='PATH', help='fail on regressions against this baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='allowed p95 growth and throughput drop, as a fraction')
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.directory)
+    with open(os.path.join(directory, 'seed.json'), encoding='utf-8') as f:
+        dataset = json.load(f)
+    # Resolved before TestClient changes the working directory
+    json_path, save_path, baseline_path = (os.path.abspath(p) if p else None
+                                           for p in (args.json, args.save_baseline, args.baseline))
+    client = HTTPClient(args.url) if args.url else TestClient(directory)
+
+    report = {'target': args.url or 'test client', 'dataset': {'seed': dataset['seed'], 'scale': dataset['scale']},
+              'scenarios': {}}
+    for name in args.scenario or SCENARIOS:
+        concurrency = args.concurrency or DEFAULT_CONCURRENCY[name]
+        report['scenarios'][name] = run_scenario(client, dataset, name, concurrency, args.duration, args.seed)
+        print_report(name, report['scenarios'][name])
+
+    for path in (json_path, save_path):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        problems = compare(report, baseline, args.threshold)
+        if problems:
+            print(f'\n{len(problems)} regressions against {baseline_path}:')
+            for problem in problems:
+                print(f'  {problem}')
+            sys.exit(1)
+        print(f'\nNo regressions against {baseline_path} (threshold {args.threshold:.0%})')
+
+
+if __name__ == '__main__':
+    main()
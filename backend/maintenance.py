@@ -0,0 +1,478 @@
+"""
+Background maintenance, run by one server process at a time.
+
+Every process starts a scheduler thread, but only the one holding the lock
+on `<database>-maintenance.lock` does any work. When that process exits the
+lock goes with it and another process takes over on its next tick. The
+tasks:
+
+- expire_scholarships: deactivates scholarships whose application deadline
+  has passed, BATCH rows per transaction, so listings, the eligibility
+  index and new applications stop seeing them.
+- optimize: PRAGMA optimize on every database.
+- analyze, checkpoint, vacuum (off-peak): ANALYZE with analysis_limit, a
+  TRUNCATE checkpoint so the WAL files shrink back, and an incremental
+  vacuum of up to VACUUM_PAGES free pages per file.
+- reconcile_uploads (off-peak): drops upload sessions abandoned for
+  SESSION_DAYS and moves files under uploads/ that no row refers to into
+  uploads/.quarantine/<time>/, keeping their relative paths; quarantined
+  files are deleted after QUARANTINE_DAYS. Files younger than GRACE_SECONDS
+  are left alone, as are blobs rows whose file is missing and reference
+  counts that don't match the rows, which are only reported. Skipped when
+  the database isn't the one in the backend directory next to uploads/.
+
+Off-peak tasks run once a day inside WINDOW (local time). When each task
+last ran and what it did is kept in `<database>-maintenance.json`, which
+GET /api/admin/maintenance shows. POST /api/admin/maintenance/run (or
+`python maintenance.py run [task ...]`) has the leader run tasks on its
+next tick.
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:
+    # Windows runs a single server process, which is always the leader
+    fcntl = None
+
+import blobstore
+import versions
+from db import connect
+
+ENABLED = os.environ.get('EDVANCE_MAINTENANCE', '1') != '0'
+INTERVAL = int(os.environ.get('EDVANCE_MAINTENANCE_INTERVAL_SECONDS', '3600'))
+WINDOW = os.environ.get('EDVANCE_MAINTENANCE_WINDOW', '02:00-05:00')
+TICK_SECONDS = 15
+BATCH = int(os.environ.get('EDVANCE_MAINTENANCE_BATCH', '500'))
+# Between batches, so request writers get the lock
+BATCH_PAUSE = 0.05
+ANALYSIS_LIMIT = 1000
+VACUUM_PAGES = int(os.environ.get('EDVANCE_MAINTENANCE_VACUUM_PAGES', '25000'))
+GRACE_SECONDS = 3600
+SESSION_DAYS = int(os.environ.get('EDVANCE_UPLOAD_SESSION_DAYS', '7'))
+QUARANTINE_DAYS = int(os.environ.get('EDVANCE_QUARANTINE_DAYS', '30'))
+QUARANTINE_DIR = os.path.join(blobstore.UPLOAD_ROOT, '.quarantine')
+# How many paths or digests a report lists per kind
+SAMPLE = 20
+
+
+def in_window(now, window=WINDOW):
+    """Whether `now` falls inside an 'HH:MM-HH:MM' window, which may wrap midnight."""
+    if not window:
+        return True
+    start, end = (datetime.strptime(part.strip(), '%H:%M').time() for part in window.split('-'))
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def _sample(items):
+    return sorted(items)[:SAMPLE]
+
+
+class Maintenance:
+    def __init__(self):
+        self.database = None
+        self.sponsorship = None
+        self.databases = ()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._leader_file = None
+        # Each task is (function, seconds between runs, off-peak only)
+        self.tasks = {
+            'expire_scholarships': (self.expire_scholarships, INTERVAL, False),
+            'optimize': (self.optimize, INTERVAL, False),
+            'analyze': (self.analyze, 20 * 3600, True),
+            'checkpoint': (self.checkpoint, 20 * 3600, True),
+            'vacuum': (self.vacuum, 20 * 3600, True),
+            'reconcile_uploads': (self.reconcile_uploads, 20 * 3600, True),
+        }
+
+    def configure(self, database, sponsorship, databases):
+        """`database` holds the uploads and blobs tables, `sponsorship` the
+        scholarships; `databases` are every file to optimize and checkpoint."""
+        self.database = database
+        self.sponsorship = sponsorship
+        self.databases = tuple(databases)
+        self.state_path = f'{database}-maintenance.json'
+        self.lock_path = f'{database}-maintenance.lock'
+
+    # Shared state
+
+    @contextlib.contextmanager
+    def _state(self):
+        """Read-modify-write the state file, one process at a time."""
+        with open(f'{self.state_path}.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                state = self.load_state()
+                yield state
+                temp_path = f'{self.state_path}.{os.getpid()}.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, indent=1)
+                os.replace(temp_path, self.state_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except ValueError as e:
+            print(f"Warning: Could not read maintenance state: {e}")
+            state = {}
+        state.setdefault('leader', None)
+        state.setdefault('requested', [])
+        state.setdefault('tasks', {})
+        return state
+
+    def status(self):
+        state = self.load_state()
+        state['enabled'] = ENABLED
+        state['window'] = WINDOW
+        state['interval_seconds'] = INTERVAL
+        state['schedule'] = {name: 'off-peak' if off_peak else f'every {every} s'
+                             for name, (_task, every, off_peak) in self.tasks.items()}
+        return state
+
+    def request(self, names):
+        """Have the leader run the tasks `names` on its next tick."""
+        with self._state() as state:
+            state['requested'] = [name for name in self.tasks
+                                  if name in names or name in state['requested']]
+            return state['requested']
+
+    # Scheduling
+
+    def ensure_started(self):
+        """Start this process's scheduler thread once (again after a fork)."""
+        if self._started_pid == os.getpid() or not ENABLED:
+            return
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            # A forked child takes the lock for itself or not at all
+            self._leader_file = None
+            threading.Thread(target=self._run, name='maintenance', daemon=True).start()
+
+    def try_lead(self):
+        """Take the leader lock if no other process holds it; True while this process leads."""
+        if self._leader_file is not None:
+            return True
+        lock_file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._leader_file = lock_file
+        with self._state() as state:
+            state['leader'] = {'pid': os.getpid(), 'since': datetime.now().isoformat(timespec='seconds')}
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self.try_lead():
+                    self.tick()
+            except Exception as e:
+                print(f"Warning: Maintenance failed: {e}")
+            time.sleep(TICK_SECONDS)
+
+    def due(self, state, now):
+        off_peak_now = in_window(now)
+        due = []
+        for name, (_task, every, off_peak) in self.tasks.items():
+            if name in state['requested']:
+                due.append(name)
+                continue
+            if off_peak and not off_peak_now:
+                continue
+            last = state['tasks'].get(name, {}).get('started_at')
+            if last is None or now - datetime.fromisoformat(last) >= timedelta(seconds=every):
+                due.append(name)
+        return due
+
+    def tick(self):
+        for name in self.due(self.load_state(), datetime.now()):
+            self.run_task(name)
+
+    def run_task(self, name):
+        started_at = datetime.now()
+        started = time.perf_counter()
+        entry = {'started_at': started_at.isoformat(timespec='seconds')}
+        try:
+            entry['result'] = self.tasks[name][0]()
+        except Exception as e:
+            entry['error'] = str(e)
+            print(f"Warning: Maintenance task {name} failed: {e}")
+        entry['seconds'] = round(time.perf_counter() - started, 3)
+        with self._state() as state:
+            state['tasks'][name] = entry
+            state['requested'] = [n for n in state['requested'] if n != name]
+        return entry
+
+    # Tasks
+
+    def expire_scholarships(self):
+        today = date.today().isoformat()
+        conn = connect(self.sponsorship)
+        conn.isolation_level = None
+        expired = batches = 0
+        try:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    # '' sorts before every date; NULL and '' mean no deadline
+                    count = conn.execute('''
+                        UPDATE scholarships SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                        WHERE id IN (
+                            SELECT id FROM scholarships WHERE is_active = 1
+                            AND application_deadline > '' AND application_deadline < ? LIMIT ?
+                        )
+                    ''', (today, BATCH)).rowcount
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+                if count:
+                    batches += 1
+                    expired += count
+                    versions.bump(self.sponsorship, 'scholarships')
+                if count < BATCH:
+                    break
+                time.sleep(BATCH_PAUSE)
+        finally:
+            conn.close()
+        return {'expired': expired, 'batches': batches, 'deadline_before': today}
+
+    def _each_database(self, work):
+        results = {}
+        for path in self.databases:
+            conn = connect(path)
+            conn.isolation_level = None
+            started = time.perf_counter()
+            try:
+                result = work(conn) or {}
+            finally:
+                conn.close()
+            results[os.path.basename(path)] = {**result, 'seconds': round(time.perf_counter() - started, 3)}
+        return results
+
+    def optimize(self):
+        def work(conn):
+            conn.execute('PRAGMA optimize').fetchall()
+        return self._each_database(work)
+
+    def analyze(self):
+        def work(conn):
+            conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+            conn.execute('ANALYZE')
+        return self._each_database(work)
+
+    def checkpoint(self):
+        def work(conn):
+            busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            # busy: a reader kept the WAL from being truncated this time
+            return {'busy': bool(busy), 'wal_pages': wal_pages, 'checkpointed': checkpointed}
+        return self._each_database(work)
+
+    def vacuum(self):
+        def work(conn):
+            mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if mode != 2:
+                # Files created before incremental auto_vacuum need one full
+                # VACUUM (which takes the write lock for its duration) to switch
+                return {'free_pages': free, 'skipped': 'auto_vacuum is not incremental'}
+            conn.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES})').fetchall()
+            left = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            return {'freed_pages': free - left, 'free_pages': left}
+        return self._each_database(work)
+
+    def reconcile_uploads(self):
+        # The upload tree is always the one in the backend directory; a data
+        # set elsewhere (seed.py's, say) has no rows for the files in it
+        if os.path.dirname(os.path.abspath(self.database)) != blobstore.BACKEND_DIR:
+            return {'skipped': f'{self.database} is not the database of {blobstore.UPLOAD_ROOT}'}
+        report = {'sessions_expired': 0, 'quarantined': 0, 'quarantined_bytes': 0, 'quarantine_purged': 0}
+        conn = connect(self.database, {'sponsorship': self.sponsorship})
+        conn.isolation_level = None
+        try:
+            report['sessions_expired'] = self._expire_sessions(conn)
+            orphans = self._find_orphans(conn, report)
+            self._quarantine(conn, orphans, report)
+        finally:
+            conn.close()
+        report['quarantine_purged'] = self._purge_quarantine()
+        return report
+
+    def _expire_sessions(self, conn):
+        age = f'-{SESSION_DAYS} days'
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''
+                DELETE FROM upload_chunks WHERE session_id IN (
+                    SELECT id FROM upload_sessions WHERE status = 'open' AND updated_at < datetime('now', ?)
+                )
+            ''', (age,))
+            count = conn.execute("DELETE FROM upload_sessions WHERE status = 'open' AND updated_at < datetime('now', ?)",
+                                 (age,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        # Their partial files are picked up as orphans below
+        return count
+
+    def _find_orphans(self, conn, report):
+        """Files under uploads/ nothing refers to, as (kind, key, path); kind says how to re-check them."""
+        blobs = dict(conn.execute('SELECT digest, ref_count FROM blobs'))
+        open_sessions = {row[0] for row in conn.execute("SELECT id FROM upload_sessions WHERE status = 'open'")}
+        # Files from before the blob store are referenced by path
+        legacy = set()
+        located = {}
+        refs = Counter()
+        for table, path_column, digest_column in blobstore.LEGACY_COLUMNS:
+            for file_path, digest in conn.execute(f'SELECT {path_column}, {digest_column} FROM {table} '
+                                                  f'WHERE {path_column} IS NOT NULL'):
+                if digest:
+                    refs[digest] += 1
+                    continue
+                if file_path not in located:
+                    located[file_path] = blobstore.locate_file(file_path)
+                if located[file_path]:
+                    legacy.add(located[file_path])
+
+        report['missing_blobs'] = _sample(d for d in blobs if not os.path.exists(blobstore.blob_path(d)))
+        report['ref_count_mismatches'] = _sample(f'{d}: counted {n}, referenced {refs[d]}'
+                                                 for d, n in blobs.items() if n != refs[d])
+        report['unknown_digests'] = _sample(d for d in refs if d not in blobs)
+
+        cutoff = time.time() - GRACE_SECONDS
+        orphans = []
+        for directory, subdirs, files in os.walk(blobstore.UPLOAD_ROOT):
+            if directory == blobstore.UPLOAD_ROOT and '.quarantine' in subdirs:
+                subdirs.remove('.quarantine')
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if directory.startswith(blobstore.BLOB_ROOT):
+                    # Leftover .deleted trash, or a blob whose row was rolled back
+                    if not (blobstore.DIGEST.match(name) and name in blobs):
+                        orphans.append(('blob', name, path))
+                elif directory == blobstore.TEMP_DIR:
+                    session_id = name[:-len('.part')] if name.endswith('.part') else None
+                    if session_id not in open_sessions:
+                        orphans.append(('partial', session_id, path))
+                elif os.path.abspath(path) not in legacy:
+                    orphans.append(('legacy', None, path))
+        return orphans
+
+    def _quarantine(self, conn, orphans, report):
+        destination = os.path.join(QUARANTINE_DIR, datetime.now().strftime('%Y%m%d-%H%M%S'))
+        moved = []
+        for start in range(0, len(orphans), BATCH):
+            # Uploads add blob rows and claim sessions inside a write
+            # transaction on this database, so nothing can start referring to
+            # a file between the check and the move
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for kind, key, path in orphans[start:start + BATCH]:
+                    if kind == 'blob' and blobstore.DIGEST.match(key) and conn.execute(
+                            'SELECT 1 FROM blobs WHERE digest = ?', (key,)).fetchone():
+                        continue
+                    if kind == 'partial' and key and conn.execute(
+                            "SELECT 1 FROM upload_sessions WHERE id = ? AND status = 'open'", (key,)).fetchone():
+                        continue
+                    target = os.path.join(destination, os.path.relpath(path, blobstore.UPLOAD_ROOT))
+                    try:
+                        size = os.path.getsize(path)
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        os.replace(path, target)
+                    except FileNotFoundError:
+                        continue
+                    report['quarantined'] += 1
+                    report['quarantined_bytes'] += size
+                    moved.append(os.path.relpath(path, blobstore.UPLOAD_ROOT))
+            finally:
+                conn.execute('COMMIT')
+            time.sleep(BATCH_PAUSE)
+        report['quarantined_files'] = _sample(moved)
+        if moved:
+            report['quarantine_dir'] = destination
+
+    def _purge_quarantine(self):
+        if not os.path.isdir(QUARANTINE_DIR):
+            return 0
+        cutoff = datetime.now() - timedelta(days=QUARANTINE_DAYS)
+        purged = 0
+        for name in os.listdir(QUARANTINE_DIR):
+            try:
+                quarantined_at = datetime.strptime(name, '%Y%m%d-%H%M%S')
+            except ValueError:
+                continue
+            if quarantined_at < cutoff:
+                shutil.rmtree(os.path.join(QUARANTINE_DIR, name), ignore_errors=True)
+                purged += 1
+        return purged
+
+
+scheduler = Maintenance()
+
+
+def configure(database, sponsorship, databases):
+    scheduler.configure(database, sponsorship, databases)
+
+
+def ensure_started():
+    scheduler.ensure_started()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['run']:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        import domains
+        from migrations import (APPLICATION_MIGRATIONS, MAIN_MIGRATIONS, SPONSORSHIP_MIGRATIONS,
+                                STUDENT_MIGRATIONS, migrate)
+        database = 'teacher_profiles.db'
+        sponsorship, applications = domains.paths(database)
+        databases = {database: MAIN_MIGRATIONS, sponsorship: SPONSORSHIP_MIGRATIONS,
+                     applications: APPLICATION_MIGRATIONS, 'student_profiles.db': STUDENT_MIGRATIONS}
+        for path, migrations in databases.items():
+            migrate(path, migrations)
+        configure(database, sponsorship, databases)
+        names = sys.argv[2:] or list(scheduler.tasks)
+        unknown = [name for name in names if name not in scheduler.tasks]
+        if unknown:
+            print(f'unknown tasks: {", ".join(unknown)}; tasks are {", ".join(scheduler.tasks)}')
+            sys.exit(2)
+        if not scheduler.try_lead():
+            scheduler.request(names)
+            print('The server is running maintenance; it will run these on its next tick')
+            sys.exit(0)
+        for name in names:
+            print(name, json.dumps(scheduler.run_task(name), indent=1))
+    else:
+        print('usage: python maintenance.py run [task ...]')
+        sys.exit(2)
@@ -0,0 +1,364 @@
+"""
+Asynchronous video delivery, run as its own process next to the Flask app.
+
+    python mediaserver.py [--host 127.0.0.1] [--port 5002] [database]
+
+Serves GET/HEAD /api/videos/<id>/stream exactly like the Flask route
+(ETag, Last-Modified, If-None-Match, If-Range, single byte ranges) from
+the same database and uploads tree, but on one asyncio event loop, so
+thousands of viewers cost a socket and an open file each instead of a
+request thread. Put it behind the same front proxy as the app and route
+the stream URLs to it; the Flask route keeps working for everything else.
+
+Bodies go out with sendfile() in slices of CHUNK_SIZE, each awaited before
+the next, so a slow client holds at most one slice in flight and never
+builds up a buffer in this process. CLIENT_RATE caps the combined rate of
+all requests from one client address. Requests from TRUSTED_PROXIES are
+counted against the address the proxy passes in X-Real-IP or
+X-Forwarded-For, so viewers behind the front proxy don't share one cap.
+"""
+
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import re
+import signal
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import (http_date, parse_date, parse_etags, parse_if_range_header,
+                           parse_range_header, quote_etag)
+
+import blobstore
+import versions
+from db import connect
+from fileserve import content_hash, resolve_ranges
+
+CHUNK_SIZE = 256 * 1024
+# Bytes per second per client address, 0 for no cap
+CLIENT_RATE = int(os.environ.get('EDVANCE_MEDIA_CLIENT_RATE', '0'))
+# Peers whose X-Real-IP / X-Forwarded-For name the client
+TRUSTED_PROXIES = frozenset(address.strip() for address in
+                            os.environ.get('EDVANCE_MEDIA_TRUSTED_PROXIES', '127.0.0.1,::1').split(',')
+                            if address.strip())
+MAX_CONNECTIONS = int(os.environ.get('EDVANCE_MEDIA_MAX_CONNECTIONS', '4096'))
+HEADER_LIMIT = 16 * 1024
+KEEPALIVE_TIMEOUT = 15
+# A client that accepts no data for this long is dropped
+SEND_TIMEOUT = 60
+GRACEFUL_TIMEOUT = float(os.environ.get('EDVANCE_GRACEFUL_TIMEOUT', '120'))
+LOOKUP_CACHE_SIZE = 4096
+
+STREAM_PATH = re.compile(r'/api/videos/(\d+)/stream')
+
+REASONS = {
+    200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request',
+    404: 'Not Found', 405: 'Method Not Allowed', 416: 'Range Not Satisfiable',
+    431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class TokenBucket:
+    """Rate limit shared by every request from one client."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.users = 0
+
+    async def take(self, wanted):
+        """Wait until some bytes may be sent; returns how many (at most `wanted`)."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                granted = int(min(wanted, self.tokens))
+                self.tokens -= granted
+                return granted
+            await asyncio.sleep((1 - self.tokens) / self.rate + 0.01)
+
+
+class VideoLookup:
+    """Cached id -> (file_path, file_name, video_type, digest), dropped when videos change."""
+
+    def __init__(self, database):
+        self.database = database
+        self.conn = connect(database)
+        self.version = None
+        self.entries = OrderedDict()
+
+    def get(self, video_id):
+        version = versions.current(self.database, 'uploaded_videos')
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+        if video_id in self.entries:
+            self.entries.move_to_end(video_id)
+            return self.entries[video_id]
+        # An indexed primary-key read; cheap enough to do on the loop
+        row = self.conn.execute(
+            'SELECT file_path, file_name, video_type, blob_digest FROM uploaded_videos WHERE id = ?', (video_id,)
+        ).fetchone()
+        self.entries[video_id] = row
+        while len(self.entries) > LOOKUP_CACHE_SIZE:
+            self.entries.popitem(last=False)
+        return row
+
+
+class MediaServer:
+    def __init__(self, database, client_rate=CLIENT_RATE, max_connections=MAX_CONNECTIONS):
+        self.lookup = VideoLookup(database)
+        self.client_rate = client_rate
+        self.max_connections = max_connections
+        self.buckets = {}
+        self.swept = 0
+        self.connections = set()
+        # Connections waiting for their next request, closed on shutdown
+        self.idle = set()
+        self.closing = False
+
+    @staticmethod
+    def client_address(peer, headers):
+        """The client a request is from: the peer, or who a trusted proxy says it forwarded."""
+        if peer in TRUSTED_PROXIES:
+            # The proxy appends the address it saw to X-Forwarded-For
+            forwarded = headers.get('x-real-ip') or headers.get('x-forwarded-for', '').rsplit(',', 1)[-1]
+            if forwarded.strip():
+                return forwarded.strip()
+        return peer
+
+    def acquire_bucket(self, client):
+        if not self.client_rate:
+            return None
+        now = time.monotonic()
+        # A bucket idle for a second is full again, no different from a new one;
+        # keeping it until then stops back-to-back requests each starting full
+        if now - self.swept >= 1:
+            self.swept = now
+            idle = [key for key, other in self.buckets.items() if not other.users and now - other.updated >= 1]
+            for key in idle:
+                del self.buckets[key]
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.client_rate)
+        bucket.users += 1
+        return bucket
+
+    def release_bucket(self, bucket):
+        if bucket is not None:
+            bucket.users -= 1
+
+    async def handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        peer = (writer.get_extra_info('peername') or ('',))[0]
+        try:
+            writer.transport.set_write_buffer_limits(high=CHUNK_SIZE)
+            if len(self.connections) > self.max_connections:
+                await self.send_error(writer, 503, 'Too many connections', keep_alive=False)
+                return
+            keep_alive = True
+            while keep_alive and not self.closing:
+                self.idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 431, 'Request headers too large', keep_alive=False)
+                    return
+                finally:
+                    self.idle.discard(writer)
+                keep_alive = await self.handle_request(head, writer, peer)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            print(f'Warning: media request failed: {e}', file=sys.stderr)
+        finally:
+            self.connections.discard(task)
+            self.idle.discard(writer)
+            writer.close()
+
+    def shutdown(self):
+        """Stop reusing connections and drop the ones waiting between requests."""
+        self.closing = True
+        for writer in list(self.idle):
+            writer.close()
+
+    async def handle_request(self, head, writer, peer):
+        """Answer one request; returns whether the connection may be reused."""
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, protocol = lines[0].split(' ')
+        except ValueError:
+            await self.send_error(writer, 400, 'Malformed request line', keep_alive=False)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            if name:
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = ((protocol == 'HTTP/1.1' and connection != 'close') or connection == 'keep-alive') \
+            and not self.closing
+        # Bodies aren't read, so a request that has one ends the connection
+        if headers.get('content-length', '0') != '0' or 'transfer-encoding' in headers:
+            keep_alive = False
+
+        async def fail(status, message, extra=None):
+            await self.send_error(writer, status, message, keep_alive, extra, body=method != 'HEAD')
+            return keep_alive
+
+        match = STREAM_PATH.fullmatch(target.split('?', 1)[0])
+        if match is None:
+            return await fail(404, 'Not found')
+        if method not in ('GET', 'HEAD'):
+            return await fail(405, 'Method not allowed', {'Allow': 'GET, HEAD'})
+
+        try:
+            row = self.lookup.get(int(match.group(1)))
+        except sqlite3.Error as e:
+            return await fail(500, f'Error streaming video: {e}')
+        if not row:
+            return await fail(404, 'Video not found')
+        file_path, file_name, video_type, digest = row
+        if video_type != 'file':
+            return await fail(400, 'This is not a file video')
+        path = blobstore.locate_file(file_path)
+        if path is None:
+            return await fail(404, 'Video file not found')
+
+        client = self.client_address(peer, headers)
+        bucket = self.acquire_bucket(client)
+        try:
+            await self.send_file(writer, method, headers, path, file_name, digest, keep_alive, bucket)
+        finally:
+            self.release_bucket(bucket)
+        return keep_alive
+
+    async def send_file(self, writer, method, headers, path, file_name, etag, keep_alive, bucket):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            if etag is None:
+                # Legacy files have no stored digest; hashing one reads it whole
+                etag = await asyncio.get_running_loop().run_in_executor(None, content_hash, path, st)
+            response_headers = Headers({
+                'Content-Type': mimetypes.guess_type(file_name or path)[0] or 'application/octet-stream',
+                'ETag': quote_etag(etag),
+                'Last-Modified': http_date(st.st_mtime),
+                'Accept-Ranges': 'bytes',
+                'Cache-Control': 'private, max-age=0, must-revalidate',
+            })
+            if file_name:
+                response_headers.set('Content-Disposition', 'inline', filename=file_name)
+
+            if_none_match = parse_etags(headers.get('if-none-match')) if 'if-none-match' in headers else None
+            if_modified_since = parse_date(headers.get('if-modified-since'))
+            if if_none_match is not None:
+                not_modified = if_none_match.star_tag or if_none_match.contains_weak(etag)
+            else:
+                not_modified = if_modified_since is not None and int(st.st_mtime) <= if_modified_since.timestamp()
+            if not_modified:
+                await self.send_head(writer, 304, response_headers, keep_alive)
+                return
+
+            ranges = []
+            range_header = parse_range_header(headers.get('range'))
+            if range_header is not None:
+                if_range = parse_if_range_header(headers.get('if-range'))
+                if if_range.etag is not None:
+                    use_range = if_range.etag == etag
+                elif if_range.date is not None:
+                    use_range = int(st.st_mtime) <= if_range.date.timestamp()
+                else:
+                    use_range = True
+                if use_range:
+                    ranges = resolve_ranges(range_header, size)
+            if ranges is None:
+                response_headers['Content-Range'] = f'bytes */{size}'
+                await self.send_head(writer, 416, response_headers, keep_alive, content_length=0)
+                return
+
+            # Players ask for one range at a time; several are answered
+            # with the whole file, which HTTP allows.
+            if len(ranges) == 1:
+                status = 206
+                start, end = ranges[0]
+                response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            else:
+                status, start, end = 200, 0, size - 1
+            await self.send_head(writer, status, response_headers, keep_alive, content_length=end - start + 1)
+            if method == 'GET':
+                await self.send_body(writer, f, start, end - start + 1, bucket)
+
+    async def send_body(self, writer, f, offset, count, bucket):
+        loop = asyncio.get_running_loop()
+        while count > 0:
+            size = min(count, CHUNK_SIZE)
+            if bucket is not None:
+                size = await bucket.take(size)
+            # Completes once the slice is in the kernel's socket buffer, so
+            # the next read waits for the client to keep up.
+            sent = await asyncio.wait_for(loop.sendfile(writer.transport, f, offset, size), SEND_TIMEOUT)
+            if not sent:
+                raise ConnectionError('file ended early')
+            offset += sent
+            count -= sent
+
+    async def send_head(self, writer, status, headers, keep_alive, content_length=None):
+        lines = [f'HTTP/1.1 {status} {REASONS[status]}', f'Date: {http_date()}',
+                 'Access-Control-Allow-Origin: *', f'Connection: {"keep-alive" if keep_alive else "close"}']
+        if content_length is not None:
+            lines.append(f'Content-Length: {content_length}')
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+    async def send_error(self, writer, status, message, keep_alive, headers=None, body=True):
+        content = json.dumps({'error': message}).encode()
+        headers = Headers(headers)
+        headers['Content-Type'] = 'application/json'
+        await self.send_head(writer, status, headers, keep_alive, content_length=len(content))
+        if body:
+            writer.write(content)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+
+
+async def serve(database, host, port, reuse_port=False):
+    media = MediaServer(database)
+    server = await asyncio.start_server(media.handle_connection, host, port, limit=HEADER_LIMIT,
+                                        reuse_port=reuse_port or None, backlog=1024)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    print(f'Media server on http://{host}:{port}', flush=True)
+    async with server:
+        await stop.wait()
+        # Stop accepting, then give running transfers time to finish
+        server.close()
+        media.shutdown()
+        if media.connections:
+            await asyncio.wait(list(media.connections), timeout=GRACEFUL_TIMEOUT)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve video streams asynchronously.')
+    parser.add_argument('--host', default=os.environ.get('EDVANCE_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('EDVANCE_MEDIA_PORT', '5002')))
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='let several media server processes share the port')
+    parser.add_argument('database', nargs='?', default='teacher_profiles.db')
+    args = parser.parse_args()
+    os.chdir(blobstore.BACKEND_DIR)
+    asyncio.run(serve(args.database, args.host, args.port, args.reuse_port))
@@ -0,0 +1,639 @@
+"""
+Request and SQL metrics, exported at /metrics in the Prometheus text format.
+
+Each process counts into its own registry:
+
+- per route: a latency histogram (request start to last body byte), the
+  part of it spent in SQL, waiting for a pooled connection or a lock,
+  waiting for the application write queue and serialising JSON, requests
+  by status code and response bytes sent;
+- per SQL statement: a histogram of execute-plus-fetch time and the rows
+  returned. Statements are normalised (literals and IN lists collapsed) so
+  they group by shape; schema changes and PRAGMAs share the label `ddl`,
+  and labels are cut at MAX_STATEMENT_LABEL characters. Time SQLite spends waiting for another connection's
+  write lock is part of the statement that waited, usually the first write
+  of a transaction or its COMMIT.
+
+Worker processes don't share memory, so each one writes its registry to
+`<database>-metrics/<pid>.json` every FLUSH_SECONDS and when it exits, and
+/metrics adds up the files of every process. Files left by processes that
+have exited are folded into `retired.json`, so counters never go backwards
+when a worker is recycled.
+
+Statements slower than EDVANCE_SLOW_QUERY_MS are written to the slow query
+log (EDVANCE_SLOW_QUERY_LOG, or stderr) with their normalised SQL and the
+types of their parameters, never the values.
+"""
+
+import atexit
+import bisect
+import contextlib
+import functools
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from time import perf_counter
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+import prefork
+
+try:
+    import fcntl
+except ImportError:
+    # Windows runs a single server process; there is nothing to merge
+    fcntl = None
+
+ENABLED = os.environ.get('EDVANCE_METRICS', '1') != '0'
+FLUSH_SECONDS = float(os.environ.get('EDVANCE_METRICS_FLUSH_SECONDS', '5'))
+SLOW_QUERY_MS = float(os.environ.get('EDVANCE_SLOW_QUERY_MS', '100'))
+SLOW_QUERY_LOG = os.environ.get('EDVANCE_SLOW_QUERY_LOG')
+# Statements beyond this many distinct shapes are counted as 'other'
+MAX_STATEMENTS = 500
+# Longer statement labels are cut here
+MAX_STATEMENT_LABEL = 160
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'edvance_http_requests_total': (
+        'counter', 'Requests by route, method and status code.', ('route', 'method', 'status'), None),
+    'edvance_http_request_duration_seconds': (
+        'histogram', 'Time from request start to the last body byte.', ('route', 'method'), LATENCY_BUCKETS),
+    'edvance_http_request_phase_seconds': (
+        'histogram', 'Time per request spent in one phase: sql, pool_wait, lock_wait, write_queue or serialize.',
+        ('route', 'phase'), LATENCY_BUCKETS),
+    'edvance_http_response_bytes_total': (
+        'counter', 'Response body bytes sent, after compression.', ('route', 'method'), None),
+    'edvance_sql_duration_seconds': (
+        'histogram', 'Execute plus fetch time per statement.', ('statement',), SQL_BUCKETS),
+    'edvance_sql_rows_total': ('counter', 'Rows returned per statement.', ('statement',), None),
+    'edvance_sql_slow_total': ('counter', 'Statements slower than the slow query threshold.', ('statement',), None),
+    'edvance_db_pool_wait_seconds': (
+        'histogram', 'Time spent waiting for a pooled connection.', ('database',), SQL_BUCKETS),
+}
+
+UNMATCHED_ROUTE = 'unmatched'
+
+_current = threading.local()
+
+
+def declare(name, kind, help_text, labels, buckets=None):
+    """Describe a metric reported by a collector (see add_collector())."""
+    METRICS[name] = (kind, help_text, tuple(labels), buckets)
+
+
+class Registry:
+    """This process's counters and histograms."""
+
+    def __init__(self):
+        self.collectors = []
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        # Histograms: [count per bucket..., count above the last, sum]
+        self.histograms = {}
+        self.statements = set()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-1] += value
+
+    def statement_label(self, statement):
+        if statement in self.statements:
+            return statement
+        with self._lock:
+            if len(self.statements) >= MAX_STATEMENTS:
+                return 'other'
+            self.statements.add(statement)
+        return statement
+
+    def snapshot(self):
+        """JSON-ready copy of every value, collectors included."""
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), values] for (name, labels), values in self.histograms.items()]
+        gauges = []
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    target = gauges if METRICS[name][0] == 'gauge' else counters
+                    target.append([name, list(labels), value])
+            except Exception as e:
+                print(f"Warning: metrics collector failed: {e}", file=sys.stderr)
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+
+registry = Registry()
+if hasattr(os, 'register_at_fork'):
+    # A forked worker reports its own requests, not what its parent counted
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def add_collector(collector):
+    """Have `collector()` yield (name, label values, value) samples at every flush.
+
+    Counters are this process's running totals; gauges are current values.
+    Both are summed across processes. Declare the names with declare().
+    """
+    registry.collectors.append(collector)
+    return collector
+
+
+# Request timing
+
+def add_time(phase, seconds):
+    """Count `seconds` towards `phase` of the request running on this thread."""
+    phases = getattr(_current, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def waiting(lock):
+    """Hold `lock`, counting the time it took to get as the request's lock_wait."""
+    started = time.perf_counter()
+    with lock:
+        add_time('lock_wait', time.perf_counter() - started)
+        yield
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, counting serialisation time per request."""
+
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            add_time('serialize', time.perf_counter() - started)
+
+
+class _RecordedBody:
+    """Passes a response body through, counting bytes; records the request on close()."""
+
+    def __init__(self, body, record):
+        self._body = body
+        self._record = record
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._body:
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._record(self.sent)
+
+
+class Middleware:
+    """WSGI middleware timing each request until its body has been sent."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        exporter.ensure_flusher()
+        started = time.perf_counter()
+        phases = _current.phases = {}
+        _current.route = None
+        response = {'status': '500', 'length': None}
+
+        def recording_start_response(status, headers, exc_info=None):
+            response['status'] = status.split(' ', 1)[0]
+            response['length'] = next((v for k, v in headers if k.lower() == 'content-length'), None)
+            return start_response(status, headers, exc_info)
+
+        def record(sent):
+            route = environ.get('edvance.route') or UNMATCHED_ROUTE
+            method = environ.get('REQUEST_METHOD', '')
+            registry.inc('edvance_http_requests_total', (route, method, response['status']))
+            registry.observe('edvance_http_request_duration_seconds', (route, method),
+                             time.perf_counter() - started)
+            registry.inc('edvance_http_response_bytes_total', (route, method), sent)
+            for phase, seconds in phases.items():
+                registry.observe('edvance_http_request_phase_seconds', (route, phase), seconds)
+            if getattr(_current, 'phases', None) is phases:
+                _current.phases = None
+
+        try:
+            body = self.wsgi_app(environ, recording_start_response)
+        except BaseException:
+            record(0)
+            raise
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            # Leave the server's sendfile path alone; the header gives the size
+            record(int(response['length'] or 0))
+            return body
+        return _RecordedBody(body, record)
+
+
+def _label_route():
+    # Route patterns, not paths, so ids don't each get a series
+    rule = request.url_rule.rule if request.url_rule is not None else None
+    request.environ['edvance.route'] = rule
+    _current.route = rule
+
+
+# SQL timing
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_SPACE = re.compile(r'\s+')
+# Schema changes, settings and attachments, mostly run once by migrations or per connection
+_DDL = re.compile(r'(?:CREATE|ALTER|DROP|PRAGMA|ANALYZE|VACUUM|REINDEX|ATTACH|DETACH)\b', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize_sql(sql):
+    """Collapse whitespace, literals and placeholder lists so statements group by shape."""
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _LITERAL.sub('?', sql)
+    return _LIST.sub('(?, ...)', sql)
+
+
+def statement_label(statement):
+    """The `statement` label of a normalised statement: DDL shares one, long ones are cut."""
+    if _DDL.match(statement):
+        return 'ddl'
+    if len(statement) > MAX_STATEMENT_LABEL:
+        statement = statement[:MAX_STATEMENT_LABEL - 4] + ' ...'
+    return registry.statement_label(statement)
+
+
+def bind_shape(parameters):
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in parameters.items()) + '}'
+    return '(' + ', '.join(type(v).__name__ for v in parameters) + ')'
+
+
+_slow_log_lock = threading.Lock()
+
+
+def _log_slow(statement, shape, seconds, rows):
+    entry = {
+        'at': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'ms': round(seconds * 1000, 3),
+        'rows': rows,
+        'route': getattr(_current, 'route', None),
+        'sql': statement,
+        'params': shape,
+    }
+    line = json.dumps(entry)
+    with _slow_log_lock:
+        if SLOW_QUERY_LOG:
+            with open(SLOW_QUERY_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        else:
+            print(f'Slow query: {line}', file=sys.stderr)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor recording each statement's execute and fetch time and row count."""
+
+    _statement = None
+
+    def _finish(self):
+        sql = self._statement
+        if sql is None:
+            return
+        self._statement = None
+        seconds = self._seconds
+        add_time('sql', seconds)
+        normalized = normalize_sql(sql)
+        statement = statement_label(normalized)
+        registry.observe('edvance_sql_duration_seconds', (statement,), seconds)
+        if self._rows:
+            registry.inc('edvance_sql_rows_total', (statement,), self._rows)
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            registry.inc('edvance_sql_slow_total', (statement,))
+            shape = 'many' if self._parameters is None else bind_shape(self._parameters)
+            _log_slow(normalized, shape, seconds, self._rows)
+        self._parameters = None
+
+    def execute(self, sql, parameters=()):
+        if self._statement is not None:
+            self._finish()
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._seconds = perf_counter() - started
+            self._rows = 0
+            self._parameters = parameters
+            self._statement = sql
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._statement is not None:
+            self._finish()
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._seconds = perf_counter() - started
+            self._rows = 0
+            self._parameters = None
+            self._statement = sql
+            self._finish()
+
+    def fetchone(self):
+        started = perf_counter()
+        row = super().fetchone()
+        if self._statement is not None:
+            self._seconds += perf_counter() - started
+            if row is None:
+                self._finish()
+            else:
+                self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = perf_counter()
+        rows = super().fetchmany(size)
+        if self._statement is not None:
+            self._seconds += perf_counter() - started
+            self._rows += len(rows)
+            if len(rows) < size:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        started = perf_counter()
+        rows = super().fetchall()
+        if self._statement is not None:
+            self._seconds += perf_counter() - started
+            self._rows += len(rows)
+            self._finish()
+        return rows
+
+    def __next__(self):
+        started = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            if self._statement is not None:
+                self._seconds += perf_counter() - started
+                self._finish()
+            raise
+        self._seconds += perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Statements whose rows weren't read to the end finish here
+        self._finish()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors are TimedCursors; see db.connect()."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return TimedConnection if ENABLED else sqlite3.Connection
+
+
+def observe_pool_wait(database, seconds):
+    if ENABLED:
+        registry.observe('edvance_db_pool_wait_seconds', (database,), seconds)
+        add_time('pool_wait', seconds)
+
+
+# Sharing between processes
+
+def _merge(totals, data, gauges=True):
+    for name, labels, value in data.get('counters', ()):
+        key = (name, tuple(labels))
+        totals['counters'][key] = totals['counters'].get(key, 0) + value
+    if gauges:
+        for name, labels, value in data.get('gauges', ()):
+            key = (name, tuple(labels))
+            totals['gauges'][key] = totals['gauges'].get(key, 0) + value
+    for name, labels, values in data.get('histograms', ()):
+        key = (name, tuple(labels))
+        current = totals['histograms'].get(key)
+        if current is None:
+            totals['histograms'][key] = list(values)
+        elif len(current) == len(values):
+            totals['histograms'][key] = [a + b for a, b in zip(current, values)]
+
+
+def _empty():
+    return {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+
+def _as_json(totals):
+    return {kind: [[name, list(labels), value] for (name, labels), value in values.items()]
+            for kind, values in totals.items()}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Exporter:
+    """Writes this process's registry to the shared directory and sums everyone's."""
+
+    def __init__(self):
+        self.directory = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def configure(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _write(self, path, data):
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def flush(self):
+        if self.directory is None:
+            return
+        with self._write_lock:
+            self._write(os.path.join(self.directory, f'{os.getpid()}.json'), registry.snapshot())
+
+    def ensure_flusher(self):
+        # One flushing thread per process, started again after a fork
+        if self._pid == os.getpid() or self.directory is None:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Warning: Could not write metrics: {e}", file=sys.stderr)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+    def collect(self):
+        """Totals over every process that has written to the directory."""
+        if self.directory is None:
+            totals = _empty()
+            _merge(totals, registry.snapshot())
+            return totals
+        self.flush()
+        retired_path = os.path.join(self.directory, 'retired.json')
+        with self._locked():
+            retired = _empty()
+            if os.path.exists(retired_path):
+                with open(retired_path, encoding='utf-8') as f:
+                    _merge(retired, json.load(f))
+            totals = _empty()
+            _merge(totals, _as_json(retired))
+            exited = []
+            for entry in os.listdir(self.directory):
+                pid, _, extension = entry.partition('.')
+                if extension != 'json' or not pid.isdigit():
+                    continue
+                path = os.path.join(self.directory, entry)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if int(pid) != os.getpid() and (fcntl is None or not _alive(int(pid))):
+                    # Keep its counts; a gauge of a process that is gone means nothing
+                    _merge(retired, data, gauges=False)
+                    _merge(totals, data, gauges=False)
+                    exited.append(path)
+                else:
+                    _merge(totals, data)
+            if exited:
+                self._write(retired_path, _as_json(retired))
+                for path in exited:
+                    os.remove(path)
+        return totals
+
+
+exporter = Exporter()
+
+
+def flush():
+    exporter.flush()
+
+
+# Prometheus text format
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value == value and value not in (float('inf'), float('-inf')) else str(value)
+    return str(value)
+
+
+def render():
+    totals = exporter.collect()
+    series = {}
+    for kind in ('counters', 'gauges', 'histograms'):
+        for (name, labels), value in totals[kind].items():
+            if name in METRICS:
+                series.setdefault(name, []).append((labels, value))
+    lines = []
+    for name in sorted(series):
+        kind, help_text, label_names, buckets = METRICS[name]
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series[name], key=lambda item: [str(v) for v in item[0]]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_labels(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app, directory):
+    """Instrument `app`; processes sharing `directory` report together.
+
+    Call right after creating the app, before other before_request hooks.
+    """
+    if not ENABLED:
+        return
+    exporter.configure(directory)
+    app.json = TimedJSONProvider(app)
+    app.before_request(_label_route)
+    app.wsgi_app = Middleware(app.wsgi_app)
+    # Don't lose the last FLUSH_SECONDS of a worker that is retiring
+    atexit.register(flush)
+    prefork.worker_exit_hooks.append(flush)
@@ -0,0 +1,718 @@
+"""
+Versioned schema migrations.
+
+Each database keeps its schema version in PRAGMA user_version. migrate()
+applies the pending migrations in order, each in its own transaction, and
+does nothing but read the version when the database is already current.
+
+tests/test_query_plans.py (or `python migrations.py check`) verifies that
+the hot queries are still served from indexes (no full table scans or
+temp B-tree sorts).
+"""
+
+import os
+import sys
+import tempfile
+
+import applicants
+import domains
+import facets
+from db import connect
+
+
+def _facet_triggers(material_type, table):
+    """Triggers keeping study_material_facets in step with one material table."""
+    increment = f'''
+            INSERT INTO study_material_facets (standard, subject, material_type, count)
+            VALUES (new.standard, new.subject, '{material_type}', 1)
+            ON CONFLICT (standard, subject, material_type) DO UPDATE SET count = count + 1;'''
+    decrement = f'''
+            UPDATE study_material_facets SET count = count - 1
+            WHERE standard = old.standard AND subject = old.subject AND material_type = '{material_type}';
+            DELETE FROM study_material_facets
+            WHERE standard = old.standard AND subject = old.subject AND material_type = '{material_type}'
+              AND count <= 0;'''
+    return [
+        f'CREATE TRIGGER {table}_facets_insert AFTER INSERT ON {table} BEGIN{increment}\n        END',
+        f'CREATE TRIGGER {table}_facets_update AFTER UPDATE OF standard, subject ON {table} '
+        f'WHEN old.standard IS NOT new.standard OR old.subject IS NOT new.subject BEGIN{decrement}{increment}\n        END',
+        f'CREATE TRIGGER {table}_facets_delete AFTER DELETE ON {table} BEGIN{decrement}\n        END',
+    ]
+
+
+# Each migration is (version, description, steps). A step is either a SQL
+# statement or a callable taking the connection.
+MAIN_MIGRATIONS = [
+    (1, 'baseline schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS teacher_profile (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            qualification TEXT NOT NULL,
+            teaching_where TEXT NOT NULL,
+            since_when TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS uploaded_notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            standard TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS uploaded_videos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            standard TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            topic TEXT NOT NULL,
+            video_type TEXT NOT NULL,
+            file_path TEXT,
+            video_url TEXT,
+            file_name TEXT,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS sponsor_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            company_name TEXT NOT NULL,
+            gst_number TEXT NOT NULL,
+            annual_turnover REAL NOT NULL,
+            tax_registration_file TEXT,
+            tax_registration_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS scholarships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sponsor_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            amount REAL NOT NULL,
+            currency TEXT DEFAULT 'INR',
+            gender_criteria TEXT,
+            family_income_max REAL,
+            location_type TEXT,
+            min_academic_percentage REAL,
+            application_deadline DATE,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sponsor_id) REFERENCES sponsor_profiles (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS scholarship_applications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scholarship_id INTEGER NOT NULL,
+            student_data TEXT NOT NULL,
+            application_message TEXT,
+            status TEXT DEFAULT 'pending',
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reviewed_at TIMESTAMP,
+            FOREIGN KEY (scholarship_id) REFERENCES scholarships (id)
+        )
+        ''',
+    ]),
+    (2, 'indexes for study materials, scholarships and applications', [
+        # Study materials: browse by standard and subject, newest first. The
+        # full filter path covers every selected column.
+        'CREATE INDEX IF NOT EXISTS idx_notes_standard_subject_uploaded '
+        'ON uploaded_notes (standard, subject, uploaded_at, topic, file_name)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_standard_uploaded ON uploaded_notes (standard, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_subject_uploaded ON uploaded_notes (subject, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_notes_uploaded ON uploaded_notes (uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_videos_standard_subject_uploaded '
+        'ON uploaded_videos (standard, subject, uploaded_at, topic, file_name, video_type)',
+        'CREATE INDEX IF NOT EXISTS idx_videos_standard_uploaded ON uploaded_videos (standard, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_videos_subject_uploaded ON uploaded_videos (subject, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_videos_uploaded ON uploaded_videos (uploaded_at)',
+        # Scholarships: only active rows are ever listed or matched.
+        'CREATE INDEX IF NOT EXISTS idx_scholarships_active_amount ON scholarships (amount) WHERE is_active = 1',
+        'CREATE INDEX IF NOT EXISTS idx_scholarships_active_created ON scholarships (created_at) WHERE is_active = 1',
+        # Applications: newest first, overall and per scholarship.
+        'CREATE INDEX IF NOT EXISTS idx_applications_applied ON scholarship_applications (applied_at)',
+        'CREATE INDEX IF NOT EXISTS idx_applications_scholarship_applied '
+        'ON scholarship_applications (scholarship_id, applied_at)',
+        'CREATE INDEX IF NOT EXISTS idx_sponsor_profiles_updated ON sponsor_profiles (updated_at)',
+    ]),
+    (3, 'keyset order for the covering study-material indexes', [
+        # Paging orders by (uploaded_at, id), so id has to follow uploaded_at
+        # in the key for the index to deliver rows in page order.
+        'DROP INDEX IF EXISTS idx_notes_standard_subject_uploaded',
+        'CREATE INDEX idx_notes_standard_subject_uploaded '
+        'ON uploaded_notes (standard, subject, uploaded_at, id, topic, file_name)',
+        'DROP INDEX IF EXISTS idx_videos_standard_subject_uploaded',
+        'CREATE INDEX idx_videos_standard_subject_uploaded '
+        'ON uploaded_videos (standard, subject, uploaded_at, id, topic, file_name)',
+    ]),
+    (4, 'resumable upload sessions', [
+        '''
+        CREATE TABLE upload_sessions (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            total_size INTEGER NOT NULL,
+            metadata TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE upload_chunks (
+            session_id TEXT NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            byte_count INTEGER NOT NULL,
+            PRIMARY KEY (session_id, byte_offset)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, 'content-addressed blob store', [
+        '''
+        CREATE TABLE blobs (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        'ALTER TABLE uploaded_notes ADD COLUMN blob_digest TEXT',
+        'ALTER TABLE uploaded_videos ADD COLUMN blob_digest TEXT',
+        'ALTER TABLE sponsor_profiles ADD COLUMN tax_registration_digest TEXT',
+    ]),
+    (6, 'media ingestion jobs and video metadata', [
+        '''
+        CREATE TABLE media_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            video_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX idx_media_jobs_status ON media_jobs (status, started_at)',
+        # Videos uploaded before ingestion existed are served as they are
+        "ALTER TABLE uploaded_videos ADD COLUMN processing_status TEXT DEFAULT 'ready'",
+        'ALTER TABLE uploaded_videos ADD COLUMN duration_seconds REAL',
+        'ALTER TABLE uploaded_videos ADD COLUMN width INTEGER',
+        'ALTER TABLE uploaded_videos ADD COLUMN height INTEGER',
+        'ALTER TABLE uploaded_videos ADD COLUMN bitrate INTEGER',
+        'ALTER TABLE uploaded_videos ADD COLUMN size_bytes INTEGER',
+    ]),
+    (7, 'full-text search index', [
+        # Notes are indexed at rowid id * 2 and videos at id * 2 + 1
+        '''
+        CREATE VIRTUAL TABLE search_index USING fts5 (
+            topic, subject, standard, file_name, body,
+            material_type UNINDEXED, material_id UNINDEXED, uploaded_at UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        ''',
+        # Column weights for bm25(): topic, subject, standard, file_name, body
+        "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 4.0, 4.0, 2.0, 1.0)')",
+        '''
+        CREATE TRIGGER uploaded_notes_search_insert AFTER INSERT ON uploaded_notes BEGIN
+            INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                      material_type, material_id, uploaded_at)
+            VALUES (new.id * 2, new.topic, new.subject, new.standard, new.file_name, '',
+                    'notes', new.id, new.uploaded_at);
+        END
+        ''',
+        '''
+        CREATE TRIGGER uploaded_notes_search_update
+        AFTER UPDATE OF topic, subject, standard, file_name ON uploaded_notes BEGIN
+            UPDATE search_index SET topic = new.topic, subject = new.subject, standard = new.standard,
+                                    file_name = new.file_name
+            WHERE rowid = new.id * 2;
+        END
+        ''',
+        '''
+        CREATE TRIGGER uploaded_notes_search_delete AFTER DELETE ON uploaded_notes BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 2;
+        END
+        ''',
+        '''
+        CREATE TRIGGER uploaded_videos_search_insert AFTER INSERT ON uploaded_videos BEGIN
+            INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                      material_type, material_id, uploaded_at)
+            VALUES (new.id * 2 + 1, new.topic, new.subject, new.standard, new.file_name, '',
+                    'videos', new.id, new.uploaded_at);
+        END
+        ''',
+        '''
+        CREATE TRIGGER uploaded_videos_search_update
+        AFTER UPDATE OF topic, subject, standard, file_name ON uploaded_videos BEGIN
+            UPDATE search_index SET topic = new.topic, subject = new.subject, standard = new.standard,
+                                    file_name = new.file_name
+            WHERE rowid = new.id * 2 + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER uploaded_videos_search_delete AFTER DELETE ON uploaded_videos BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+        END
+        ''',
+        '''
+        INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                  material_type, material_id, uploaded_at)
+        SELECT id * 2, topic, subject, standard, file_name, '', 'notes', id, uploaded_at FROM uploaded_notes
+        ''',
+        '''
+        INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                  material_type, material_id, uploaded_at)
+        SELECT id * 2 + 1, topic, subject, standard, file_name, '', 'videos', id, uploaded_at FROM uploaded_videos
+        ''',
+        # media_jobs now carries PDF text extraction for notes as well
+        'ALTER TABLE media_jobs RENAME COLUMN video_id TO item_id',
+        "ALTER TABLE media_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'video'",
+        "INSERT INTO media_jobs (kind, item_id) SELECT 'note', id FROM uploaded_notes",
+    ]),
+    (8, 'scholarship change log', [
+        # Lets in-memory copies of the scholarships catch up on just the rows
+        # that changed. Only the most recent 10000 changes are kept.
+        '''
+        CREATE TABLE scholarship_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            scholarship_id INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER scholarship_changes_prune AFTER INSERT ON scholarship_changes BEGIN
+            DELETE FROM scholarship_changes WHERE seq <= new.seq - 10000;
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_insert AFTER INSERT ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (new.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_update AFTER UPDATE ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (new.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_delete AFTER DELETE ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (old.id);
+        END
+        ''',
+        # Scholarship listings carry the sponsor's name and company
+        '''
+        CREATE TRIGGER sponsor_profiles_log_update AFTER UPDATE OF name, company_name ON sponsor_profiles BEGIN
+            INSERT INTO scholarship_changes (scholarship_id)
+            SELECT id FROM scholarships WHERE sponsor_id = new.id;
+        END
+        ''',
+    ]),
+    (9, 'indexed applicant attributes', [
+        'ALTER TABLE scholarship_applications ADD COLUMN applicant_gender TEXT',
+        'ALTER TABLE scholarship_applications ADD COLUMN applicant_family_income REAL',
+        'ALTER TABLE scholarship_applications ADD COLUMN applicant_academic_percentage REAL',
+        'ALTER TABLE scholarship_applications ADD COLUMN applicant_location_type TEXT',
+        applicants.backfill,
+        # Sponsors rank applicants by marks or income, optionally narrowed
+        # to a gender and location first.
+        'CREATE INDEX idx_applications_percentage ON scholarship_applications (applicant_academic_percentage)',
+        'CREATE INDEX idx_applications_income ON scholarship_applications (applicant_family_income)',
+        'CREATE INDEX idx_applications_gender_location_percentage '
+        'ON scholarship_applications (applicant_gender, applicant_location_type, applicant_academic_percentage)',
+    ]),
+    (10, 'per-scholarship application status counts', [
+        '''
+        CREATE TABLE application_status_counts (
+            scholarship_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scholarship_id, status)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT INTO application_status_counts (scholarship_id, status, count)
+        SELECT scholarship_id, ifnull(status, ''), COUNT(*) FROM scholarship_applications
+        GROUP BY scholarship_id, ifnull(status, '')
+        ''',
+        '''
+        CREATE TRIGGER application_counts_insert AFTER INSERT ON scholarship_applications BEGIN
+            INSERT INTO application_status_counts (scholarship_id, status, count)
+            VALUES (new.scholarship_id, ifnull(new.status, ''), 1)
+            ON CONFLICT (scholarship_id, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER application_counts_update AFTER UPDATE OF status, scholarship_id ON scholarship_applications
+        WHEN old.status IS NOT new.status OR old.scholarship_id IS NOT new.scholarship_id BEGIN
+            UPDATE application_status_counts SET count = count - 1
+            WHERE scholarship_id = old.scholarship_id AND status = ifnull(old.status, '');
+            INSERT INTO application_status_counts (scholarship_id, status, count)
+            VALUES (new.scholarship_id, ifnull(new.status, ''), 1)
+            ON CONFLICT (scholarship_id, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER application_counts_delete AFTER DELETE ON scholarship_applications BEGIN
+            UPDATE application_status_counts SET count = count - 1
+            WHERE scholarship_id = old.scholarship_id AND status = ifnull(old.status, '');
+        END
+        ''',
+        # Paging one status tab, overall and per scholarship
+        'CREATE INDEX idx_applications_status_applied ON scholarship_applications (status, applied_at)',
+        'CREATE INDEX idx_applications_scholarship_status_applied '
+        'ON scholarship_applications (scholarship_id, status, applied_at)',
+    ]),
+    (11, 'study material facet counts', [
+        '''
+        CREATE TABLE study_material_facets (
+            standard TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            material_type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (standard, subject, material_type)
+        ) WITHOUT ROWID
+        ''',
+        facets.rebuild,
+        *_facet_triggers('notes', 'uploaded_notes'),
+        *_facet_triggers('videos', 'uploaded_videos'),
+    ]),
+    (12, 'sponsorship and applications moved to their own databases', [
+        domains.move_tables,
+    ]),
+]
+
+# Sponsor profiles and scholarships; schema as of main migration 11
+SPONSORSHIP_MIGRATIONS = [
+    (1, 'sponsorship schema', [
+        '''
+        CREATE TABLE sponsor_profiles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            company_name TEXT NOT NULL,
+            gst_number TEXT NOT NULL,
+            annual_turnover REAL NOT NULL,
+            tax_registration_file TEXT,
+            tax_registration_path TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tax_registration_digest TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE scholarships (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sponsor_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            amount REAL NOT NULL,
+            currency TEXT DEFAULT 'INR',
+            gender_criteria TEXT,
+            family_income_max REAL,
+            location_type TEXT,
+            min_academic_percentage REAL,
+            application_deadline DATE,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sponsor_id) REFERENCES sponsor_profiles (id)
+        )
+        ''',
+        'CREATE INDEX idx_scholarships_active_amount ON scholarships (amount) WHERE is_active = 1',
+        'CREATE INDEX idx_scholarships_active_created ON scholarships (created_at) WHERE is_active = 1',
+        'CREATE INDEX idx_sponsor_profiles_updated ON sponsor_profiles (updated_at)',
+        '''
+        CREATE TABLE scholarship_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            scholarship_id INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TRIGGER scholarship_changes_prune AFTER INSERT ON scholarship_changes BEGIN
+            DELETE FROM scholarship_changes WHERE seq <= new.seq - 10000;
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_insert AFTER INSERT ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (new.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_update AFTER UPDATE ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (new.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER scholarships_log_delete AFTER DELETE ON scholarships BEGIN
+            INSERT INTO scholarship_changes (scholarship_id) VALUES (old.id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER sponsor_profiles_log_update AFTER UPDATE OF name, company_name ON sponsor_profiles BEGIN
+            INSERT INTO scholarship_changes (scholarship_id)
+            SELECT id FROM scholarships WHERE sponsor_id = new.id;
+        END
+        ''',
+    ]),
+    (2, 'expiry index for active scholarships', [
+        'CREATE INDEX idx_scholarships_active_deadline ON scholarships (application_deadline) WHERE is_active = 1',
+    ]),
+]
+
+# Scholarship applications; schema as of main migration 11. Scholarships
+# are in another file, so scholarship_id can't be a foreign key.
+APPLICATION_MIGRATIONS = [
+    (1, 'applications schema', [
+        '''
+        CREATE TABLE scholarship_applications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scholarship_id INTEGER NOT NULL,
+            student_data TEXT NOT NULL,
+            application_message TEXT,
+            status TEXT DEFAULT 'pending',
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            reviewed_at TIMESTAMP,
+            applicant_gender TEXT,
+            applicant_family_income REAL,
+            applicant_academic_percentage REAL,
+            applicant_location_type TEXT
+        )
+        ''',
+        'CREATE INDEX idx_applications_applied ON scholarship_applications (applied_at)',
+        'CREATE INDEX idx_applications_scholarship_applied ON scholarship_applications (scholarship_id, applied_at)',
+        'CREATE INDEX idx_applications_percentage ON scholarship_applications (applicant_academic_percentage)',
+        'CREATE INDEX idx_applications_income ON scholarship_applications (applicant_family_income)',
+        'CREATE INDEX idx_applications_gender_location_percentage '
+        'ON scholarship_applications (applicant_gender, applicant_location_type, applicant_academic_percentage)',
+        'CREATE INDEX idx_applications_status_applied ON scholarship_applications (status, applied_at)',
+        'CREATE INDEX idx_applications_scholarship_status_applied '
+        'ON scholarship_applications (scholarship_id, status, applied_at)',
+        '''
+        CREATE TABLE application_status_counts (
+            scholarship_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scholarship_id, status)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER application_counts_insert AFTER INSERT ON scholarship_applications BEGIN
+            INSERT INTO application_status_counts (scholarship_id, status, count)
+            VALUES (new.scholarship_id, ifnull(new.status, ''), 1)
+            ON CONFLICT (scholarship_id, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER application_counts_update AFTER UPDATE OF status, scholarship_id ON scholarship_applications
+        WHEN old.status IS NOT new.status OR old.scholarship_id IS NOT new.scholarship_id BEGIN
+            UPDATE application_status_counts SET count = count - 1
+            WHERE scholarship_id = old.scholarship_id AND status = ifnull(old.status, '');
+            INSERT INTO application_status_counts (scholarship_id, status, count)
+            VALUES (new.scholarship_id, ifnull(new.status, ''), 1)
+            ON CONFLICT (scholarship_id, status) DO UPDATE SET count = count + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER application_counts_delete AFTER DELETE ON scholarship_applications BEGIN
+            UPDATE application_status_counts SET count = count - 1
+            WHERE scholarship_id = old.scholarship_id AND status = ifnull(old.status, '');
+        END
+        ''',
+    ]),
+    (2, 'applicant attributes from the profile form fields', [
+        applicants.backfill,
+    ]),
+]
+
+STUDENT_MIGRATIONS = [
+    (1, 'baseline schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS student_profile (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            personal_data TEXT NOT NULL,
+            academic_data TEXT NOT NULL,
+            residential_data TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+]
+
+# Hot queries as issued by the routes, with the index each must use, by
+# the database they run against
+QUERY_PLAN_EXPECTATIONS = {'main': [
+    # One side of the /api/study-materials page merge, per filter combination
+    ('study notes page by standard and subject',
+     "SELECT id, standard, subject, topic, file_name, uploaded_at, 'notes' AS type FROM uploaded_notes "
+     'WHERE standard = ? AND subject = ? AND (uploaded_at < ? OR (uploaded_at = ? AND id < ?)) '
+     'ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+     ('Class 10', 'Physics', '2025-01-01', '2025-01-01', 10, 51), 'idx_notes_standard_subject_uploaded'),
+    ('study videos page by standard and subject',
+     "SELECT id, standard, subject, topic, file_name, uploaded_at, 'videos' AS type FROM uploaded_videos "
+     'WHERE standard = ? AND subject = ? AND uploaded_at <= ? '
+     'ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+     ('Class 10', 'Physics', '2025-01-01', 51), 'idx_videos_standard_subject_uploaded'),
+    ('study notes page by standard',
+     "SELECT id, standard, subject, topic, file_name, uploaded_at, 'notes' AS type FROM uploaded_notes "
+     'WHERE standard = ? ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+     ('Class 10', 51), 'idx_notes_standard_uploaded'),
+    ('study videos page by subject',
+     "SELECT id, standard, subject, topic, file_name, uploaded_at, 'videos' AS type FROM uploaded_videos "
+     'WHERE subject = ? ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+     ('Physics', 51), 'idx_videos_subject_uploaded'),
+    ('study notes page unfiltered',
+     "SELECT id, standard, subject, topic, file_name, uploaded_at, 'notes' AS type FROM uploaded_notes "
+     'WHERE uploaded_at < ? ORDER BY uploaded_at DESC, id DESC LIMIT ?',
+     ('2025-01-01', 51), 'idx_notes_uploaded'),
+    ('notes list',
+     'SELECT id, standard, subject, topic, file_name, uploaded_at FROM uploaded_notes ORDER BY uploaded_at DESC',
+     (), 'idx_notes_uploaded'),
+], 'sponsorship': [
+    ('active scholarships',
+     'SELECT s.*, sp.name, sp.company_name FROM scholarships s '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE s.is_active = 1 ORDER BY s.created_at DESC',
+     (), 'idx_scholarships_active_created'),
+    ('eligible scholarships',
+     'SELECT s.*, sp.name, sp.company_name FROM scholarships s '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE s.is_active = 1 '
+     'AND (s.family_income_max IS NULL OR s.family_income_max >= ?) '
+     'AND (s.min_academic_percentage IS NULL OR s.min_academic_percentage <= ?) '
+     'ORDER BY s.amount DESC',
+     (250000, 90), 'idx_scholarships_active_amount'),
+    ('expired scholarships',
+     'SELECT id FROM scholarships WHERE is_active = 1 '
+     "AND application_deadline > '' AND application_deadline < ? LIMIT ?",
+     ('2025-01-01', 500), 'idx_scholarships_active_deadline'),
+], 'applications': [
+    # Run with the sponsorship database attached, as the routes do
+    ('scholarship applications',
+     'SELECT sa.*, s.title, s.amount, s.currency, sp.name, sp.company_name '
+     'FROM scholarship_applications sa '
+     'JOIN scholarships s ON sa.scholarship_id = s.id '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'ORDER BY sa.applied_at DESC',
+     (), 'idx_applications_applied'),
+    ('applications by academic percentage',
+     'SELECT sa.id, sa.status, sa.applicant_academic_percentage FROM scholarship_applications sa '
+     'JOIN scholarships s ON sa.scholarship_id = s.id '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE sa.applicant_academic_percentage >= ? '
+     'ORDER BY sa.applicant_academic_percentage DESC, sa.id DESC LIMIT ?',
+     (80, 50), 'idx_applications_percentage'),
+    ('applications by gender and location',
+     'SELECT sa.id, sa.status, sa.applicant_academic_percentage FROM scholarship_applications sa '
+     'JOIN scholarships s ON sa.scholarship_id = s.id '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE sa.applicant_gender = ? AND sa.applicant_location_type = ? '
+     'ORDER BY sa.applicant_academic_percentage DESC, sa.id DESC LIMIT ?',
+     ('Female', 'Rural', 50), 'idx_applications_gender_location_percentage'),
+    ('applications page by scholarship and status',
+     'SELECT sa.id, sa.status, sa.applied_at FROM scholarship_applications sa '
+     'JOIN scholarships s ON sa.scholarship_id = s.id '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE sa.scholarship_id = ? AND sa.status = ? '
+     'AND (sa.applied_at < ? OR (sa.applied_at = ? AND sa.id < ?)) '
+     'ORDER BY sa.applied_at DESC, sa.id DESC LIMIT ?',
+     (1, 'pending', '2025-01-01', '2025-01-01', 10, 51), 'idx_applications_scholarship_status_applied'),
+    ('applications page by status',
+     'SELECT sa.id, sa.status, sa.applied_at FROM scholarship_applications sa '
+     'JOIN scholarships s ON sa.scholarship_id = s.id '
+     'JOIN sponsor_profiles sp ON s.sponsor_id = sp.id '
+     'WHERE sa.status = ? ORDER BY sa.applied_at DESC, sa.id DESC LIMIT ?',
+     ('pending', 51), 'idx_applications_status_applied'),
+    ('application counts for a scholarship',
+     'SELECT status, count FROM application_status_counts WHERE scholarship_id = ?',
+     (1,), 'PRIMARY KEY'),
+]}
+
+
+def schema_version(conn, schema='main'):
+    return conn.execute(f'PRAGMA {schema}.user_version').fetchone()[0]
+
+
+def migrate(path, migrations):
+    """Apply any migrations newer than the database's user_version."""
+    target = migrations[-1][0]
+    conn = connect(path)
+    try:
+        if schema_version(conn) >= target:
+            return
+        conn.isolation_level = None
+        for version, _description, steps in migrations:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Another process may have migrated while we waited for the lock
+                if schema_version(conn) >= version:
+                    conn.execute('COMMIT')
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.close()
+
+
+def query_plan_problems(conn, expectations):
+    """Return a list of hot queries whose plan scans a table or sorts in a temp B-tree."""
+    problems = []
+    for name, sql, params, index in expectations:
+        details = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        plan = '; '.join(details)
+        if index not in plan:
+            problems.append(f'{name}: expected {index}, got: {plan}')
+        elif 'TEMP B-TREE' in plan:
+            problems.append(f'{name}: sorts in a temp B-tree: {plan}')
+        elif any(d.startswith('SCAN') and 'INDEX' not in d for d in details):
+            problems.append(f'{name}: full table scan: {plan}')
+    return problems
+
+
+def scratch_databases(directory):
+    """Migrate empty databases in `directory`; returns {schema: (path, attached)} for QUERY_PLAN_EXPECTATIONS."""
+    database = os.path.join(directory, 'main.db')
+    migrate(database, MAIN_MIGRATIONS)
+    # The main migrations create the other two files
+    sponsorship, applications = domains.paths(database)
+    return {'main': (database, None), 'sponsorship': (sponsorship, None),
+            'applications': (applications, {'sponsorship': sponsorship})}
+
+
+def check_query_plans():
+    """Migrate scratch databases and assert every hot query uses its index.
+
+    tests/test_query_plans.py runs the same checks under pytest.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        problems = []
+        for schema, (path, attached) in scratch_databases(directory).items():
+            conn = connect(path, attached)
+            problems += query_plan_problems(conn, QUERY_PLAN_EXPECTATIONS[schema])
+            conn.close()
+    assert not problems, '\n'.join(problems)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['check']:
+        check_query_plans()
+        print(f'{sum(map(len, QUERY_PLAN_EXPECTATIONS.values()))} query plans OK')
+    else:
+        print('usage: python migrations.py check')
+        sys.exit(2)
@@ -0,0 +1,199 @@
+"""
+Minimal MP4/MOV (ISO base media) box parser.
+
+probe() reads duration and resolution from the moov box, and faststart()
+rewrites a file so that moov comes before the media data, which lets a
+browser start playback without first fetching the end of the file.
+"""
+
+import struct
+
+# Boxes whose payload is just more boxes, on the path to the sample tables
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class MP4Error(ValueError):
+    pass
+
+
+def iter_boxes(f, start, end):
+    """Yield (type, offset, size, header_size) for boxes between `start` and `end`."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f'corrupt {box_type!r} box at offset {offset}')
+        yield box_type, offset, size, header_size
+        offset += size
+
+
+def iter_buffer_boxes(buf, start, end):
+    """Like iter_boxes() but over an in-memory buffer."""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f'corrupt {box_type!r} box inside moov')
+        yield box_type, offset, size, header_size
+        offset += size
+
+
+def top_level_boxes(f):
+    f.seek(0, 2)
+    file_size = f.tell()
+    return list(iter_boxes(f, 0, file_size)), file_size
+
+
+def _walk(buf, start, end, path=()):
+    for box_type, offset, size, header_size in iter_buffer_boxes(buf, start, end):
+        yield path + (box_type,), offset, size, header_size
+        if box_type in CONTAINER_BOXES:
+            yield from _walk(buf, offset + header_size, offset + size, path + (box_type,))
+
+
+def _read_moov(f, boxes):
+    for box_type, offset, size, header_size in boxes:
+        if box_type == b'moov':
+            f.seek(offset)
+            return bytearray(f.read(size)), offset
+    raise MP4Error('no moov box')
+
+
+def probe(path):
+    """Return a dict with duration_seconds, width, height, bitrate, size_bytes and faststart."""
+    with open(path, 'rb') as f:
+        boxes, file_size = top_level_boxes(f)
+        moov, moov_offset = _read_moov(f, boxes)
+
+    info = {'duration_seconds': None, 'width': None, 'height': None,
+            'bitrate': None, 'size_bytes': file_size}
+    mdat_offsets = [offset for box_type, offset, _size, _hs in boxes if box_type == b'mdat']
+    info['faststart'] = not mdat_offsets or moov_offset < mdat_offsets[0]
+
+    track_dims = None
+    for path_, offset, size, header_size in _walk(moov, 0, len(moov)):
+        body = offset + header_size
+        if path_ == (b'moov', b'mvhd'):
+            version = moov[body]
+            if version == 1:
+                timescale, duration = struct.unpack_from('>IQ', moov, body + 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', moov, body + 12)
+            if timescale:
+                info['duration_seconds'] = round(duration / timescale, 3)
+        elif path_[-1] == b'tkhd':
+            # Width and height are 16.16 fixed point at the end of the box
+            width, height = struct.unpack_from('>II', moov, offset + size - 8)
+            track_dims = (width >> 16, height >> 16)
+        elif path_[-1] == b'hdlr' and track_dims:
+            handler = bytes(moov[body + 8:body + 12])
+            if handler == b'vide' and info['width'] is None and track_dims[0]:
+                info['width'], info['height'] = track_dims
+
+    if info['duration_seconds']:
+        info['bitrate'] = int(file_size * 8 / info['duration_seconds'])
+    return info
+
+
+def _chunk_offset_tables(moov):
+    return [(path_[-1], offset, header_size) for path_, offset, _size, header_size in _walk(moov, 0, len(moov))
+            if path_[-1] in (b'stco', b'co64')]
+
+
+def _set_box_size(buf, offset, header_size, size):
+    if header_size == 16:
+        struct.pack_into('>Q', buf, offset + 8, size)
+    else:
+        struct.pack_into('>I', buf, offset, size)
+
+
+def _upgrade_stco(moov):
+    """Rewrite every stco table as co64, fixing up the sizes of enclosing boxes."""
+    while True:
+        tables = [t for t in _chunk_offset_tables(moov) if t[0] == b'stco']
+        if not tables:
+            return moov
+        _box_type, offset, header_size = tables[0]
+        body = offset + header_size
+        count = struct.unpack_from('>I', moov, body + 4)[0]
+        entries = struct.unpack_from(f'>{count}I', moov, body + 8)
+        new_box = bytearray(struct.pack('>I4s', 16 + 8 * count, b'co64'))
+        new_box += moov[body:body + 8]
+        new_box += struct.pack(f'>{count}Q', *entries)
+        old_size = struct.unpack_from('>I', moov, offset)[0]
+        growth = len(new_box) - old_size
+        # Every box that encloses this one grows by the same amount
+        for path_, parent_offset, parent_size, parent_header_size in _walk(moov, 0, len(moov)):
+            if parent_offset < offset < parent_offset + parent_size and path_[-1] in CONTAINER_BOXES:
+                _set_box_size(moov, parent_offset, parent_header_size, parent_size + growth)
+        moov = moov[:offset] + new_box + moov[offset + old_size:]
+
+
+def _shift_chunk_offsets(moov, delta, low, high):
+    """Add `delta` to chunk offsets that point into [low, high)."""
+    for box_type, offset, header_size in _chunk_offset_tables(moov):
+        body = offset + header_size
+        count = struct.unpack_from('>I', moov, body + 4)[0]
+        fmt = f'>{count}I' if box_type == b'stco' else f'>{count}Q'
+        entries = struct.unpack_from(fmt, moov, body + 8)
+        shifted = [e + delta if low <= e < high else e for e in entries]
+        struct.pack_into(fmt, moov, body + 8, *shifted)
+
+
+def _copy_range(src, dst, start, end):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src.read(min(COPY_BUFFER_SIZE, remaining))
+        if not block:
+            raise MP4Error('unexpected end of file')
+        dst.write(block)
+        remaining -= len(block)
+
+
+def faststart(src_path, dst_path):
+    """Write a copy of `src_path` with moov ahead of mdat.
+
+    Returns False (and writes nothing) when the file is already fast-start.
+    """
+    with open(src_path, 'rb') as src:
+        boxes, file_size = top_level_boxes(src)
+        moov, moov_offset = _read_moov(src, boxes)
+        mdat_offsets = [offset for box_type, offset, _size, _hs in boxes if box_type == b'mdat']
+        if not mdat_offsets or moov_offset < mdat_offsets[0]:
+            return False
+        if any(path_[-1] == b'cmov' for path_, _o, _s, _h in _walk(moov, 0, len(moov))):
+            raise MP4Error('compressed moov boxes are not supported')
+
+        moov_end = moov_offset + len(moov)
+        insert_at = mdat_offsets[0]
+        # Everything between the insertion point and the old moov moves down
+        # by the size of moov; past 4 GiB that needs 64-bit chunk offsets.
+        if file_size + len(moov) > 0xFFFFFFFF:
+            moov = _upgrade_stco(moov)
+        _shift_chunk_offsets(moov, len(moov), insert_at, moov_offset)
+
+        with open(dst_path, 'wb') as dst:
+            _copy_range(src, dst, 0, insert_at)
+            dst.write(moov)
+            _copy_range(src, dst, insert_at, moov_offset)
+            _copy_range(src, dst, moov_end, file_size)
+    return True
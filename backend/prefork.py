@@ -0,0 +1,365 @@
+"""
+Pre-forking production server for Linux and other Unix systems.
+
+The master process imports the app once, so schema migrations and other
+import-time work are done before any worker exists, then forks `workers`
+processes that each answer up to `threads` requests at a time. Workers
+accept from the master's listening socket, or with reuse_port each bind
+their own SO_REUSEPORT socket and the kernel spreads connections evenly.
+
+A worker retires after `max_requests` requests (plus up to 10% jitter, so
+workers don't all restart together) or once its resident memory passes
+`max_memory_mb`. It stops accepting, finishes the requests it already
+has, and the master starts a replacement.
+
+Signals to the master:
+
+    TERM, INT   stop accepting, let in-flight requests finish for up to
+                `graceful_timeout` seconds, then exit
+    HUP         re-execute the master with the code now on disk, start new
+                workers and retire the old ones once the new ones are
+                ready; the listening socket stays open throughout
+"""
+
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    import resource
+except ImportError:
+    # Windows; run_server.py only uses the defaults below there
+    resource = None
+
+# Called in a worker once it has finished its last request, before it exits
+worker_exit_hooks = []
+
+WORKERS = int(os.environ.get('EDVANCE_WORKERS', str(os.cpu_count() or 2)))
+THREADS = int(os.environ.get('EDVANCE_THREADS', '8'))
+MAX_REQUESTS = int(os.environ.get('EDVANCE_MAX_REQUESTS', '10000'))
+MAX_MEMORY_MB = int(os.environ.get('EDVANCE_MAX_WORKER_MEMORY_MB', '512'))
+# Long enough for a large single-request upload on a slow link to finish
+GRACEFUL_TIMEOUT = float(os.environ.get('EDVANCE_GRACEFUL_TIMEOUT', '120'))
+# Longest wait for the next bytes of a request before dropping the connection
+REQUEST_TIMEOUT = float(os.environ.get('EDVANCE_REQUEST_TIMEOUT', '60'))
+BACKLOG = 1024
+READY_TIMEOUT = 30
+# Workers that die sooner than this after starting are restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+
+# Passed across the exec of a reload
+LISTEN_FD_ENV = 'EDVANCE_LISTEN_FD'
+OLD_WORKERS_ENV = 'EDVANCE_OLD_WORKERS'
+
+
+def log(message):
+    print(f'[{os.getpid()}] {message}', file=sys.stderr, flush=True)
+
+
+def resident_memory_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        if resource is None:
+            return 0
+        # Peak rather than current size, but never smaller
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bind_socket(host, port, reuse_port=False):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    # Every worker is woken for each connection; the ones that lose the
+    # race must get EAGAIN from accept() rather than block in it.
+    sock.setblocking(False)
+    return sock
+
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection, so an idle keep-alive client never holds
+    # a thread; put nginx in front for client keep-alive.
+    protocol_version = 'HTTP/1.0'
+    timeout = REQUEST_TIMEOUT
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Werkzeug server answering up to `threads` requests concurrently."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd, on_request=None):
+        self.on_request = on_request
+        self._slots = threading.Semaphore(threads)
+        self._idle = threading.Condition()
+        self._active = 0
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+
+    def get_request(self):
+        # With every thread busy, leave the connection in the backlog for
+        # another worker. OSError makes serve_forever() carry on polling.
+        if not self._slots.acquire(timeout=0.5):
+            raise OSError('no idle request thread')
+        try:
+            return super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._active += 1
+        threading.Thread(target=self._handle, args=(request, client_address), daemon=True).start()
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._idle:
+                self._active -= 1
+                self._idle.notify_all()
+            self._slots.release()
+            if self.on_request is not None:
+                self.on_request()
+
+    def drain(self, timeout):
+        """Wait for in-flight requests; returns False if some are still running."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._active == 0, timeout)
+
+
+def run_worker(app, options, listener, ready_fd):
+    """Serve requests until told to stop or a recycling limit is hit."""
+    signal.set_wakeup_fd(-1)
+    for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    # A terminal hangup is for the master to act on
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if options['reuse_port']:
+        listener = bind_socket(options['host'], options['port'], reuse_port=True)
+    stopping = threading.Event()
+    counter_lock = threading.Lock()
+    handled = 0
+    max_requests = options['max_requests']
+    if max_requests:
+        max_requests += random.randint(0, max_requests // 10)
+
+    def stop(reason):
+        if not stopping.is_set():
+            stopping.set()
+            log(f'worker stopping: {reason}')
+            # shutdown() waits for serve_forever() to return, so not from its thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    def on_request():
+        nonlocal handled
+        with counter_lock:
+            handled += 1
+        if max_requests and handled >= max_requests:
+            stop(f'served {handled} requests')
+        elif options['max_memory_mb'] and resident_memory_mb() > options['max_memory_mb']:
+            stop(f'resident memory above {options["max_memory_mb"]} MB')
+
+    server = PooledWSGIServer(options['host'], options['port'], app, options['threads'],
+                              fd=listener.fileno(), on_request=on_request)
+    listener.close()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop('SIGTERM'))
+    signal.signal(signal.SIGINT, lambda signum, frame: stop('SIGINT'))
+    os.write(ready_fd, b'.')
+    os.close(ready_fd)
+
+    server.serve_forever()
+    if not server.drain(options['graceful_timeout']):
+        log('worker exiting with requests still running')
+    for hook in worker_exit_hooks:
+        try:
+            hook()
+        except Exception:
+            traceback.print_exc()
+    return 0
+
+
+class Master:
+    def __init__(self, app, options, listener):
+        self.app = app
+        self.options = options
+        self.listener = listener
+        self.workers = {}
+        self.retiring = set()
+        self.pending = []
+        self.stopping = False
+        self.next_spawn = 0.0
+
+    def _on_signal(self, signum, frame):
+        self.pending.append(signum)
+
+    def spawn(self):
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 1
+            try:
+                code = run_worker(self.app, self.options, self.listener, ready_write)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(ready_write)
+        self.workers[pid] = (ready_read, time.monotonic())
+        return pid
+
+    def wait_ready(self, pids):
+        """Wait until the new workers `pids` accept requests; return how many do."""
+        waiting = {self.workers[pid][0]: pid for pid in pids}
+        ready = 0
+        deadline = time.monotonic() + READY_TIMEOUT
+        while waiting and time.monotonic() < deadline:
+            readable, _, _ = select.select(list(waiting), [], [], deadline - time.monotonic())
+            for fd in readable:
+                del waiting[fd]
+                if os.read(fd, 1):
+                    ready += 1
+        return ready
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                ready_read, started = self.workers.pop(pid)
+                os.close(ready_read)
+                if os.waitstatus_to_exitcode(status) != 0 and not self.stopping:
+                    log(f'worker {pid} exited with status {os.waitstatus_to_exitcode(status)}')
+                if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                    self.next_spawn = time.monotonic() + MIN_WORKER_LIFETIME
+            self.retiring.discard(pid)
+
+    def reload(self):
+        log('reloading')
+        env = dict(os.environ)
+        env[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in list(self.workers) + list(self.retiring))
+        if self.listener is not None:
+            self.listener.set_inheritable(True)
+            env[LISTEN_FD_ENV] = str(self.listener.fileno())
+        sys.stderr.flush()
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+    def stop(self):
+        self.stopping = True
+        log('stopping; waiting for in-flight requests')
+        for pid in list(self.workers) + list(self.retiring):
+            self._kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.options['graceful_timeout'] + 5
+        while (self.workers or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers) + list(self.retiring):
+            self._kill(pid, signal.SIGKILL)
+        self.reap()
+
+    @staticmethod
+    def _kill(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def run(self, old_workers=()):
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._on_signal)
+
+        self.retiring = set(old_workers)
+        if self.app is None:
+            log('app failed to load; old workers keep serving until the next SIGHUP')
+        else:
+            new = [self.spawn() for _ in range(self.options['workers'])]
+            ready = self.wait_ready(new)
+            if self.retiring:
+                if ready:
+                    for pid in self.retiring:
+                        self._kill(pid, signal.SIGTERM)
+                else:
+                    log('no new worker became ready; keeping the old workers')
+            log(f'{ready} of {len(new)} workers serving on {self.options["host"]}:{self.options["port"]}')
+
+        while True:
+            select.select([wakeup_read], [], [], 1.0)
+            try:
+                while os.read(wakeup_read, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            self.reap()
+            while self.pending:
+                signum = self.pending.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT):
+                    self.stop()
+                    return
+                if signum == signal.SIGHUP:
+                    self.reload()
+            if self.app is not None:
+                while len(self.workers) < self.options['workers'] and time.monotonic() >= self.next_spawn:
+                    self.spawn()
+
+
+def serve(load_app, host='127.0.0.1', port=5001, workers=WORKERS, threads=THREADS,
+          max_requests=MAX_REQUESTS, max_memory_mb=MAX_MEMORY_MB,
+          graceful_timeout=GRACEFUL_TIMEOUT, reuse_port=False):
+    """Run the master process until it is stopped; `load_app` imports and returns the app."""
+    old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+
+    listener = None
+    if listen_fd is not None:
+        listener = socket.socket(fileno=int(listen_fd))
+        listener.set_inheritable(False)
+    elif not reuse_port:
+        listener = bind_socket(host, port)
+
+    try:
+        app = load_app()
+    except Exception:
+        if not old_workers:
+            raise
+        traceback.print_exc()
+        app = None
+
+    options = {
+        'host': host,
+        'port': port,
+        'workers': max(1, workers),
+        'threads': max(1, threads),
+        'max_requests': max_requests,
+        'max_memory_mb': max_memory_mb,
+        'graceful_timeout': graceful_timeout,
+        'reuse_port': reuse_port,
+    }
+    Master(app, options, listener).run(old_workers)
@@ -0,0 +1,278 @@
+"""
+On-demand profiling of live requests.
+
+A request is profiled when an admin asks for it with an `X-Profile` header
+or a `_profile` query argument (`cprofile` or `sample`), or when it is
+picked by the sampling rate set through PUT /api/admin/profiling, which
+can be limited to some endpoints (view function names such as
+get_study_materials). The settings are kept in the profiles directory, so
+every worker process follows them.
+
+`cprofile` runs the request under cProfile and saves a .pstats file, for
+`python -m pstats` or snakeviz. `sample` has a background thread look at
+the request's stack every INTERVAL_MS and saves the stacks it saw as a
+.collapsed file, one `frame;frame;frame count` line per stack, ready for
+flamegraph.pl or speedscope. The sampler costs the request next to nothing,
+so it is the one to leave on at a low rate. Profiles cover the request
+until its body has been sent; the response says which file it went to in
+X-Profile-File. Only the newest KEEP files are kept.
+
+Requests that aren't profiled pay for a header and a query argument lookup
+and, when a rate is set, a random draw.
+"""
+
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+MODES = ('cprofile', 'sample')
+INTERVAL_MS = float(os.environ.get('EDVANCE_PROFILE_INTERVAL_MS', '5'))
+KEEP = int(os.environ.get('EDVANCE_PROFILE_KEEP', '200'))
+# How often workers look for new settings
+SETTINGS_CHECK_SECONDS = 1.0
+SETTINGS_FILE = 'settings.json'
+DEFAULT_SETTINGS = {'mode': 'sample', 'rate': 0.0, 'endpoints': []}
+
+FILE_PATTERN = re.compile(
+    r'^(?P<at>\d{8}-\d{6})-(?P<endpoint>[\w.]+)-(?P<pid>\d+)-(?P<seq>\d+)\.(?P<ext>pstats|collapsed)$')
+EXTENSIONS = {'cprofile': 'pstats', 'sample': 'collapsed'}
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """`frame`'s stack as a collapsed-stack line, outermost frame first."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    """One thread per process sampling the stacks of the requests being profiled."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def start(self, thread_id):
+        counts = Counter()
+        with self._lock:
+            if self._pid != os.getpid():
+                # Started again in a forked worker
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='profile-sampler', daemon=True).start()
+            self._active[thread_id] = counts
+            self._wake.set()
+        return counts
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                active = list(self._active.items())
+            frames = sys._current_frames()
+            for thread_id, counts in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    counts[collapse(frame)] += 1
+            del frames
+
+
+class Profiler:
+    def __init__(self):
+        self.directory = None
+        self.allowed = None
+        self.sampler = Sampler(INTERVAL_MS / 1000)
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._settings_mtime = None
+        self._checked_at = 0.0
+        # cProfile can't profile two threads at once on every Python version
+        self._cprofile_lock = threading.Lock()
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+
+    def configure(self, directory, allowed):
+        self.directory = directory
+        self.allowed = allowed
+        os.makedirs(directory, exist_ok=True)
+
+    # Settings shared by every worker
+
+    def _settings_path(self):
+        return os.path.join(self.directory, SETTINGS_FILE)
+
+    def refresh_settings(self, force=False):
+        now = time.monotonic()
+        if now - self._checked_at < SETTINGS_CHECK_SECONDS and not force:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._settings_path()).st_mtime_ns
+        except FileNotFoundError:
+            self.settings, self._settings_mtime = dict(DEFAULT_SETTINGS), None
+            return
+        if mtime == self._settings_mtime:
+            return
+        try:
+            with open(self._settings_path(), encoding='utf-8') as f:
+                self.settings = {**DEFAULT_SETTINGS, **json.load(f)}
+            self._settings_mtime = mtime
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read profiling settings: {e}")
+
+    def save_settings(self, settings):
+        path = self._settings_path()
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+        os.replace(temp_path, path)
+        self.settings, self._checked_at = dict(settings), 0.0
+
+    # Per request
+
+    def _requested_mode(self):
+        mode = request.headers.get('X-Profile') or request.args.get('_profile')
+        if mode:
+            # Asking is only honoured for admins, and silently ignored otherwise
+            return mode if mode in MODES and self.allowed() else None
+        self.refresh_settings()
+        rate = self.settings['rate']
+        if rate and random.random() < rate:
+            endpoints = self.settings['endpoints']
+            if not endpoints or request.endpoint in endpoints:
+                return self.settings['mode']
+        return None
+
+    def before_request(self):
+        mode = self._requested_mode()
+        if mode is None:
+            return
+        if mode == 'cprofile':
+            if not self._cprofile_lock.acquire(blocking=False):
+                return
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (a debugger, coverage) owns the hook
+                self._cprofile_lock.release()
+                return
+            g._profile = (mode, profile)
+        else:
+            g._profile = (mode, self.sampler.start(threading.get_ident()))
+
+    def after_request(self, response):
+        active = g.pop('_profile', None)
+        if active is not None:
+            name = self._file_name(active[0])
+            response.headers['X-Profile-File'] = name
+            # Keep profiling until the body has been sent
+            response.call_on_close(lambda: self._finish(active, name))
+        return response
+
+    def teardown_request(self, exc=None):
+        # Requests that never produced a response
+        active = g.pop('_profile', None)
+        if active is not None:
+            self._finish(active, self._file_name(active[0]))
+
+    def _file_name(self, mode):
+        with self._seq_lock:
+            self._seq += 1
+            seq = self._seq
+        endpoint = request.endpoint or 'unmatched'
+        return f'{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{os.getpid()}-{seq}.{EXTENSIONS[mode]}'
+
+    def _finish(self, active, name):
+        mode, profile = active
+        path = os.path.join(self.directory, name)
+        try:
+            if mode == 'cprofile':
+                profile.disable()
+                self._cprofile_lock.release()
+                profile.dump_stats(path)
+            else:
+                counts = self.sampler.stop(threading.get_ident())
+                with open(path, 'w', encoding='utf-8') as f:
+                    for stack, count in counts.most_common():
+                        f.write(f'{stack} {count}\n')
+            self._rotate()
+        except OSError as e:
+            print(f"Warning: Could not write profile {path}: {e}")
+
+    def _rotate(self):
+        names = sorted(name for name in os.listdir(self.directory) if FILE_PATTERN.match(name))
+        for name in names[:-KEEP] if KEEP else ():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    # Admin
+
+    def list_files(self):
+        """Saved profiles, newest first."""
+        files = []
+        for name in os.listdir(self.directory):
+            match = FILE_PATTERN.match(name)
+            if match is None:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            files.append({
+                'name': name,
+                'endpoint': match['endpoint'],
+                'mode': 'cprofile' if match['ext'] == 'pstats' else 'sample',
+                'pid': int(match['pid']),
+                'created_at': datetime.strptime(match['at'], '%Y%m%d-%H%M%S').isoformat(),
+                'size': size,
+            })
+        files.sort(key=lambda f: (f['created_at'], f['name']), reverse=True)
+        return files
+
+    def file_path(self, name):
+        """Path of the saved profile `name`, or None if there is no such profile."""
+        if not FILE_PATTERN.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+profiler = Profiler()
+
+
+def init_app(app, directory, allowed):
+    """Let requests to `app` be profiled into `directory`.
+
+    `allowed()` tells whether the current request may ask to be profiled.
+    """
+    profiler.configure(directory, allowed)
+    app.before_request(profiler.before_request)
+    app.after_request(profiler.after_request)
+    app.teardown_request(profiler.teardown_request)
@@ -0,0 +1,177 @@
+"""
+In-process cache for read-heavy GET endpoints.
+
+@cached(database, *tables) keeps a route's response keyed by path and query
+arguments, stamped with the version counters (versions.py) of the tables
+the route reads. The ETag is derived from the same counters, so a request
+whose If-None-Match still matches gets a 304 before the view, or the
+database, is touched. Write routes bump the counters after committing,
+which retires every cached body and ETag that depended on the table.
+
+Compressed copies of a body (see compress.py) are kept in its entry, so a
+hot response is compressed once per encoding.
+"""
+
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+import compress
+import versions
+
+MAX_BYTES = int(os.environ.get('EDVANCE_RESPONSE_CACHE_BYTES', str(32 * 1024 * 1024)))
+# Bodies larger than this are served with an ETag but not kept
+MAX_ENTRY_BYTES = MAX_BYTES // 8
+
+
+class ResponseCache:
+    """LRU of response bodies bounded by their total size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, stamp, body, content_type):
+        """Cache a body; returns the new entry, or None when it is too large."""
+        if len(body) > MAX_ENTRY_BYTES:
+            return None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= _entry_size(old)
+            entry = (stamp, body, content_type, {})
+            self._entries[key] = entry
+            self.size += len(body)
+            self._evict()
+        return entry
+
+    def add_variant(self, key, entry, encoding, data):
+        """Keep the `encoding` copy of entry's body, if the entry is still cached."""
+        with self._lock:
+            if self._entries.get(key) is not entry or encoding in entry[3]:
+                return
+            entry[3][encoding] = data
+            self.size += len(data)
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _key, evicted = self._entries.popitem(last=False)
+            self.size -= _entry_size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+def _entry_size(entry):
+    return len(entry[1]) + sum(len(data) for data in entry[3].values())
+
+
+cache = ResponseCache(MAX_BYTES)
+
+
+def _buffer(response):
+    """Return the body of `response`, or None if it streams more than MAX_ENTRY_BYTES.
+
+    In that case the chunks read so far are put back in front of the rest.
+    """
+    if not response.is_streamed:
+        return response.get_data()
+    chunks = []
+    size = 0
+    iterator = iter(response.response)
+    for chunk in iterator:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_ENTRY_BYTES:
+            response.response = _resume(chunks, iterator)
+            return None
+    body = b''.join(chunks)
+    response.set_data(body)
+    return body
+
+
+def _resume(chunks, iterator):
+    try:
+        yield from chunks
+        yield from iterator
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+def _etag(key, stamp):
+    return hashlib.blake2b(repr((key, stamp)).encode(), digest_size=12).hexdigest()
+
+
+def cached(database, *tables):
+    """Cache a view's successful GET responses until one of `tables` changes."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or MAX_BYTES <= 0:
+                return view(*args, **kwargs)
+
+            stamp = tuple(versions.current(database, table) for table in tables)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            etag = _etag(key, stamp)
+            # Compressed and plain copies share the version, so either matches
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+            else:
+                entry = cache.get(key, stamp)
+                if entry is None:
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                    body = _buffer(response)
+                    if body is None:
+                        # Too large to cache: keep streaming it
+                        response.set_etag(etag)
+                        response.headers['Cache-Control'] = 'no-cache'
+                        return response
+                    entry = cache.put(key, stamp, body, response.content_type)
+                else:
+                    body = entry[1]
+                    response = current_app.response_class(body, content_type=entry[2])
+                encoding = compress.negotiate(response.mimetype, len(body))
+                response.set_etag(etag, weak=encoding is not None)
+                if encoding is not None:
+                    data = entry[3].get(encoding) if entry is not None else None
+                    if data is None:
+                        data = compress.encode(body, encoding)
+                        if entry is not None:
+                            cache.add_variant(key, entry, encoding, data)
+                    else:
+                        compress.stats.record(encoding, len(body), len(data), cached=True)
+                    response.set_data(data)
+                    response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            # Clients may keep the body but must revalidate it every time
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,81 @@
+"""
+Helpers for the resumable upload API.
+
+A client opens an upload session, PUTs chunks at byte offsets (in any order,
+several at once if it likes), can ask which byte ranges are still missing,
+and finally asks the server to turn the assembled file into a note or video.
+Each chunk is streamed from the request straight into a preallocated
+partial file, so memory use stays at one copy buffer per request.
+"""
+
+import os
+import secrets
+
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+PARTIAL_DIR = os.path.join(UPLOAD_ROOT, '.partial')
+
+MAX_UPLOAD_SIZE = int(os.environ.get('EDVANCE_UPLOAD_MAX_SIZE', str(4 * 1024 ** 3)))
+MAX_CHUNK_SIZE = int(os.environ.get('EDVANCE_UPLOAD_MAX_CHUNK_SIZE', str(32 * 1024 ** 2)))
+RECOMMENDED_CHUNK_SIZE = min(8 * 1024 ** 2, MAX_CHUNK_SIZE)
+COPY_BUFFER_SIZE = 1024 * 1024
+
+NOTE_EXTENSIONS = ('.pdf',)
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.wmv', '.flv', '.webm')
+
+
+def new_session_id():
+    return secrets.token_urlsafe(24)
+
+
+def partial_path(session_id):
+    return os.path.join(PARTIAL_DIR, f'{session_id}.part')
+
+
+def create_partial(session_id, total_size):
+    """Create the (sparse) file that chunks are written into."""
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    path = partial_path(session_id)
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    return path
+
+
+def write_chunk(path, offset, stream, length):
+    """Copy `length` bytes from `stream` into `path` at `offset`; returns bytes written."""
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    return written
+
+
+def coverage(chunks, total_size):
+    """Merge (offset, length) chunks; return (received_bytes, missing ranges).
+
+    Missing ranges are inclusive [start, end] pairs.
+    """
+    received = 0
+    missing = []
+    position = 0
+    for offset, length in sorted(chunks):
+        end = offset + length
+        if offset > position:
+            missing.append([position, offset - 1])
+        if end > position:
+            received += end - max(offset, position)
+            position = end
+    if position < total_size:
+        missing.append([position, total_size - 1])
+    return received, missing
+
+
+def discard_partial(session_id):
+    try:
+        os.remove(partial_path(session_id))
+    except FileNotFoundError:
+        pass
@@ -1,17 +1,64 @@
 #!/usr/bin/env python3
 
+import argparse
 import sys
 import os
 
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-try:
+
+def load_app():
     from app import app
     print("Flask app loaded successfully!")
-    print("Starting server on http://127.0.0.1:5001")
-    app.run(debug=True, host='127.0.0.1', port=5001)
-except Exception as e:
-    print(f"Error loading Flask app: {e}")
-    import traceback
-    traceback.print_exc()
+    return app
+
+
+def parse_args():
+    import prefork
+
+    parser = argparse.ArgumentParser(description='Run the Edvance API server.')
+    parser.add_argument('--production', action='store_true',
+                        default=os.environ.get('EDVANCE_SERVER_MODE') == 'production',
+                        help='serve with pre-forked worker processes instead of the debug server')
+    parser.add_argument('--host', default=os.environ.get('EDVANCE_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('EDVANCE_PORT', '5001')))
+    parser.add_argument('--workers', type=int, default=prefork.WORKERS, help='worker processes')
+    parser.add_argument('--threads', type=int, default=prefork.THREADS, help='concurrent requests per worker')
+    parser.add_argument('--max-requests', type=int, default=prefork.MAX_REQUESTS,
+                        help='restart a worker after this many requests (0: never)')
+    parser.add_argument('--max-memory-mb', type=int, default=prefork.MAX_MEMORY_MB,
+                        help='restart a worker once its resident memory passes this (0: never)')
+    parser.add_argument('--graceful-timeout', type=float, default=prefork.GRACEFUL_TIMEOUT,
+                        help='seconds in-flight requests get to finish on stop, reload or restart')
+    parser.add_argument('--reuse-port', action='store_true',
+                        help='give each worker its own SO_REUSEPORT socket')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # The app locks admin routes down without a token in production
+    if args.production:
+        os.environ['EDVANCE_SERVER_MODE'] = 'production'
+
+    if args.production and hasattr(os, 'fork'):
+        import prefork
+        prefork.serve(load_app, host=args.host, port=args.port, workers=args.workers,
+                      threads=args.threads, max_requests=args.max_requests,
+                      max_memory_mb=args.max_memory_mb, graceful_timeout=args.graceful_timeout,
+                      reuse_port=args.reuse_port)
+        sys.exit(0)
+
+    try:
+        app = load_app()
+        print(f"Starting server on http://{args.host}:{args.port}")
+        if args.production:
+            # No fork() on Windows: one process, one thread per request
+            app.run(host=args.host, port=args.port, threaded=True)
+        else:
+            app.run(debug=True, host=args.host, port=args.port)
+    except Exception as e:
+        print(f"Error loading Flask app: {e}")
+        import traceback
+        traceback.print_exc()
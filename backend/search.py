@@ -0,0 +1,194 @@
+"""
+Full-text search over notes and videos.
+
+The search_index FTS5 table holds topic, subject, standard and file name
+for every note and video (kept in step by triggers on the two tables) plus
+the extracted text of PDF notes, which media workers fill in after upload.
+
+Run `python search.py rebuild` to re-index everything, including the text
+of every PDF, from scratch.
+"""
+
+import html
+import logging
+import os
+import re
+import sys
+
+import blobstore
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+else:
+    # pypdf logs a warning for every font it can't fully decode
+    logging.getLogger('pypdf').setLevel(logging.ERROR)
+
+# Extracted text beyond this is not indexed
+MAX_BODY_CHARS = int(os.environ.get('EDVANCE_SEARCH_MAX_BODY_CHARS', str(1024 * 1024)))
+SNIPPET_TOKENS = 12
+# Ranking costs a couple of microseconds per matching document, so very
+# broad queries rank only this many of the newest matches; search() says
+# when that happened and the API passes it on as `truncated`.
+CANDIDATE_LIMIT = int(os.environ.get('EDVANCE_SEARCH_CANDIDATE_LIMIT', '2000'))
+
+# Control characters that can't appear in indexed text mark the snippet
+# highlights until the snippet has been HTML-escaped.
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+_TERM_RE = re.compile(r'\w+')
+
+
+def note_rowid(note_id):
+    return note_id * 2
+
+
+def extract_pdf_text(path):
+    """Return the text of a PDF, or '' when it has none or pypdf is not installed."""
+    if PdfReader is None:
+        return ''
+    parts = []
+    length = 0
+    reader = PdfReader(path)
+    for page in reader.pages:
+        try:
+            text = page.extract_text() or ''
+        except Exception:
+            # One unreadable page shouldn't lose the rest of the document
+            continue
+        parts.append(text)
+        length += len(text)
+        if length >= MAX_BODY_CHARS:
+            break
+    return '\n'.join(parts)[:MAX_BODY_CHARS].replace('\x00', '')
+
+
+def set_note_body(c, note_id, text):
+    c.execute('UPDATE search_index SET body = ? WHERE rowid = ?', (text, note_rowid(note_id)))
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, the last as a prefix.
+
+    Returns None when the text has no searchable words.
+    """
+    terms = _TERM_RE.findall(query or '')
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _column_filter(column, value):
+    return '{%s} : "%s"' % (column, value.replace('"', '""'))
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and wrap its matches in <mark>."""
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def search(c, expression, standard=None, subject=None, material_type=None, limit=20, after=None):
+    """Return (rows, truncated): up to `limit` + 1 rows matching `expression`, best first.
+
+    Rows are (rowid, rank, material_type, material_id, standard, subject,
+    topic, file_name, uploaded_at, snippet). `after` is the (rank, rowid)
+    of the last row of the previous page. `truncated` says more than
+    CANDIDATE_LIMIT documents matched, so older ones were left out of the
+    ranking and can't be reached by paging.
+    """
+    # Filters also go into the match expression so the index narrows the
+    # candidates before ranking; the equality checks then make them exact.
+    conditions = []
+    params = []
+    for column, value in (('standard', standard), ('subject', subject)):
+        if value:
+            if _TERM_RE.search(value):
+                expression = f'{_column_filter(column, value)} AND ({expression})'
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    conditions[:0] = [
+        'search_index MATCH ?',
+        'rowid >= coalesce((SELECT rowid FROM search_index WHERE search_index MATCH ? '
+        'ORDER BY rowid DESC LIMIT 1 OFFSET ?), 0)',
+    ]
+    params[:0] = [expression, expression, CANDIDATE_LIMIT - 1]
+    if material_type:
+        conditions.append('material_type = ?')
+        params.append(material_type)
+    if after is not None:
+        conditions.append('(rank > ? OR (rank = ? AND rowid > ?))')
+        params.extend([after[0], after[0], after[1]])
+    params.append(limit + 1)
+    c.execute(f'''
+        SELECT rowid, rank, material_type, material_id, standard, subject, topic, file_name, uploaded_at,
+               snippet(search_index, -1, '{_MARK_START}', '{_MARK_END}', '…', {SNIPPET_TOKENS})
+        FROM search_index
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank, rowid
+        LIMIT ?
+    ''', params)
+    rows = c.fetchall()
+    c.execute('SELECT 1 FROM search_index WHERE search_index MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?',
+              (expression, CANDIDATE_LIMIT))
+    return rows, c.fetchone() is not None
+
+
+def rebuild(database):
+    """Re-index every note and video, extracting PDF text again."""
+    from db import connect
+    from migrations import MAIN_MIGRATIONS, migrate
+
+    migrate(database, MAIN_MIGRATIONS)
+    conn = connect(database)
+    c = conn.cursor()
+    c.execute('DELETE FROM search_index')
+    c.execute('''
+        INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                  material_type, material_id, uploaded_at)
+        SELECT id * 2, topic, subject, standard, file_name, '', 'notes', id, uploaded_at FROM uploaded_notes
+    ''')
+    c.execute('''
+        INSERT INTO search_index (rowid, topic, subject, standard, file_name, body,
+                                  material_type, material_id, uploaded_at)
+        SELECT id * 2 + 1, topic, subject, standard, file_name, '', 'videos', id, uploaded_at FROM uploaded_videos
+    ''')
+    conn.commit()
+
+    c.execute('SELECT id, file_path FROM uploaded_notes')
+    notes = c.fetchall()
+    extracted = missing = 0
+    for note_id, file_path in notes:
+        path = blobstore.locate_file(file_path)
+        if path is None:
+            missing += 1
+            continue
+        try:
+            text = extract_pdf_text(path)
+        except Exception as e:
+            print(f"Warning: Could not read {path}: {e}")
+            continue
+        set_note_body(c, note_id, text)
+        conn.commit()
+        extracted += 1
+
+    c.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    return len(notes), extracted, missing
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['rebuild']:
+        os.chdir(blobstore.BACKEND_DIR)
+        database = sys.argv[2] if len(sys.argv) > 2 else 'teacher_profiles.db'
+        if PdfReader is None:
+            print('pypdf is not installed; only titles and file names will be indexed')
+        notes, extracted, missing = rebuild(database)
+        print(f'Indexed text of {extracted} of {notes} notes; {missing} notes point at missing files')
+    else:
+        print('usage: python search.py rebuild [database]')
+        sys.exit(2)
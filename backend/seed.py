@@ -0,0 +1,350 @@
+"""
+Deterministic synthetic data for load tests and benchmarks.
+
+    python seed.py DIRECTORY [--scale 1.0] [--seed 1]
+
+creates the server's database files in DIRECTORY, at the current schema,
+filled with COUNTS rows times `scale`: notes and videos across standards
+and subjects, sponsors, scholarships with a spread of criteria and
+deadlines, and applications whose student_data has the layout the student
+profile form sends. Applications are skewed towards a few popular
+scholarships, as real ones are. Notes and videos point at a handful of
+generated files under DIRECTORY/media, so downloads and range requests
+have something to read.
+
+The same seed and scale always give the same rows; only the media paths
+differ between directories. A seed.json manifest next to the databases
+tells loadtest.py what is in them. Start the server from DIRECTORY to
+serve the data set.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import applicants
+import domains
+from migrations import APPLICATION_MIGRATIONS, MAIN_MIGRATIONS, SPONSORSHIP_MIGRATIONS, STUDENT_MIGRATIONS, migrate
+
+COUNTS = {
+    'notes': 100_000,
+    'videos': 20_000,
+    'sponsors': 1_000,
+    'scholarships': 10_000,
+    'applications': 1_000_000,
+}
+# Distinct files behind the notes and videos, and their sizes
+MEDIA_FILES = 8
+NOTE_FILE_BYTES = 200 * 1024
+VIDEO_FILE_BYTES = 8 * 1024 * 1024
+# Every fifth video is a link rather than an uploaded file
+LINK_VIDEO_EVERY = 5
+CHUNK_ROWS = 10_000
+# Timestamps end here rather than now, so a seed always gives the same rows
+EPOCH = datetime(2026, 6, 30, 18, 0, 0)
+
+STANDARDS = ['6', '7', '8', '9', '10', '11', '12']
+SUBJECTS = {
+    'Mathematics': ['Real Numbers', 'Polynomials', 'Linear Equations', 'Quadratic Equations', 'Arithmetic Progressions',
+                    'Triangles', 'Coordinate Geometry', 'Trigonometry', 'Circles', 'Surface Areas', 'Statistics',
+                    'Probability', 'Matrices', 'Integrals'],
+    'Physics': ['Motion', 'Laws of Motion', 'Gravitation', 'Work and Energy', 'Sound', 'Light Reflection',
+                'Refraction', 'Electricity', 'Magnetic Effects', 'Thermodynamics', 'Waves', 'Semiconductors'],
+    'Chemistry': ['Matter', 'Atoms and Molecules', 'Structure of the Atom', 'Chemical Reactions', 'Acids and Bases',
+                  'Metals and Non-metals', 'Carbon Compounds', 'Periodic Classification', 'Chemical Bonding',
+                  'Equilibrium', 'Electrochemistry'],
+    'Biology': ['The Cell', 'Tissues', 'Life Processes', 'Control and Coordination', 'Reproduction', 'Heredity',
+                'Evolution', 'Ecosystems', 'Human Health', 'Biotechnology'],
+    'English': ['Reading Comprehension', 'Grammar', 'Essay Writing', 'Letter Writing', 'Poetry', 'Prose',
+                'Drama', 'Vocabulary'],
+    'Hindi': ['Vyakaran', 'Nibandh Lekhan', 'Patra Lekhan', 'Kavya', 'Gadya', 'Apathit Gadyansh'],
+    'History': ['French Revolution', 'Nationalism in Europe', 'Nationalism in India', 'Industrialisation',
+                'Print Culture', 'Mughal Empire', 'Harappan Civilisation'],
+    'Geography': ['Resources and Development', 'Water Resources', 'Agriculture', 'Minerals and Energy',
+                  'Manufacturing Industries', 'Climate', 'Natural Vegetation'],
+    'Computer Science': ['Python Basics', 'Data Structures', 'Databases', 'Networking', 'Boolean Logic',
+                         'Algorithms', 'Cyber Safety'],
+    'Economics': ['Development', 'Sectors of the Economy', 'Money and Credit', 'Globalisation', 'Consumer Rights'],
+}
+PARTS = ['Introduction', 'Part 1', 'Part 2', 'Part 3', 'Worked Examples', 'Practice Problems', 'Revision Notes',
+         'Previous Year Questions', 'Summary']
+
+FIRST_NAMES = ['Aarav', 'Aditi', 'Ananya', 'Arjun', 'Diya', 'Ishaan', 'Kavya', 'Kabir', 'Meera', 'Neha',
+               'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Riya', 'Rohan', 'Saanvi', 'Sahil', 'Sneha', 'Tanvi',
+               'Vihaan', 'Vikram', 'Yash', 'Zara', 'Fatima', 'Imran', 'Joseph', 'Maria', 'Harpreet', 'Gurpreet']
+LAST_NAMES = ['Sharma', 'Verma', 'Gupta', 'Singh', 'Kumar', 'Patel', 'Reddy', 'Nair', 'Iyer', 'Das',
+              'Banerjee', 'Mukherjee', 'Khan', 'Joshi', 'Mehta', 'Shah', 'Rao', 'Pillai', 'Yadav', 'Chauhan']
+STATES = {
+    'Maharashtra': ['Mumbai', 'Pune', 'Nagpur', 'Nashik'], 'Karnataka': ['Bengaluru', 'Mysuru', 'Hubballi-Dharwad'],
+    'Tamil Nadu': ['Chennai', 'Coimbatore', 'Madurai'], 'Uttar Pradesh': ['Lucknow', 'Kanpur', 'Varanasi'],
+    'West Bengal': ['Kolkata', 'Durgapur', 'Siliguri'], 'Gujarat': ['Ahmedabad', 'Surat', 'Vadodara'],
+    'Rajasthan': ['Jaipur', 'Jodhpur', 'Udaipur'], 'Kerala': ['Kochi', 'Thiruvananthapuram', 'Kozhikode'],
+    'Bihar': ['Patna', 'Gaya', 'Bhagalpur'], 'Punjab': ['Ludhiana', 'Amritsar', 'Jalandhar'],
+}
+COMPANY_WORDS = ['Bharat', 'Sun', 'Lotus', 'Ganga', 'Everest', 'Sahyadri', 'Indus', 'Kaveri', 'Nilgiri', 'Deccan',
+                 'Vidya', 'Shakti', 'Prakash', 'Navodaya', 'Pragati']
+COMPANY_KINDS = ['Industries', 'Foundation', 'Technologies', 'Trust', 'Finance', 'Pharma', 'Motors', 'Textiles']
+SCHOLARSHIP_KINDS = ['Merit', 'Girls in STEM', 'Rural Talent', 'Need-based', 'Sports', 'Arts', 'First Generation',
+                     'Engineering', 'Medical', 'Excellence']
+# The student profile form's options
+COURSES = ['B.A.', 'B.Sc.', 'B.Com', 'BCA', 'B.Tech', 'B.E.', 'MBBS', 'BDS', 'LLB', 'MBA', 'MCA', 'M.Tech', 'M.Sc.',
+           'M.Com']
+INCOME_RANGES = list(applicants.INCOME_RANGES)
+
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _before_epoch(rng, days):
+    return _timestamp(EPOCH - timedelta(seconds=rng.randrange(days * 86400)))
+
+
+def _write_media(rng, directory):
+    """The files notes and videos point at; returns (note paths, video paths)."""
+    media = os.path.join(directory, 'media')
+    os.makedirs(media, exist_ok=True)
+    notes, videos = [], []
+    for i in range(MEDIA_FILES):
+        path = os.path.join(media, f'note-{i}.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + rng.randbytes(NOTE_FILE_BYTES - 9))
+        notes.append(path)
+        path = os.path.join(media, f'video-{i}.mp4')
+        with open(path, 'wb') as f:
+            f.write(rng.randbytes(VIDEO_FILE_BYTES))
+        videos.append(path)
+    return notes, videos
+
+
+def _material(rng):
+    subject = rng.choice(list(SUBJECTS))
+    topic = f'{rng.choice(SUBJECTS[subject])} - {rng.choice(PARTS)}'
+    return rng.choice(STANDARDS), subject, topic
+
+
+def _file_name(topic, extension):
+    return topic.lower().replace(' - ', '-').replace(' ', '-') + extension
+
+
+def note_rows(rng, count, note_paths):
+    for i in range(count):
+        standard, subject, topic = _material(rng)
+        yield (standard, subject, topic, note_paths[i % len(note_paths)], _file_name(topic, '.pdf'),
+               _before_epoch(rng, 730))
+
+
+def video_rows(rng, count, video_paths):
+    for i in range(1, count + 1):
+        standard, subject, topic = _material(rng)
+        uploaded_at = _before_epoch(rng, 730)
+        if i % LINK_VIDEO_EVERY == 0:
+            url = 'https://www.youtube.com/watch?v=' + ''.join(
+                rng.choices('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-', k=11))
+            yield (standard, subject, topic, 'link', None, url, 'External Video', uploaded_at, 'ready',
+                   None, None, None, None, None)
+        else:
+            yield (standard, subject, topic, 'file', video_paths[i % len(video_paths)], None,
+                   _file_name(topic, '.mp4'), uploaded_at, 'ready', round(rng.uniform(120, 2400), 2),
+                   1280, 720, 2_500_000, VIDEO_FILE_BYTES)
+
+
+def sponsor_rows(rng, count):
+    for i in range(count):
+        company = f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_KINDS)}'
+        gst = f'{rng.randint(1, 37):02d}{"".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=5))}' \
+              f'{rng.randint(1000, 9999)}{rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ")}1Z{rng.randint(0, 9)}'
+        created_at = _before_epoch(rng, 1095)
+        yield (f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', company, gst,
+               round(rng.uniform(1e6, 5e9), 2), created_at, created_at)
+
+
+def scholarship_rows(rng, count, sponsors):
+    for i in range(count):
+        kind = rng.choice(SCHOLARSHIP_KINDS)
+        created_at = _before_epoch(rng, 730)
+        deadline = (EPOCH + timedelta(days=rng.randint(-90, 540))).strftime('%Y-%m-%d')
+        yield (
+            rng.randint(1, sponsors),
+            f'{kind} Scholarship {2026 + i % 3}-{i % 100:02d}',
+            f'{kind} scholarship for students of classes {rng.choice(STANDARDS)} to 12 and undergraduates.',
+            rng.choice([5000, 10000, 15000, 25000, 50000, 75000, 100000, 200000]),
+            'INR',
+            rng.choices([None, 'Any', 'Female', 'Male'], weights=[2, 4, 3, 1])[0],
+            rng.choice([None, None, 100000, 250000, 500000, 800000]),
+            rng.choices([None, 'Any', 'Rural', 'Urban'], weights=[2, 4, 2, 1])[0],
+            rng.choice([None, 50, 60, 70, 75, 80, 85, 90]),
+            deadline,
+            0 if rng.random() < 0.1 else 1,
+            created_at,
+            created_at,
+        )
+
+
+def student_data(rng):
+    """A student profile exactly as the student profile form posts it to /api/student/profile."""
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    personal = {
+        'name': f'{first} {last}',
+        'fatherName': f'{rng.choice(FIRST_NAMES)} {last}',
+        'motherName': f'{rng.choice(FIRST_NAMES)} {last}',
+        'dob': f'{rng.randint(2003, 2012)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        'contact': f'9{rng.randrange(10 ** 9):09d}',
+        'financial': rng.choices(INCOME_RANGES, weights=[25, 35, 20, 13, 7])[0],
+        'parentContact': f'8{rng.randrange(10 ** 9):09d}',
+    }
+    percent = round(min(100, max(35, rng.gauss(72, 12))), 1)
+    if rng.random() < 0.4:
+        academic = {
+            'status': 'College',
+            'collegeName': f'{rng.choice(COMPANY_WORDS)} College',
+            'collegeState': rng.choice(list(STATES)),
+            'collegeCourse': rng.choice(COURSES),
+            'collegeYear': rng.choice(['1st', '2nd', '3rd', '4th']),
+            'class10Perc': str(round(min(100, max(35, percent + rng.uniform(-8, 8))), 1)),
+            'class12Perc': str(percent),
+        }
+    else:
+        academic = {
+            'status': 'School',
+            'schoolName': f'{rng.choice(COMPANY_WORDS)} Public School',
+            'schoolState': rng.choice(list(STATES)),
+            'schoolClass': f'{rng.choice(STANDARDS)}th',
+            'schoolPercent': str(percent),
+            'schoolDesc': rng.choice(['', 'I enjoy science and want to become an engineer.',
+                                      'I like reading and take part in debates.']),
+        }
+    state = rng.choice(list(STATES))
+    residential = {
+        'state': state,
+        'city': rng.choice(STATES[state]),
+        'addressDesc': f'{rng.randint(1, 400)}, {rng.choice(LAST_NAMES)} Nagar',
+        'pincode': f'{rng.randint(110001, 855117)}',
+    }
+    return {'personal': personal, 'academic': academic, 'residential': residential}
+
+
+def application_rows(rng, count, scholarships):
+    # Popular scholarships get most of the applications
+    ids = list(range(1, scholarships + 1))
+    rng.shuffle(ids)
+    total = 0.0
+    cum_weights = []
+    for rank in range(len(ids)):
+        total += 1 / (rank + 1) ** 0.8
+        cum_weights.append(total)
+    for start in range(0, count, CHUNK_ROWS):
+        chosen = rng.choices(ids, cum_weights=cum_weights, k=min(CHUNK_ROWS, count - start))
+        for scholarship_id in chosen:
+            data = student_data(rng)
+            applied = EPOCH - timedelta(seconds=rng.randrange(180 * 86400))
+            status = rng.choices(['pending', 'rejected', 'accepted'], weights=[70, 20, 10])[0]
+            reviewed_at = None if status == 'pending' else _timestamp(applied + timedelta(days=rng.randint(1, 20)))
+            yield (scholarship_id, json.dumps(data), rng.choice(['', 'I would be grateful for this support.',
+                                                                 'Please consider my application.']),
+                   status, _timestamp(applied), reviewed_at) + applicants.column_values(data)
+
+
+def _insert(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == CHUNK_ROWS:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+    conn.commit()
+
+
+def _bulk_connection(path):
+    conn = sqlite3.connect(path)
+    # A half-written data set is simply generated again
+    conn.execute('PRAGMA synchronous = OFF')
+    return conn
+
+
+def seed(directory, scale=1.0, seed_value=1):
+    """Generate a data set in `directory`; returns the manifest."""
+    database = os.path.join(directory, 'teacher_profiles.db')
+    if os.path.exists(database):
+        raise FileExistsError(f'{directory} already has a data set')
+    os.makedirs(directory, exist_ok=True)
+    sponsorship, applications = domains.paths(database)
+    migrate(database, MAIN_MIGRATIONS)
+    migrate(sponsorship, SPONSORSHIP_MIGRATIONS)
+    migrate(applications, APPLICATION_MIGRATIONS)
+    migrate(os.path.join(directory, 'student_profiles.db'), STUDENT_MIGRATIONS)
+
+    counts = {name: max(1, int(count * scale)) for name, count in COUNTS.items()}
+    # One generator per table, so changing one table's count leaves the others alone
+    rng = {name: random.Random(f'{seed_value}-{name}') for name in (*COUNTS, 'media')}
+    note_paths, video_paths = _write_media(rng['media'], directory)
+
+    conn = _bulk_connection(database)
+    _insert(conn, 'INSERT INTO uploaded_notes (standard, subject, topic, file_path, file_name, uploaded_at) '
+                  'VALUES (?, ?, ?, ?, ?, ?)', note_rows(rng['notes'], counts['notes'], note_paths))
+    _insert(conn, 'INSERT INTO uploaded_videos (standard, subject, topic, video_type, file_path, video_url, '
+                  'file_name, uploaded_at, processing_status, duration_seconds, width, height, bitrate, size_bytes) '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            video_rows(rng['videos'], counts['videos'], video_paths))
+    conn.close()
+
+    conn = _bulk_connection(sponsorship)
+    _insert(conn, 'INSERT INTO sponsor_profiles (name, company_name, gst_number, annual_turnover, created_at, '
+                  'updated_at) VALUES (?, ?, ?, ?, ?, ?)', sponsor_rows(rng['sponsors'], counts['sponsors']))
+    _insert(conn, 'INSERT INTO scholarships (sponsor_id, title, description, amount, currency, gender_criteria, '
+                  'family_income_max, location_type, min_academic_percentage, application_deadline, is_active, '
+                  'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            scholarship_rows(rng['scholarships'], counts['scholarships'], counts['sponsors']))
+    active = [row[0] for row in conn.execute('SELECT id FROM scholarships WHERE is_active = 1 ORDER BY id')]
+    conn.close()
+
+    conn = _bulk_connection(applications)
+    columns = ', '.join(applicants.COLUMNS)
+    _insert(conn, 'INSERT INTO scholarship_applications (scholarship_id, student_data, application_message, '
+                  f'status, applied_at, reviewed_at, {columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            application_rows(rng['applications'], counts['applications'], counts['scholarships']))
+    conn.close()
+
+    for path in (database, sponsorship, applications):
+        conn = sqlite3.connect(path)
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.close()
+
+    manifest = {
+        'seed': seed_value,
+        'scale': scale,
+        'counts': counts,
+        'standards': STANDARDS,
+        'subjects': list(SUBJECTS),
+        'topics': sorted({topic for topics in SUBJECTS.values() for topic in topics}),
+        'link_video_every': LINK_VIDEO_EVERY,
+        'video_file_bytes': VIDEO_FILE_BYTES,
+        'active_scholarships': active,
+    }
+    with open(os.path.join(directory, 'seed.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic data set for load tests.')
+    parser.add_argument('directory')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply every row count by this')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    started = time.monotonic()
+    try:
+        manifest = seed(args.directory, args.scale, args.seed)
+    except FileExistsError as e:
+        print(e)
+        sys.exit(1)
+    rows = ', '.join(f'{count} {name}' for name, count in manifest['counts'].items())
+    print(f'Seeded {rows} into {args.directory} in {time.monotonic() - started:.0f}s')
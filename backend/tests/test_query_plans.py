@@ -0,0 +1,24 @@
+"""Every hot query in migrations.QUERY_PLAN_EXPECTATIONS is served from its index."""
+
+import pytest
+
+from db import connect
+from migrations import QUERY_PLAN_EXPECTATIONS, query_plan_problems, scratch_databases
+
+CASES = [(schema, expectation) for schema, expectations in QUERY_PLAN_EXPECTATIONS.items()
+         for expectation in expectations]
+
+
+@pytest.fixture(scope='module')
+def databases(tmp_path_factory):
+    return scratch_databases(str(tmp_path_factory.mktemp('schema')))
+
+
+@pytest.mark.parametrize('schema, expectation', CASES, ids=[expectation[0] for _schema, expectation in CASES])
+def test_query_uses_index(databases, schema, expectation):
+    path, attached = databases[schema]
+    conn = connect(path, attached)
+    try:
+        assert query_plan_problems(conn, [expectation]) == []
+    finally:
+        conn.close()
@@ -0,0 +1,88 @@
+"""
+Change counters shared by every server process.
+
+Each name gets an 8-byte slot in a small memory-mapped file next to the
+database (`<database>-versions`). Routes call bump() after committing a
+change; anything that keeps a derived copy of the data in memory compares
+the counter it last saw with current(), which reads shared memory and never
+touches SQLite.
+
+Counters are seeded from the clock, so they never repeat even if the file
+is deleted while processes are running.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows runs a single server process; the thread lock is enough
+    fcntl = None
+
+# Append only: a name's position is its slot in the file
+NAMES = (
+    'scholarships',
+    'uploaded_notes',
+    'uploaded_videos',
+    'teacher_profile',
+)
+
+_SLOT = struct.Struct('<Q')
+FILE_SIZE = 4096
+
+
+class Counters:
+    """The counter file for one database."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < FILE_SIZE:
+            os.ftruncate(self._fd, FILE_SIZE)
+        self._map = mmap.mmap(self._fd, FILE_SIZE)
+
+    def current(self, name):
+        return _SLOT.unpack_from(self._map, NAMES.index(name) * _SLOT.size)[0]
+
+    def bump(self, name):
+        offset = NAMES.index(name) * _SLOT.size
+        with self._lock:
+            if fcntl is not None:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                value = max(_SLOT.unpack_from(self._map, offset)[0] + 1, time.time_ns())
+                _SLOT.pack_into(self._map, offset, value)
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return value
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counters(database):
+    counters = _counters.get(database)
+    if counters is None:
+        with _counters_lock:
+            counters = _counters.get(database)
+            if counters is None:
+                counters = _counters[database] = Counters(f'{database}-versions')
+    return counters
+
+
+def current(database, name):
+    return get_counters(database).current(name)
+
+
+def bump(database, *names):
+    """Mark `names` as changed; call after the change has been committed."""
+    counters = get_counters(database)
+    for name in names:
+        counters.bump(name)